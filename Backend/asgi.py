@@ -0,0 +1,8 @@
+# asgi.py
+# Production ASGI entry point: the routes from main.py served by Quart on a single event loop.
+#   hypercorn asgi:app --bind 0.0.0.0:3446 [--workers 4]
+import os
+
+os.environ.setdefault('CANDY_SERVER', 'asgi')
+
+from main import app
@@ -0,0 +1,262 @@
+# backup.py
+# Snapshots of CandyPanel.db and the WireGuard directory (wgN.conf plus server keys).
+# The database is copied online with SQLite's backup API a few pages at a time, so API writers never wait on it.
+# Every file is stored once, gzip-compressed, under objects/<sha256>; each snapshot is a small JSON manifest
+# in snapshots/, so unchanged configs cost nothing. Old snapshots are pruned and unreferenced objects removed.
+#
+#   python3 backup.py list
+#   python3 backup.py create
+#   python3 backup.py restore <snapshot id | latest> [--only db|configs]
+# _sync takes a snapshot every 'backup_interval' minutes while 'auto_backup' is on, keeping 'backup_keep' of them.
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import nullcontext
+from datetime import datetime
+import metrics
+
+BACKUP_PAGES = 256 # Database pages copied per step
+BACKUP_STEP_SLEEP = 0.005 # Seconds between steps, leaving the CPU and the database to request handlers
+BACKUP_MAX_RESTARTS = 3 # Writes from other connections restart a paged copy; after this many, copy in one step
+CHUNK_SIZE = 1024 * 1024
+WG_FILE_RE = re.compile(r"^(?:wg(\d+)\.conf|server_(?:private|public)_wg(\d+)\.key)$")
+
+def backup_dir_for(db_path: str) -> str:
+    return os.environ.get('CANDY_BACKUP_DIR', os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups'))
+
+class _Restarted(Exception):
+    pass
+
+def _private_dir(path: str):
+    """
+    Creates 'path' readable by the owner only: snapshots hold the server private keys and the database.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700) # makedirs leaves an existing directory's mode alone
+
+def _open_private(path: str, mode: str):
+    """
+    Opens 'path' for writing, created (or truncated) with mode 0600 whatever the umask.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600) # An existing file keeps its mode through os.open
+    return os.fdopen(fd, mode)
+
+def _copy_database(db_path: str, target_path: str):
+    """
+    Copies the live database into 'target_path' with the online backup API, BACKUP_PAGES pages per step.
+    """
+    source = sqlite3.connect(db_path, timeout=30)
+    target = sqlite3.connect(target_path)
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1 # Another connection wrote to the source and SQLite started over
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _Restarted()
+        last_remaining = remaining
+        time.sleep(BACKUP_STEP_SLEEP)
+
+    try:
+        try:
+            source.backup(target, pages=BACKUP_PAGES, progress=progress)
+        except _Restarted:
+            # Busy database: one step holds a read transaction for the whole copy, which WAL lets writers work around
+            print(f"[!] Database backup restarted {restarts} times; copying it in one step.")
+            source.backup(target, pages=-1)
+    finally:
+        target.close()
+        source.close()
+
+def _store(backup_dir: str, path: str) -> dict:
+    """
+    Adds a file to the object store unless identical content is already there; returns its manifest entry.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    sha256 = digest.hexdigest()
+    object_path = os.path.join(backup_dir, 'objects', sha256[:2], f"{sha256}.gz")
+    if not os.path.exists(object_path):
+        _private_dir(os.path.dirname(object_path))
+        with open(path, 'rb') as src, _open_private(f"{object_path}.tmp", 'wb') as raw, \
+                gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        os.replace(f"{object_path}.tmp", object_path)
+    return {'sha256': sha256, 'size': os.path.getsize(path), 'stored': os.path.getsize(object_path)}
+
+def create_snapshot(db_path: str, wg_dir: str, backup_dir: str = None, interface_lock=None) -> dict:
+    """
+    Takes a snapshot of the database and WireGuard files and returns its manifest.
+    'interface_lock(wg_id)', when given, is held while that interface's files are read.
+    """
+    backup_dir = backup_dir or backup_dir_for(db_path)
+    for path in (backup_dir, os.path.join(backup_dir, 'objects'), os.path.join(backup_dir, 'snapshots')):
+        _private_dir(path)
+    start = time.perf_counter()
+    files = {}
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        db_copy = os.path.join(tmp, 'CandyPanel.db')
+        _copy_database(db_path, db_copy)
+        files['CandyPanel.db'] = _store(backup_dir, db_copy)
+
+        for name in sorted(os.listdir(wg_dir)) if os.path.isdir(wg_dir) else []:
+            match = WG_FILE_RE.match(name)
+            if not match:
+                continue
+            wg_id = int(match.group(1) or match.group(2))
+            # Copy under the interface lock, then hash and compress without holding it
+            copy = os.path.join(tmp, name)
+            with interface_lock(wg_id) if interface_lock else nullcontext():
+                shutil.copy(os.path.join(wg_dir, name), copy)
+            files[f"wireguard/{name}"] = _store(backup_dir, copy)
+
+    now = datetime.now()
+    snapshot_id = now.strftime('%Y%m%dT%H%M%S')
+    path = os.path.join(backup_dir, 'snapshots', f"{snapshot_id}.json")
+    if os.path.exists(path): # Two snapshots within a second
+        snapshot_id = now.strftime('%Y%m%dT%H%M%S.%f')
+        path = os.path.join(backup_dir, 'snapshots', f"{snapshot_id}.json")
+    manifest = {'id': snapshot_id, 'created_at': now.isoformat(), 'files': files}
+    with _open_private(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+    elapsed = time.perf_counter() - start
+    metrics.BACKUP_SECONDS.observe(elapsed)
+    metrics.BACKUP_LAST_SUCCESS.set(time.time())
+    print(f"[+] Backup {snapshot_id}: {len(files)} files, "
+          f"{sum(entry['size'] for entry in files.values()) / 1024:.0f} KiB in {elapsed:.2f}s.")
+    return manifest
+
+def list_snapshots(backup_dir: str) -> list[dict]:
+    """
+    Returns every snapshot manifest, oldest first.
+    """
+    snapshots_dir = os.path.join(backup_dir, 'snapshots')
+    manifests = []
+    for name in sorted(os.listdir(snapshots_dir)) if os.path.isdir(snapshots_dir) else []:
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(snapshots_dir, name)) as f:
+                    manifests.append(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"[!] Skipping unreadable backup manifest {name}: {e}")
+    return sorted(manifests, key=lambda manifest: manifest['created_at'])
+
+def snapshot_due(backup_dir: str, interval_minutes: float) -> bool:
+    snapshots = list_snapshots(backup_dir)
+    if not snapshots:
+        return True
+    return (datetime.now() - datetime.fromisoformat(snapshots[-1]['created_at'])).total_seconds() >= interval_minutes * 60
+
+def prune(backup_dir: str, keep: int) -> int:
+    """
+    Keeps the newest 'keep' snapshots and deletes objects no remaining snapshot uses. Returns snapshots removed.
+    """
+    snapshots = list_snapshots(backup_dir)
+    removed = snapshots[:-keep] if keep > 0 else []
+    for manifest in removed:
+        os.remove(os.path.join(backup_dir, 'snapshots', f"{manifest['id']}.json"))
+    referenced = {entry['sha256'] for manifest in snapshots[len(removed):] for entry in manifest['files'].values()}
+    objects_dir = os.path.join(backup_dir, 'objects')
+    for root, _, names in os.walk(objects_dir):
+        for name in names:
+            if name.endswith('.gz') and name[:-3] not in referenced:
+                os.remove(os.path.join(root, name))
+    return len(removed)
+
+def _extract(backup_dir: str, entry: dict, target_path: str):
+    """
+    Decompresses an object to 'target_path' and checks it against the manifest's hash.
+    """
+    object_path = os.path.join(backup_dir, 'objects', entry['sha256'][:2], f"{entry['sha256']}.gz")
+    digest = hashlib.sha256()
+    with gzip.open(object_path, 'rb') as src, open(target_path, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            dst.write(chunk)
+    if digest.hexdigest() != entry['sha256']:
+        raise ValueError(f"Backup object {entry['sha256']} is corrupt.")
+
+def restore(panel, snapshot_id: str, wg_dir: str, backup_dir: str = None, database: bool = True, configs: bool = True) -> dict:
+    """
+    Restores a snapshot into the running installation: the database through the backup API (so open
+    connections see the restored data) and the WireGuard files atomically, each under its interface lock.
+    """
+    backup_dir = backup_dir or backup_dir_for(panel.db.db_path)
+    snapshots = list_snapshots(backup_dir)
+    if not snapshots:
+        raise ValueError(f"No backups in {backup_dir}.")
+    manifest = snapshots[-1] if snapshot_id == 'latest' else next((m for m in snapshots if m['id'] == snapshot_id), None)
+    if manifest is None:
+        raise ValueError(f"Backup '{snapshot_id}' not found.")
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        if database:
+            db_copy = os.path.join(tmp, 'CandyPanel.db')
+            _extract(backup_dir, manifest['files']['CandyPanel.db'], db_copy)
+            live_generations = panel.db.generations()
+            source = sqlite3.connect(db_copy)
+            try:
+                with panel.db._lock:
+                    source.backup(panel.db.conn)
+            finally:
+                source.close()
+            # Move every cache generation past both timelines, so all processes drop what they cached
+            restored = panel.db.generations()
+            for scope in set(live_generations) | set(restored):
+                panel.db._execute_query("UPDATE `cache_generation` SET `generation` = ? WHERE `scope` = ?",
+                                        (max(live_generations.get(scope, 0), restored.get(scope, 0)) + 1, scope))
+            print(f"[+] Database restored from backup {manifest['id']}.")
+        if configs:
+            for key, entry in manifest['files'].items():
+                if not key.startswith('wireguard/'):
+                    continue
+                name = key.split('/', 1)[1]
+                match = WG_FILE_RE.match(name)
+                if not match:
+                    continue
+                staged = os.path.join(tmp, name)
+                _extract(backup_dir, entry, staged)
+                target = os.path.join(wg_dir, name)
+                with panel._locks.hold(int(match.group(1) or match.group(2))):
+                    shutil.copy(staged, f"{target}.restore")
+                    os.chmod(f"{target}.restore", 0o600)
+                    os.replace(f"{target}.restore", target)
+            print(f"[+] WireGuard files restored from backup {manifest['id']}. "
+                  "Reload the interfaces (e.g. edit and save them in the panel) to apply them.")
+    return manifest
+
+if __name__ == '__main__':
+    import core
+    parser = argparse.ArgumentParser(description="CandyPanel backups")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="List snapshots")
+    commands.add_parser('create', help="Take a snapshot now")
+    restore_parser = commands.add_parser('restore', help="Restore a snapshot into this installation")
+    restore_parser.add_argument('snapshot', help="Snapshot id from 'list', or 'latest'")
+    restore_parser.add_argument('--only', choices=('db', 'configs'))
+    args = parser.parse_args()
+
+    panel = core.CandyPanel()
+    backups = backup_dir_for(panel.db.db_path)
+    if args.command == 'list':
+        for manifest in list_snapshots(backups):
+            stored = sum(entry['stored'] for entry in manifest['files'].values())
+            print(f"{manifest['id']}  {len(manifest['files'])} files  {stored / 1024:.0f} KiB compressed")
+    elif args.command == 'create':
+        create_snapshot(panel.db.db_path, core.WG_DIR, backups, panel._locks.hold)
+    else:
+        restore(panel, args.snapshot, core.WG_DIR, backups, database=args.only != 'configs', configs=args.only != 'db')
+    panel.db.close()
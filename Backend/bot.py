@@ -3,6 +3,7 @@ import httpx
 import json
 import os
 import re
+import metrics
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
 
@@ -104,6 +105,22 @@ LANGUAGES = {
                                   "Example: `/broadcast Server maintenance tonight.`",
         "admin_broadcast_sent": "Broadcast sent to {sent_count} users.",
         "admin_error_broadcast": "Error preparing broadcast: {message}. Please try again later.",
+        "admin_forecast_title": "⏳ **Clients running out within {hours:g} hours:** {count} of {examined} "
+                                "(as of `{generated_at}`)\n\n",
+        "admin_forecast_item": "`{name}`: {reason} `{runs_out_at}`\nUsed `{used_gb:.2f}` of `{quota_gb}` GB, "
+                               "`{rate_mb_h:.1f}` MB/hour{user}\n\n",
+        "admin_forecast_traffic": "traffic runs out",
+        "admin_forecast_expiry": "expires",
+        "admin_forecast_user": ", bot user `{telegram_id}`",
+        "admin_forecast_none": "No clients are forecast to run out within {hours:g} hours.",
+        "admin_error_forecast": "Error fetching the forecast: {message}",
+        "admin_top_rate": "🔥 **Top {count} clients by current speed:**\n\n",
+        "admin_top_hour": "🔥 **Top {count} clients by usage in the last hour** (since `{since}`):\n\n",
+        "admin_top_day": "🔥 **Top {count} clients by usage in the last day** (since `{since}`):\n\n",
+        "admin_top_rate_item": "{rank}. `{name}`: ↓ `{download_mbps:.2f}` ↑ `{upload_mbps:.2f}` Mbps\n",
+        "admin_top_usage_item": "{rank}. `{name}`: `{used_gb:.2f} GB`\n",
+        "admin_top_none": "No traffic recorded for that window yet.",
+        "admin_error_top": "Error fetching top clients: {message}",
         "admin_server_control_info": "⚙️ **Server Control Options (via CandyPanel API):**\n"
                                      "Use the following commands:\n\n"
                                      "**Clients:**\n"
@@ -119,6 +136,10 @@ LANGUAGES = {
                                      "`/cp_change_setting <key> <value>`\n\n"
                                      "**Sync:**\n"
                                      "`/cp_trigger_sync`\n\n"
+                                     "**Forecast:**\n"
+                                     "`/forecast [hours]`\n\n"
+                                     "**Top Clients:**\n"
+                                     "`/top [rate|hour|day] [count]`\n\n"
                                      "**Example:** `/cp_new_client testuser 2025-12-31T23:59:59 10737418240 0 This is a test` (10GB traffic)",
         "cmd_usage_error": "Usage: `{command_name} {expected_args}`",
         "invalid_id_format": "Invalid ID format. Must be an integer.",
@@ -242,6 +263,22 @@ LANGUAGES = {
                                   "مثال: `/broadcast سرور امشب برای نگهداری از دسترس خارج می‌شود.`",
         "admin_broadcast_sent": "پیام برای {sent_count} کاربر ارسال شد.",
         "admin_error_broadcast": "خطا در آماده‌سازی پیام: {message}. لطفا دوباره تلاش کنید.",
+        "admin_forecast_title": "⏳ **کلاینت‌هایی که تا {hours:g} ساعت آینده تمام می‌شوند:** {count} از {examined} "
+                                "(تا `{generated_at}`)\n\n",
+        "admin_forecast_item": "`{name}`: {reason} `{runs_out_at}`\nمصرف `{used_gb:.2f}` از `{quota_gb}` GB، "
+                               "`{rate_mb_h:.1f}` MB در ساعت{user}\n\n",
+        "admin_forecast_traffic": "اتمام ترافیک",
+        "admin_forecast_expiry": "انقضا",
+        "admin_forecast_user": "، کاربر ربات `{telegram_id}`",
+        "admin_forecast_none": "هیچ کلاینتی تا {hours:g} ساعت آینده تمام نمی‌شود.",
+        "admin_error_forecast": "خطا در دریافت پیش‌بینی: {message}",
+        "admin_top_rate": "🔥 **{count} کلاینت پرمصرف بر اساس سرعت فعلی:**\n\n",
+        "admin_top_hour": "🔥 **{count} کلاینت پرمصرف در یک ساعت گذشته** (از `{since}`):\n\n",
+        "admin_top_day": "🔥 **{count} کلاینت پرمصرف در یک روز گذشته** (از `{since}`):\n\n",
+        "admin_top_rate_item": "{rank}. `{name}`: ↓ `{download_mbps:.2f}` ↑ `{upload_mbps:.2f}` Mbps\n",
+        "admin_top_usage_item": "{rank}. `{name}`: `{used_gb:.2f} GB`\n",
+        "admin_top_none": "هنوز ترافیکی برای این بازه ثبت نشده است.",
+        "admin_error_top": "خطا در دریافت کلاینت‌های پرمصرف: {message}",
         "admin_server_control_info": "⚙️ **گزینه‌های کنترل سرور (از طریق API CandyPanel):**\n"
                                      "از دستورات زیر استفاده کنید:\n\n"
                                      "**کلاینت‌ها:**\n"
@@ -257,6 +294,10 @@ LANGUAGES = {
                                      "`/cp_change_setting <کلید> <مقدار>`\n\n"
                                      "**همگام‌سازی:**\n"
                                      "`/cp_trigger_sync`\n\n"
+                                     "**پیش‌بینی:**\n"
+                                     "`/forecast [ساعت]`\n\n"
+                                     "**کلاینت‌های پرمصرف:**\n"
+                                     "`/top [rate|hour|day] [تعداد]`\n\n"
                                      "**مثال:** `/cp_new_client testuser 2025-12-31T23:59:59 10737418240 0 این یک تست است` (10 گیگابایت ترافیک)",
         "cmd_usage_error": "نحوه استفاده: `{command_name} {expected_args}`",
         "invalid_id_format": "قالب شناسه نامعتبر است. باید عدد صحیح باشد.",
@@ -306,20 +347,27 @@ user_states = {} # {telegram_id: {"step": "await_amount_type" | "await_quantity"
 # --- Helper Functions for API Calls ---
 async def call_unified_api(endpoint: str, payload: dict):
     """Makes an asynchronous POST request to the unified API."""
+    start, outcome = time.perf_counter(), 'ok'
     try:
         async with httpx.AsyncClient() as client:
             response = await client.post(f"{UNIFIED_API_URL}{endpoint}", json=payload, timeout=30)
             response.raise_for_status() # Raise an exception for 4xx/5xx responses
             return response.json()
     except httpx.HTTPStatusError as e:
+        outcome = 'http_error'
         print(f"[-] HTTP error calling unified API {endpoint}: {e.response.status_code} - {e.response.text}")
         return {"success": False, "message": e.response.text} # Return only the text for better parsing
     except httpx.RequestError as e:
+        outcome = 'network_error'
         print(f"[-] Network error calling unified API {endpoint}: {e}")
         return {"success": False, "message": f"Network error: {e}"}
     except Exception as e:
+        outcome = 'error'
         print(f"[-] Unexpected error calling unified API {endpoint}: {e}")
         return {"success": False, "message": f"Unexpected error: {e}"}
+    finally:
+        metrics.BOT_API_SECONDS.observe(time.perf_counter() - start, endpoint, outcome)
+        metrics.REGISTRY.flush('bot', min_interval=15) # At most one snapshot write per 15 s
 
 def get_bot_token_api_from_unified_api():
     """Fetches the bot token from the unified API's settings."""
@@ -327,12 +375,13 @@ def get_bot_token_api_from_unified_api():
         # Import here to avoid circular dependency
         from db import SQLite
         db = SQLite()
-        token_setting = db.get('settings', where={'key': 'telegram_bot_token'})
-        api_id = db.get('settings', where={'key': 'telegram_api_id'})
-        api_hash = db.get('settings', where={'key': 'telegram_api_hash'})
-        return (token_setting['value'] if token_setting else None,
-                api_id['value'] if api_id else None,
-                api_hash['value'] if api_hash else None)
+        try:
+            keys = ('telegram_bot_token', 'telegram_api_id', 'telegram_api_hash')
+            rows = db.query("SELECT `key`, `value` FROM `settings` WHERE `key` IN (?, ?, ?)", keys)
+        finally:
+            db.close()
+        settings = {row['key']: row['value'] for row in rows}
+        return tuple(settings.get(key) for key in keys)
     except Exception as e:
         print(f"Error fetching bot token from unified API: {e}")
         return None, None, None
@@ -438,6 +487,12 @@ async def handle_all_messages(client: Client, message: Message):
     elif text.startswith("/broadcast"):
         await admin_broadcast_command(client, message)
         return
+    elif text.startswith("/forecast"):
+        await admin_forecast_command(client, message)
+        return
+    elif text.startswith("/top"):
+        await admin_top_command(client, message)
+        return
     elif text.startswith("/cp_"): # Catch all CandyPanel API commands
         await handle_cp_command(client, message)
         return
@@ -1113,6 +1168,77 @@ async def admin_broadcast_command(client: Client, message: Message):
         await message.reply_text(_(telegram_id, "admin_error_broadcast", message=response.get('message', 'Unknown error')))
 
 
+async def admin_forecast_command(client: Client, message: Message):
+    telegram_id = message.from_user.id
+    is_admin_resp = await call_unified_api("/bot_api/admin/check_admin", {"telegram_id": telegram_id})
+    if not is_admin_resp.get('data', {}).get('is_admin', False):
+        await message.reply_text(_(telegram_id, "admin_unauthorized"))
+        return
+
+    args = message.text.split()
+    try:
+        hours = float(args[1]) if len(args) > 1 else 24
+    except ValueError:
+        await message.reply_text(_(telegram_id, "cmd_usage_error", command_name="/forecast", expected_args="[hours]"))
+        return
+
+    response = await call_unified_api("/bot_api/admin/forecast", {"telegram_id": telegram_id, "hours": hours, "limit": 20})
+    if not response.get('success'):
+        await message.reply_text(_(telegram_id, "admin_error_forecast", message=response.get('message', 'Unknown error')))
+        return
+
+    forecast = response['data']
+    if not forecast['clients']:
+        await message.reply_text(_(telegram_id, "admin_forecast_none", hours=forecast['hours']))
+        return
+    # Bot users among them can be offered more traffic or time before they are cut off
+    forecast_text = _(telegram_id, "admin_forecast_title", hours=forecast['hours'], count=forecast['count'],
+                      examined=forecast['clients_examined'], generated_at=forecast['generated_at'])
+    for item in forecast['clients']:
+        forecast_text += _(telegram_id, "admin_forecast_item",
+                           name=item['name'],
+                           reason=_(telegram_id, f"admin_forecast_{item['reason']}"),
+                           runs_out_at=item['runs_out_at'].replace('T', ' '),
+                           used_gb=item['used'] / (1024**3),
+                           quota_gb=f"{item['quota'] / (1024**3):.2f}" if item['quota'] else "∞",
+                           rate_mb_h=(item['rate'] or 0) * 3600 / (1024**2),
+                           user=_(telegram_id, "admin_forecast_user", telegram_id=item['telegram_id']) if item['telegram_id'] else "")
+    await message.reply_text(forecast_text)
+
+
+async def admin_top_command(client: Client, message: Message):
+    telegram_id = message.from_user.id
+    is_admin_resp = await call_unified_api("/bot_api/admin/check_admin", {"telegram_id": telegram_id})
+    if not is_admin_resp.get('data', {}).get('is_admin', False):
+        await message.reply_text(_(telegram_id, "admin_unauthorized"))
+        return
+
+    args = message.text.split()
+    by = args[1].lower() if len(args) > 1 else 'rate'
+    if by not in ('rate', 'hour', 'day') or (len(args) > 2 and not args[2].isdigit()):
+        await message.reply_text(_(telegram_id, "cmd_usage_error", command_name="/top", expected_args="[rate|hour|day] [count]"))
+        return
+
+    response = await call_unified_api("/bot_api/admin/top", {"telegram_id": telegram_id, "by": by,
+                                                              "n": int(args[2]) if len(args) > 2 else 10})
+    if not response.get('success'):
+        await message.reply_text(_(telegram_id, "admin_error_top", message=response.get('message', 'Unknown error')))
+        return
+
+    top = response['data']
+    if not top['clients']:
+        await message.reply_text(_(telegram_id, "admin_top_none"))
+        return
+    top_text = _(telegram_id, f"admin_top_{by}", count=len(top['clients']), since=(top.get('since') or '').replace('T', ' '))
+    for rank, item in enumerate(top['clients'], 1):
+        if by == 'rate':
+            top_text += _(telegram_id, "admin_top_rate_item", rank=rank, name=item['name'],
+                          download_mbps=item['download_bps'] / 10**6, upload_mbps=item['upload_bps'] / 10**6)
+        else:
+            top_text += _(telegram_id, "admin_top_usage_item", rank=rank, name=item['name'], used_gb=item['bytes'] / (1024**3))
+    await message.reply_text(top_text)
+
+
 # --- CandyPanel API Passthrough Commands (Admin Only) ---
 async def handle_cp_command(client: Client, message: Message):
     telegram_id = message.from_user.id
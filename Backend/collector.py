@@ -0,0 +1,428 @@
+# collector.py
+# Write-behind traffic collector. Reads `wg show dump` every COLLECTOR_INTERVAL seconds and keeps each
+# client's counters in memory, writing them to `clients` in one batch every COLLECTOR_FLUSH_SECONDS and on stop,
+# so sub-minute polling doesn't mean one SQLite write per client per tick. Quotas are checked against the
+# in-memory totals, so a client over its limit is disabled within one poll instead of at the next cron run.
+# Between full polls, clients within 'quota_watch_margin' of their limit are watched every 'quota_watch_interval'
+# seconds (both in settings): only their interfaces are read, and only their counters are updated.
+#
+# main.py runs it as a daemon thread when CANDY_COLLECTOR_INTERVAL > 0; it can also run on its own:
+#   python3 collector.py [--interval 10] [--flush 60]
+# Only one process collects at a time (flock on collector.lock next to the database); the others stand by
+# and take over if it exits. While its heartbeat is fresh, cron's _sync skips its own traffic phase.
+# Unflushed counters are never lost: last_wg_rx/tx are flushed with them, so whoever reads the kernel
+# counters next (a restarted collector or _sync) counts the difference.
+# Each poll also feeds the in-memory rate rings (rates.py) behind live_rates() and client_rate(), and full polls
+# the usage buckets (talkers.py) behind top(); neither is written to the database. Standby processes (the other
+# API workers) answer those from collector.live.json, which the active collector rewrites after every full poll
+# while a standby has asked within SNAPSHOT_WANTED_SECONDS (each ask touches collector.live.wanted).
+import argparse
+import fcntl
+import heapq
+import json
+import os
+import threading
+import time
+import metrics
+from models import Client
+from rates import PeerRates
+from talkers import TopTalkers, TOP_KEEP
+
+COLLECTOR_INTERVAL = float(os.environ.get('CANDY_COLLECTOR_INTERVAL', '0')) # Seconds between polls; 0 leaves traffic to cron
+COLLECTOR_FLUSH_SECONDS = float(os.environ.get('CANDY_COLLECTOR_FLUSH', '60')) # Seconds between batched writes
+STANDBY_RETRY_SECONDS = 15 # How often a standby process checks whether the active collector went away
+DEFAULT_WATCH_MARGIN = 1024**3 # Bytes left at which a client gets watched, when 'quota_watch_margin' is unusable
+DEFAULT_WATCH_INTERVAL = 2.0
+SNAPSHOT_WANTED_SECONDS = 300 # Keep publishing live data this long after a standby process last asked for it
+SNAPSHOT_TOP = 100 # Clients per ranking in the snapshot: the most /api/top returns
+
+def _state_path(db_path: str, name: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), name)
+
+def watch_margin(value: str, quota: int) -> int:
+    """
+    Bytes of remaining quota below which a client is watched; 'value' is a byte count or a percentage like '5%'.
+    """
+    try:
+        if value.strip().endswith('%'):
+            return int(quota * float(value.strip()[:-1]) / 100)
+        return int(value)
+    except (AttributeError, ValueError):
+        return DEFAULT_WATCH_MARGIN
+
+def collector_alive(db_path: str) -> bool:
+    """
+    True while a collector for this database has polled within three of its intervals.
+    """
+    try:
+        with open(_state_path(db_path, 'collector.heartbeat')) as f:
+            heartbeat = json.load(f)
+        return time.time() - heartbeat['at'] < 3 * heartbeat['interval'] + 5
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+class TrafficCollector:
+    def __init__(self, panel, interval: float = None, flush_interval: float = None):
+        """
+        Collects traffic for 'panel' (a CandyPanel), sharing its database connection and interface pool.
+        """
+        self.panel = panel
+        self.interval = interval or COLLECTOR_INTERVAL or 10
+        self.flush_interval = flush_interval or COLLECTOR_FLUSH_SECONDS
+        self._peers = {} # public_key -> Client with the in-memory counters
+        self._dirty = set() # Public keys whose counters changed since the last flush
+        self.rates = PeerRates() # Recent totals per client and per interface, for live throughput
+        self._live_rates = (None, None) # (rates generation, live_rates() result) until the next full poll
+        self._rate_ranking = (None, []) # (rates generation, heaviest TOP_KEEP (name, rates) by current rate)
+        self.talkers = TopTalkers() # Heaviest clients over the last hour and day
+        self._interfaces = []
+        self._roster_marker = None # (clients, interfaces) generations the roster was loaded at
+        self._bandwidth_pending = 0 # Bytes not yet added to the 'bandwidth' setting
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock() # Guards _peers, rates, talkers and _bandwidth_pending between poll() and flush()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+        self._snapshot = (None, None) # (mtime, parsed collector.live.json) as last read by a standby process
+        self._wanted_at = 0.0 # When this standby process last touched collector.live.wanted
+
+    def _load_roster(self):
+        """
+        (Re)loads active clients when the clients or interfaces tables changed. Clients already tracked keep
+        their in-memory totals, which are newer than the database while the collector is the only writer.
+        """
+        generations = self.panel.db.generations()
+        marker = (generations.get('clients'), generations.get('interfaces'))
+        if marker == self._roster_marker:
+            return
+        rows = self.panel.db.iter_select('clients', ['name', 'wg', 'public_key', 'traffic', 'used_trafic'], {'status': True})
+        peers, fresh = {}, set()
+        with self._lock:
+            for row in rows:
+                peer = self._peers.get(row['public_key'])
+                if peer is None or peer.name != row['name']:
+                    peer = Client.from_row(row, strict=False)
+                    self._dirty.discard(peer.public_key)
+                    fresh.add(peer.public_key)
+                else:
+                    peer.wg = row['wg']
+                    peer.set_traffic(row['traffic'])
+                peers[peer.public_key] = peer
+            dropped = [self._peers[key] for key in self._dirty if key not in peers]
+            self._dirty.intersection_update(peers)
+            self._peers = peers
+            self.rates.track(peers, fresh)
+        if dropped:
+            # Disabled or deleted meanwhile; keep what they used up to now
+            self._write([(peer.used_trafic_json(), peer.name) for peer in dropped])
+        self._interfaces = [row['wg'] for row in self.panel.db.select('interfaces', ['wg'])]
+        self._roster_marker = marker
+
+    def poll(self, interfaces: list[int] = None, keys: set = None) -> list[str]:
+        """
+        Reads the kernel counters of 'interfaces' (default: all) and adds the deltas to the in-memory totals,
+        for every peer or only those in 'keys'. Returns the names of clients now at or over their quota.
+        """
+        with metrics.COLLECTOR_SECONDS.time('poll'):
+            self._load_roster()
+            readings = {}
+            for traffic in self.panel._map_interfaces(self.panel._get_current_wg_peer_traffic,
+                                                      self._interfaces if interfaces is None else interfaces).values():
+                readings.update(traffic)
+            read_at = time.time()
+            over_quota = []
+            with self._lock:
+                for key, reading in readings.items():
+                    peer = self._peers.get(key)
+                    if peer is None or (keys is not None and key not in keys):
+                        continue
+                    if reading.rx != peer.last_wg_rx or reading.tx != peer.last_wg_tx:
+                        download, upload = peer.download, peer.upload
+                        self._bandwidth_pending += peer.add_reading(reading.rx, reading.tx)
+                        self._dirty.add(key)
+                        self.rates.moved(key, peer, peer.download - download, peer.upload - upload, read_at)
+                    if peer.quota > 0 and peer.download + peer.upload >= peer.quota:
+                        over_quota.append(peer.name)
+                self.rates.seen(readings if keys is None else keys.intersection(readings), self._peers, read_at)
+                if interfaces is None and keys is None:
+                    self.rates.polled(self._interfaces, read_at)
+                    self.talkers.tick(self._peers, read_at)
+        return over_quota
+
+    def live_rates(self) -> dict | None:
+        """
+        Returns {'interfaces': {wg: rates}, 'clients': {name: rates}} from memory, for the clients whose traffic moved
+        within the rate window; None while no collector has published them (see _published()). Rates are bits per
+        second: 'download_bps'/'upload_bps' over the last poll interval, '_avg' over the last rates.RATE_SAMPLES polls.
+        """
+        if self._lock_file is None:
+            snapshot = self._published()
+            return dict(snapshot['rates']) if snapshot else None
+        with self._lock:
+            return dict(self._current_rates()[1])
+
+    def _current_rates(self) -> tuple[int, dict]:
+        """
+        (rates generation, live_rates() result), recomputed when the generation moved. Callers hold _lock.
+        """
+        generation, live = self._live_rates
+        if generation != self.rates.generation:
+            clients = {self._peers[key].name: rate for key, rate in self.rates.active(self._peers).items()}
+            live = {'interfaces': self.rates.interfaces(), 'clients': clients}
+            self._live_rates = (self.rates.generation, live)
+        return self._live_rates
+
+    def top(self, by: str = 'rate', n: int = 10) -> dict | None:
+        """
+        Returns the 'n' heaviest clients: by current rate (by='rate', the sum of download_bps and upload_bps) or by bytes
+        used over the last 'hour' or 'day' (see talkers.py). None while no collector has published them.
+        """
+        if self._lock_file is None:
+            snapshot = self._published()
+            if not snapshot:
+                return None
+            ranking = snapshot['top'][by]
+            return dict(ranking, clients=ranking['clients'][:n])
+        with self._lock:
+            if by != 'rate':
+                return dict(self.talkers.top(by, n), by=by)
+            # Rates and ranking from one snapshot: a poll can't slip in and pair them across generations
+            generation, live = self._current_rates()
+            ranked, ranking = self._rate_ranking
+            if ranked != generation:
+                ranking = heapq.nlargest(TOP_KEEP, live['clients'].items(),
+                                         key=lambda item: item[1]['download_bps'] + item[1]['upload_bps'])
+                self._rate_ranking = (generation, ranking)
+            ranking = ranking[:n]
+        return {'by': by, 'clients': [dict(rate, name=name, bps=rate['download_bps'] + rate['upload_bps'])
+                                      for name, rate in ranking]}
+
+    def client_rate(self, public_key: str, name: str) -> dict | None:
+        """
+        Returns the live rates of one client (see live_rates()); None until a collector has read it over two full
+        polls. Standby processes look 'name' up in the published rates, where idle clients are left out.
+        """
+        if self._lock_file is None:
+            snapshot = self._published()
+            if not snapshot:
+                return None
+            return snapshot['rates']['clients'].get(name) or dict.fromkeys(
+                ('download_bps', 'upload_bps', 'download_bps_avg', 'upload_bps_avg'), 0)
+        with self._lock:
+            peer = self._peers.get(public_key)
+            return self.rates.peer(public_key, peer.wg) if peer is not None else None
+
+    def at_risk(self) -> dict:
+        """
+        Returns {wg_id: {public_key, ...}} for clients whose remaining quota is within the watch margin.
+        """
+        margin = self.panel._get_setting('quota_watch_margin', str(DEFAULT_WATCH_MARGIN))
+        watched = {}
+        with self._lock:
+            for key, peer in self._peers.items():
+                if peer.quota > 0 and peer.quota - peer.download - peer.upload <= watch_margin(margin, peer.quota):
+                    watched.setdefault(peer.wg, set()).add(key)
+        return watched
+
+    def watch(self, deadline: float):
+        """
+        Until 'deadline' (a time.monotonic() value), re-reads just the at-risk clients every 'quota_watch_interval'
+        seconds and disables them as soon as they cross their limit. Everyone else waits for the next full poll.
+        """
+        try:
+            watch_interval = float(self.panel._get_setting('quota_watch_interval', str(DEFAULT_WATCH_INTERVAL)))
+        except ValueError:
+            watch_interval = DEFAULT_WATCH_INTERVAL
+        watched = self.at_risk() if 0 < watch_interval < self.interval else {}
+        metrics.QUOTA_WATCHED_CLIENTS.set(sum(len(keys) for keys in watched.values()))
+        while watched and time.monotonic() + watch_interval < deadline and not self._stop.wait(watch_interval):
+            with metrics.COLLECTOR_SECONDS.time('watch'):
+                self.enforce(self.poll(list(watched), set().union(*watched.values())))
+            watched = self.at_risk()
+
+    def _write(self, rows: list[tuple[str, str]]) -> int:
+        """
+        Writes (used_trafic, name) rows in short chunked transactions.
+        """
+        return self.panel.db.update_many('clients', ['used_trafic'], 'name', rows, *self.panel._sync_chunking())
+
+    def flush(self) -> int:
+        """
+        Writes every changed client's counters in short chunked transactions and adds the pending bytes to 'bandwidth'.
+        Returns the number of rows written. When a write fails (e.g. the database is locked), what it didn't write is
+        pending again for the next flush before the error is raised.
+        """
+        with metrics.COLLECTOR_SECONDS.time('flush'):
+            with self._lock:
+                keys, self._dirty = self._dirty, set()
+                # Roster (rowid) order: each chunk then touches neighbouring pages
+                dirty = [(peer.used_trafic_json(), peer.name) for key, peer in self._peers.items() if key in keys]
+                bandwidth, self._bandwidth_pending = self._bandwidth_pending, 0
+            self._last_flush = time.monotonic()
+            if not dirty and not bandwidth:
+                return 0
+            try:
+                written = self._write(dirty)
+            except Exception:
+                # Some chunks may have committed; rewriting them next time stores the same totals
+                with self._lock:
+                    self._dirty.update(key for key in keys if key in self._peers)
+                    self._bandwidth_pending += bandwidth
+                raise
+            if bandwidth:
+                try:
+                    self.panel.db.increment_setting('bandwidth', bandwidth)
+                except Exception:
+                    with self._lock:
+                        self._bandwidth_pending += bandwidth
+                    raise
+            self.panel.db.bump_generation('traffic') # used_trafic isn't trigger-watched
+            self.panel._invalidate_account_status()
+            metrics.COLLECTOR_FLUSHED_ROWS.inc(amount=written)
+            return written
+
+    def enforce(self, names: list[str]):
+        """
+        Flushes, then disables the over-quota clients in one batch through CandyPanel._disable_clients. Clients it
+        could not disable stay metered, and are retried on the next poll.
+        """
+        if not names:
+            return
+        self.flush() # The disabled rows keep their final usage
+        print(f"[!] Clients reached their traffic limit: {', '.join(names)}. Disabling...")
+        disabled = []
+        self.panel._disable_clients(names, disabled)
+        if not disabled:
+            return
+        disabled = set(disabled)
+        with self._lock:
+            self._peers = {key: peer for key, peer in self._peers.items() if peer.name not in disabled}
+            self._dirty.intersection_update(self._peers)
+            self.rates.track(self._peers, set())
+
+    def _heartbeat(self):
+        path = _state_path(self.panel.db.db_path, 'collector.heartbeat')
+        try:
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump({'at': time.time(), 'interval': self.interval, 'pid': os.getpid()}, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"[!] Could not write collector heartbeat {path}: {e}")
+
+    def _publish(self):
+        """
+        Writes live_rates() and the top() rankings to collector.live.json for the standby processes, while one of
+        them asked within SNAPSHOT_WANTED_SECONDS.
+        """
+        db_path = self.panel.db.db_path
+        try:
+            if time.time() - os.stat(_state_path(db_path, 'collector.live.wanted')).st_mtime > SNAPSHOT_WANTED_SECONDS:
+                return
+        except OSError:
+            return # No standby has asked
+        snapshot = {'at': time.time(), 'interval': self.interval, 'rates': self.live_rates(),
+                    'top': {by: self.top(by, SNAPSHOT_TOP) for by in ('rate', 'hour', 'day')}}
+        path = _state_path(db_path, 'collector.live.json')
+        try:
+            with open(f"{path}.tmp", 'w') as f:
+                f.write(json.dumps(snapshot))
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"[!] Could not write live traffic snapshot {path}: {e}")
+
+    def _published(self) -> dict | None:
+        """
+        The active collector's last snapshot, for a process that isn't it; None while there is no fresh one.
+        Asking marks live data as wanted, so the active collector publishes from its next full poll on.
+        """
+        db_path, now = self.panel.db.db_path, time.time()
+        if now - self._wanted_at > 10: # Touching on every request would be a write per request
+            try:
+                with open(_state_path(db_path, 'collector.live.wanted'), 'a'):
+                    pass
+                os.utime(_state_path(db_path, 'collector.live.wanted'))
+                self._wanted_at = now
+            except OSError as e:
+                print(f"[!] Could not ask the traffic collector for live data: {e}")
+        path = _state_path(db_path, 'collector.live.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if self._snapshot[0] != mtime:
+                with open(path) as f:
+                    self._snapshot = (mtime, json.load(f))
+        except (OSError, ValueError):
+            return None
+        snapshot = self._snapshot[1]
+        return snapshot if now - snapshot['at'] < 3 * snapshot['interval'] + 5 else None
+
+    def _acquire(self) -> bool:
+        """
+        Takes the single-collector lock without waiting; False while another process holds it.
+        """
+        lock_file = open(_state_path(self.panel.db.db_path, 'collector.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def run(self):
+        """
+        Polls until stop() is called, flushing every flush interval and once more on the way out.
+        """
+        while not self._stop.is_set() and not self._acquire():
+            self._stop.wait(STANDBY_RETRY_SECONDS)
+        if self._stop.is_set():
+            return
+        print(f"[*] Traffic collector active: polling every {self.interval:g}s, writing every {self.flush_interval:g}s.")
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                try:
+                    self.enforce(self.poll())
+                    self._heartbeat()
+                    self._publish()
+                    if time.monotonic() - self._last_flush >= self.flush_interval:
+                        self.flush()
+                    self.watch(started + self.interval)
+                except Exception as e:
+                    print(f"[!] Traffic collector poll failed: {e}")
+                self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+        finally:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[!] Traffic collector final flush failed: {e}")
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='candy-collector', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        """
+        Stops polling and waits for the final flush.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+if __name__ == '__main__':
+    import signal
+    import core
+    parser = argparse.ArgumentParser(description="CandyPanel traffic collector")
+    parser.add_argument('--interval', type=float, default=COLLECTOR_INTERVAL or 10, help="Seconds between polls")
+    parser.add_argument('--flush', type=float, default=COLLECTOR_FLUSH_SECONDS, help="Seconds between database writes")
+    args = parser.parse_args()
+    collector = TrafficCollector(core.CandyPanel(), args.interval, args.flush)
+    signal.signal(signal.SIGTERM, lambda *_: collector._stop.set())
+    try:
+        collector.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.panel.db.close()
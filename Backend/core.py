@@ -1,22 +1,61 @@
 # core.py
-import subprocess, json, random, uuid, time, ipaddress, os, psutil, shutil, re , netifaces , string
-from db import SQLite
-from nanoid import generate
+# psutil, netifaces, nanoid, uuid and backup are imported where they are used, and segno through optional.py:
+# cron.py and bot restarts start a fresh interpreter each time and most of them never reach those code paths.
+import subprocess, json, random, time, ipaddress, os, shutil, re , string, hashlib, io, threading
+from db import SQLite, CONFIG_SETTING_KEYS
+from models import Client, Interface, PeerStats
+from cache import LRUCache
+from wg_helper import WireGuardOps, CommandExecutionError, generate_keypair
+from locks import InterfaceLocks
+from collector import collector_alive
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import metrics
+import traffic_engine
+import forecast
+from optional import optional_import
 from datetime import datetime , timedelta
 
 # --- Configuration Paths (Consider making these configurable in a real app) ---
-SERVER_PUBLIC_KEY_PATH = "/etc/wireguard/server_public_wgX.key"
-SERVER_PRIVATE_KEY_PATH = "/etc/wireguard/server_private_wgX.key"
-WG_CONF_PATH = "/etc/wireguard/wgX.conf"
-WG_DIR = "/etc/wireguard"
+WG_DIR = os.environ.get('CANDY_WG_DIR', "/etc/wireguard") # Overridable for benchmarks against a synthetic fleet
+SERVER_PUBLIC_KEY_PATH = os.path.join(WG_DIR, "server_public_wgX.key")
+SERVER_PRIVATE_KEY_PATH = os.path.join(WG_DIR, "server_private_wgX.key")
+WG_CONF_PATH = os.path.join(WG_DIR, "wgX.conf")
 DB_FILE = "total_traffic.json" # File to store cumulative traffic data
+ACCOUNT_STATUS_TTL = 30 # Seconds a cached bot account status stays valid
+QR_CACHE_SIZE = 512 # Rendered QR PNGs kept in memory
+CONFIG_CACHE_SIZE = 4096 # Rendered client configs kept in memory
+INTERFACE_WORKERS = int(os.environ.get('CANDY_INTERFACE_WORKERS', '4')) # Interfaces backed up, read or reloaded at once by _sync
+RECONCILE_SYNCCONF_THRESHOLD = 64 # Peer changes above this are applied with one `wg syncconf` instead of `wg set` each
+SYNC_HISTORY_KEEP = 10080 # `sync_runs` rows kept: a week of per-minute cron runs
+METRIC_COMMANDS = ('wg-quick', 'wg', 'systemctl', 'ufw', 'qrencode', 'crontab', 'sysctl', 'apt') # Labels for spawned commands
 
 class CandyPanel:
-    def __init__(self):
+    def __init__(self, db_path: str = None):
         """
         Initializes the CandyPanel with a SQLite database connection.
         """
-        self.db = SQLite()
+        self.db = SQLite(db_path)
+        # WireGuard, wg-quick@ and ufw operations go to the privileged helper (argv-list subprocesses without it)
+        self.wg = WireGuardOps()
+        # One lock per interface around wgN.conf edits and the matching kernel updates, across threads and processes
+        self._locks = InterfaceLocks(WG_DIR)
+        # Cross-interface work in _sync (backups, traffic dumps, reset reloads); threads start on first use
+        self._interface_pool = ThreadPoolExecutor(max_workers=INTERFACE_WORKERS, thread_name_prefix='candy-interface')
+        # Bot account status rows keyed by telegram_id; dropped whenever client usage changes
+        self._account_status_cache = LRUCache(maxsize=4096, ttl=ACCOUNT_STATUS_TTL)
+        # Rendered QR PNGs keyed by the SHA-256 of the config they encode
+        self._qr_cache = LRUCache(maxsize=QR_CACHE_SIZE)
+        # Rendered client configs keyed by client name, valid for one (interface version, settings version)
+        self._config_cache = LRUCache(maxsize=CONFIG_CACHE_SIZE)
+        self._settings_version = 0
+        self._interface_versions = {} # wg_id -> version, bumped on every interface change
+        self._config_settings = None # (settings_version, {key: value}) for CONFIG_SETTING_KEYS
+        self._settings = None # (settings generation, {key: value}) for the whole settings table
+        # Cross-process invalidation: other workers, cron.py and the bot write through their own connections
+        self._generations = {} # scope -> last seen `cache_generation` value
+        self._generation_marker = None # (data_version, write_count) when the generations were last read
+        self._generation_lock = threading.Lock()
 
     @staticmethod
     def _is_valid_ip(ip: str) -> bool:
@@ -29,13 +68,22 @@ class CandyPanel:
         except ValueError:
             return False
 
+    @staticmethod
+    def _command_label(cmd: str) -> str:
+        """
+        Metric label for a shell command: the first WireGuard/system tool it runs, past sudo/bash/echo wrappers.
+        """
+        words = re.findall(r"[\w.-]+", cmd)
+        return next((word for word in words if word in METRIC_COMMANDS), words[0] if words else '')
+
     def run_command(self, cmd: str, check: bool = True) -> str | None:
         """
         Executes a shell command and returns its stdout.
         Raises an exception if the command fails and 'check' is True.
         """
         try:
-            result = subprocess.run(cmd, shell=True, check=check, capture_output=True, text=True)
+            with metrics.SUBPROCESS_SECONDS.time(self._command_label(cmd)):
+                result = subprocess.run(cmd, shell=True, check=check, capture_output=True, text=True)
             if result.returncode != 0:
                 # Log the error instead of just printing and exiting
                 print(f"Error running command '{cmd}': {result.stderr.strip()}")
@@ -56,6 +104,7 @@ class CandyPanel:
     def _get_default_interface(self):
         """Gets the default network interface."""
         try:
+            import netifaces
             gateways = netifaces.gateways()
             return gateways['default'][netifaces.AF_INET][1]
         except Exception:
@@ -119,9 +168,7 @@ class CandyPanel:
         """
         Generates a new WireGuard private and public key pair.
         """
-        priv = self.run_command("wg genkey")
-        pub = self.run_command(f"echo {priv} | wg pubkey")
-        return priv, pub
+        return generate_keypair()
 
     def _get_used_ips(self, wg_id: int) -> set[int]:
         """
@@ -144,26 +191,116 @@ class CandyPanel:
         """
         Creates a backup of the WireGuard configuration file.
         """
-        config_path = WG_CONF_PATH.replace('X', str(wg_id))
-        backup_path = f"{config_path}.bak"
-        try:
-            shutil.copy(config_path, backup_path)
-            print(f"[+] Backup created: {backup_path}")
-        except FileNotFoundError:
-            print(f"[!] Warning: Config file {config_path} not found for backup.")
-        except Exception as e:
-            print(f"[!] Error creating backup for wg{wg_id}: {e}")
+        with self._locks.hold(wg_id): # Copy a complete file, not one mid-edit
+            config_path = WG_CONF_PATH.replace('X', str(wg_id))
+            backup_path = f"{config_path}.bak"
+            try:
+                shutil.copy(config_path, backup_path)
+                print(f"[+] Backup created: {backup_path}")
+            except FileNotFoundError:
+                print(f"[!] Warning: Config file {config_path} not found for backup.")
+            except Exception as e:
+                print(f"[!] Error creating backup for wg{wg_id}: {e}")
+
+    def _read_interface_state(self, wg_id: int) -> dict:
+        """
+        Parses wgX.conf into the state the running interface should have:
+        listen port, MTU, addresses and peers (public key -> allowed-ips).
+        """
+        state = {'listen_port': None, 'mtu': None, 'addresses': set(), 'peers': {}}
+        peer_key = None
+        with open(WG_CONF_PATH.replace('X', str(wg_id)), "r") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    peer_key = None
+                    continue
+                if '=' not in line or line.startswith('#'):
+                    continue
+                key, value = (part.strip() for part in line.split('=', 1))
+                key = key.lower()
+                if key == 'listenport' and value.isdigit():
+                    state['listen_port'] = int(value)
+                elif key == 'mtu' and value.isdigit():
+                    state['mtu'] = int(value)
+                elif key == 'address':
+                    state['addresses'].update(str(ipaddress.ip_interface(a.strip())) for a in value.split(',') if a.strip())
+                elif key == 'publickey':
+                    peer_key = value
+                    state['peers'].setdefault(peer_key, '')
+                elif key == 'allowedips' and peer_key:
+                    state['peers'][peer_key] = value
+        return state
+
+    @staticmethod
+    def _normalize_allowed_ips(allowed_ips: str) -> tuple:
+        return tuple(sorted(str(ipaddress.ip_network(a.strip(), strict=False)) for a in allowed_ips.split(',') if a.strip()))
+
+    def _reconcile_wireguard(self, wg_id: int) -> list[str]:
+        """
+        Brings the running interface in line with wgX.conf by applying only the differences
+        (listen port, MTU, addresses, peers), so established sessions on the interface survive.
+        Brings the interface up with wg-quick when it isn't running. Returns the changes made.
+        """
+        name = f"wg{wg_id}"
+        desired = self._read_interface_state(wg_id)
+        live = self.wg.live_state(name)
+        if live is None:
+            self.wg.up(name)
+            return ['up']
+
+        changes = []
+        if desired['listen_port'] and desired['listen_port'] != live['listen_port']:
+            self.wg.set_listen_port(name, desired['listen_port'])
+            changes.append(f"listen-port {live['listen_port']} -> {desired['listen_port']}")
+        if desired['mtu'] and desired['mtu'] != live['mtu']:
+            self.wg.set_mtu(name, desired['mtu'])
+            changes.append(f"mtu {live['mtu']} -> {desired['mtu']}")
+        # Add new addresses before dropping old ones so the interface is never left without one
+        for address in sorted(desired['addresses'] - live['addresses']):
+            self.wg.address('add', name, address)
+            changes.append(f"address +{address}")
+        for address in sorted(live['addresses'] - desired['addresses']):
+            self.wg.address('del', name, address)
+            changes.append(f"address -{address}")
+
+        removed = [key for key in live['peers'] if key not in desired['peers']]
+        changed = [key for key, allowed in desired['peers'].items()
+                   if key not in live['peers'] or self._normalize_allowed_ips(allowed) != self._normalize_allowed_ips(live['peers'][key])]
+        if len(removed) + len(changed) > RECONCILE_SYNCCONF_THRESHOLD:
+            # syncconf diffs peers itself and only touches the ones that differ
+            self.wg.syncconf(name)
+        else:
+            for key in removed:
+                self.wg.remove_peer(name, key)
+            for key in changed:
+                self.wg.set_peer(name, key, desired['peers'][key])
+        if removed or changed:
+            changes.append(f"peers -{len(removed)} ~{len(changed)}")
+        return changes
 
     def _reload_wireguard(self, wg_id: int):
         """
-        Reloads a specific WireGuard interface.
+        Applies wgX.conf to the running interface.
+        With the 'reload_mode' setting at 'reconcile' (the default) only the differences are applied;
+        'restart' takes the interface down and up again, dropping every session on it.
         """
-        print(f"[*] Reloading WireGuard interface wg{wg_id}...")
-        # Ensure the interface is down before bringing it up to apply changes
-        # Use '|| true' to prevent error if already down, allowing 'up' to proceed
-        self.run_command(f"sudo wg-quick down wg{wg_id} || true", check=False)
-        self.run_command(f"sudo wg-quick up wg{wg_id}")
-        print(f"[*] WireGuard interface wg{wg_id} reloaded.")
+        with self._locks.hold(wg_id):
+            if self._get_setting('reload_mode', 'reconcile') != 'restart':
+                try:
+                    changes = self._reconcile_wireguard(wg_id)
+                    print(f"[*] WireGuard interface wg{wg_id} reconciled: {', '.join(changes) or 'no changes'}.")
+                    return
+                except (CommandExecutionError, OSError, ValueError) as e:
+                    print(f"[!] Reconciling wg{wg_id} failed ({e}); restarting the interface instead.")
+            print(f"[*] Reloading WireGuard interface wg{wg_id}...")
+            # Ensure the interface is down before bringing it up to apply changes
+            try:
+                self.wg.down(f"wg{wg_id}")
+            except CommandExecutionError:
+                pass # Already down; 'up' can proceed
+            self.wg.up(f"wg{wg_id}")
+            print(f"[*] WireGuard interface wg{wg_id} reloaded.")
 
     def _add_peer_to_config(self, wg_id: int, client_name: str, client_public_key: str, client_ip: str):
         """
@@ -176,34 +313,52 @@ class CandyPanel:
 PublicKey = {client_public_key}
 AllowedIPs = {client_ip}/32
 """
-        try:
-            with open(config_path, "a") as f:
-                f.write(peer_entry)
-            # Apply changes to the running WireGuard interface without full restart
-            self.run_command(f"sudo bash -c 'wg syncconf wg{wg_id} <(wg-quick strip wg{wg_id})'")
-            print(f"[+] Client '{client_name}' added to wg{wg_id} config.")
-        except Exception as e:
-            raise CommandExecutionError(f"Failed to add client '{client_name}' to WireGuard configuration: {e}")
+        with self._locks.hold(wg_id):
+            try:
+                with open(config_path, "a") as f:
+                    f.write(peer_entry)
+                # Add just this peer to the running interface; the file above keeps it across restarts
+                self.wg.set_peer(f"wg{wg_id}", client_public_key, f"{client_ip}/32")
+                print(f"[+] Client '{client_name}' added to wg{wg_id} config.")
+            except Exception as e:
+                raise CommandExecutionError(f"Failed to add client '{client_name}' to WireGuard configuration: {e}")
 
     def _remove_peer_from_config(self, wg_id: int, client_name: str, client_public_key: str):
         """
         Removes a client peer entry from the WireGuard configuration file.
         """
+        with self._locks.hold(wg_id):
+            try:
+                removed = self._remove_peers_from_config(wg_id, {client_public_key})
+            except Exception as e:
+                raise CommandExecutionError(f"Error removing client '{client_name}' from WireGuard configuration: {e}")
+            if removed:
+                print(f"[+] Client '{client_name}' removed from wg{wg_id} config.")
+            elif removed is not None:
+                print(f"[!] Client '{client_name}' peer block not found in config file. No changes made to config.")
+
+    def _remove_peers_from_config(self, wg_id: int, public_keys: set[str]) -> set[str] | None:
+        """
+        Removes every peer whose public key is in 'public_keys' from wgN.conf in one rewrite,
+        then from the running interface in one `wg set` per chunk of peers.
+        Returns the keys found in the config, or None when the config file doesn't exist.
+        """
         config_path = WG_CONF_PATH.replace('X', str(wg_id))
 
-        if not os.path.exists(config_path):
-            print(f"[!] WireGuard config file {config_path} not found. Cannot remove peer from config.")
-            return # Cannot remove if file doesn't exist
+        with self._locks.hold(wg_id):
+            if not os.path.exists(config_path):
+                print(f"[!] WireGuard config file {config_path} not found. Cannot remove peer from config.")
+                return None # Cannot remove if file doesn't exist
 
-        self._backup_config(wg_id) # Backup before modifying
+            self._backup_config(wg_id) # Backup before modifying
 
-        try:
             with open(config_path, "r") as f:
                 lines = f.readlines()
 
             new_lines = []
             in_peer_block = False
             peer_block_to_delete = False
+            removed = set() # peer_block_to_delete only describes the current block
             temp_block = []
 
             for line in lines:
@@ -217,8 +372,10 @@ AllowedIPs = {client_ip}/32
                 elif in_peer_block:
                     temp_block.append(line)
                     # Check for public key to identify the peer block, more reliable than comment
-                    if f"PublicKey = {client_public_key}" in line.strip():
+                    key, _, value = line.strip().partition('=')
+                    if key.strip() == 'PublicKey' and value.strip() in public_keys:
                         peer_block_to_delete = True
+                        removed.add(value.strip())
                     # An empty line or a new [Peer] indicates the end of the current peer block
                     if not line.strip() and in_peer_block:
                         if not peer_block_to_delete:
@@ -232,29 +389,90 @@ AllowedIPs = {client_ip}/32
             if in_peer_block and not peer_block_to_delete:
                 new_lines.extend(temp_block)
 
-            if peer_block_to_delete:
+            if removed:
                 with open(config_path, "w") as f:
                     f.writelines(new_lines)
-                self.run_command(f"sudo bash -c 'wg syncconf wg{wg_id} <(wg-quick strip wg{wg_id})'")
-                print(f"[+] Client '{client_name}' removed from wg{wg_id} config.")
+                self.wg.remove_peers(f"wg{wg_id}", sorted(removed))
+            return removed
+
+    def _disable_clients(self, client_names: list[str], disabled: list = None) -> tuple[bool, str]:
+        """
+        Disables many clients at once, e.g. everyone who expired at the start of a month.
+        Each interface loses its peers in one config rewrite and one kernel update, and every status flips in one
+        transaction while the interfaces are still locked: no chunking or pauses, so the configs and the table never
+        disagree and no lock is held through a sleep. The names actually disabled are appended to 'disabled' when given.
+        """
+        start = time.perf_counter()
+        names = list(dict.fromkeys(client_names))
+        clients = []
+        for i in range(0, len(names), 500): # Stay under SQLite's bound-parameter limit
+            chunk = names[i:i + 500]
+            clients += self.db.query(f"SELECT `name`, `wg`, `public_key` FROM `clients` WHERE `status` = 1 "
+                                     f"AND `name` IN ({', '.join('?' * len(chunk))})", tuple(chunk))
+        by_interface = {} # wg_id -> {public_key: name}
+        for client in clients:
+            by_interface.setdefault(client['wg'], {})[client['public_key']] = client['name']
+
+        flipped, failed = [], [] # This call's names only; a caller's 'disabled' list may already hold others
+        with ExitStack() as stack:
+            for wg_id in sorted(by_interface): # One global order, so batches never deadlock each other
+                stack.enter_context(self._locks.hold(wg_id))
+            for wg_id, peers in sorted(by_interface.items()):
+                try:
+                    removed = self._remove_peers_from_config(wg_id, set(peers))
+                except Exception as e:
+                    print(f"[!] Error removing {len(peers)} peers from wg{wg_id}: {e}. Leaving them enabled.")
+                    failed.extend(peers.values())
+                    continue
+                if removed is not None and len(removed) < len(peers):
+                    print(f"[!] {len(peers) - len(removed)} peers were already missing from wg{wg_id} config.")
+                flipped.extend(peers.values())
+            self.db.update_many('clients', ['status'], 'name', [(False, name) for name in flipped])
+        if flipped:
+            self._invalidate_account_status()
+        if disabled is not None:
+            disabled.extend(flipped)
+        message = (f"Disabled {len(flipped)} clients on {len(by_interface)} interfaces "
+                   f"in {time.perf_counter() - start:.2f}s")
+        if failed:
+            message += f"; {len(failed)} could not be disabled"
+        print(f"[{'!' if failed else '+'}] {message}.")
+        return not failed, message + '.'
+
+    def _map_interfaces(self, fn, wg_ids, errors: list = None) -> dict:
+        """
+        Runs fn(wg_id) for every interface on the interface worker pool and returns {wg_id: result}.
+        Interfaces are independent, so they run side by side; 'fn' takes the interface lock itself where needed.
+        A failure is reported and leaves that interface out of the result without stopping the others.
+        """
+        def run(wg_id):
+            try:
+                return wg_id, fn(wg_id), None
+            except Exception as e:
+                return wg_id, None, e
+
+        wg_ids = list(wg_ids)
+        outcomes = self._interface_pool.map(run, wg_ids) if len(wg_ids) > 1 and INTERFACE_WORKERS > 1 else map(run, wg_ids)
+        results = {}
+        for wg_id, result, error in outcomes:
+            if error is not None:
+                print(f"[!] {fn.__name__} failed for wg{wg_id}: {error}")
+                if errors is not None:
+                    errors.append(f"{fn.__name__} wg{wg_id}: {error}")
             else:
-                print(f"[!] Client '{client_name}' peer block not found in config file. No changes made to config.")
-
-        except Exception as e:
-            raise CommandExecutionError(f"Error removing client '{client_name}' from WireGuard configuration: {e}")
-
+                results[wg_id] = result
+        return results
 
     def _get_current_wg_peer_traffic(self, wg_id: int) -> dict:
         """
         Retrieves current traffic statistics (rx, tx) for all WireGuard peers
         on a specific interface from 'wg show dump'.
-        Returns a dictionary: {public_key: {'rx': int, 'tx': int}}
+        Returns a dictionary: {public_key: PeerStats}
         """
         traffic_data = {}
         try:
-            # Use 'sudo wg show <interface> dump' to get machine-readable output
-            result = subprocess.run(['sudo', 'wg', 'show', f"wg{wg_id}", 'dump'], capture_output=True, text=True, check=True)
-            output_lines = result.stdout.strip().splitlines()
+            # 'wg show <interface> dump' gives machine-readable output
+            output_lines = self.wg.dump(f"wg{wg_id}").strip().splitlines()
 
             # The 'dump' output for an interface lists the interface details on the first line,
             # followed by a line for each peer.
@@ -268,7 +486,7 @@ AllowedIPs = {client_ip}/32
                         pubkey = parts[0] # Peer public key is the first field
                         rx = int(parts[5]) # transfer_rx is the 6th field (index 5)
                         tx = int(parts[6]) # transfer_tx is the 7th field (index 6)
-                        traffic_data[pubkey] = {'rx': rx, 'tx': tx}
+                        traffic_data[pubkey] = PeerStats(rx, tx)
                     except (ValueError, IndexError) as e:
                         print(f"Warning: Could not parse wg dump peer line: '{line.strip()}'. Error: {e}")
                 elif len(parts) == 4:
@@ -279,8 +497,8 @@ AllowedIPs = {client_ip}/32
                     # Other unexpected lines or malformed lines
                     print(f"Warning: Unexpected line format or number of parts in wg dump output: '{line.strip()}'")
 
-        except subprocess.CalledProcessError as e:
-            print(f"Warning: Failed to run `sudo wg show wg{wg_id} dump`. Error: {e.stderr.strip()}. Please ensure WireGuard is installed and you have appropriate permissions (e.g., sudo access).")
+        except CommandExecutionError as e:
+            print(f"Warning: Failed to run `wg show wg{wg_id} dump`. Error: {e}. Please ensure WireGuard is installed and the WireGuard helper (or sudo access) is available.")
         except Exception as e:
             print(f"An unexpected error occurred while getting traffic for wg{wg_id}: {e}")
         return traffic_data
@@ -339,9 +557,9 @@ AllowedIPs = {client_ip}/32
             return False, f"Failed to enable IP forwarding: {e}"
 
 
-        print("[+] Creating /etc/wireguard if not exists...")
-        os.makedirs("/etc/wireguard", exist_ok=True)
-        os.chmod("/etc/wireguard", 0o700)
+        print(f"[+] Creating {WG_DIR} if not exists...")
+        os.makedirs(WG_DIR, exist_ok=True)
+        os.chmod(WG_DIR, 0o700)
         env = os.environ.copy()
         env["AP_PORT"] = '3446' # Ensure this is set for `bot.py` and `main.py`
         wg_id = 0 # Default initial interface ID
@@ -403,8 +621,8 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
             }, {'wg': wg_id})
 
         try:
-            self.run_command(f"sudo systemctl enable wg-quick@wg{wg_id}")
-            self.run_command(f"sudo systemctl start wg-quick@wg{wg_id}")
+            self.wg.service('enable', f"wg{wg_id}")
+            self.wg.service('start', f"wg{wg_id}")
         except Exception as e:
             return False, f"Failed to start WireGuard service: {e}"
 
@@ -416,6 +634,8 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
         admin_data = json.dumps({'user': admin_user, 'password': admin_password})
         self.db.update('settings', {'value': admin_data}, {'key': 'admin'})
         self.db.update('settings', {'value': '1'}, {'key': 'install'})
+        self._invalidate_config_caches(wg_id)
+        self._invalidate_config_caches()
         current_dir = os.path.abspath(os.path.dirname(__file__))
         cron_script_path = os.path.join(current_dir, 'cron.py')
         backend_dir = os.path.dirname(cron_script_path)
@@ -430,6 +650,7 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
         """
         admin_settings = json.loads(self.db.get('settings', where={'key': 'admin'})['value'])
         if admin_settings.get('user') == user and admin_settings.get('password') == password:
+            import uuid
             session_token = str(uuid.uuid4())
             self.db.update('settings', {'value': session_token}, {'key': 'session_token'})
             return True, session_token
@@ -440,6 +661,7 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
         """
         Retrieves various system and application statistics for the dashboard.
         """
+        import psutil
         mem = psutil.virtual_memory()
         net1 = psutil.net_io_counters()
         time.sleep(1) # Wait for 1 second to calculate network speed
@@ -471,6 +693,41 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
         """
         return self.db.select('clients')
 
+    def _iter_clients(self):
+        """
+        Yields every client record, reading the table in chunks; used_trafic is parsed into a dict.
+        """
+        for row in self.db.iter_select('clients'):
+            yield Client.from_row(row, strict=False).to_dict()
+
+    def _get_account_status(self, telegram_id: int) -> dict | None:
+        """
+        Retrieves a bot user joined with their CandyPanel client in a single keyed lookup.
+        Client columns are None when the user has no (or a missing) client.
+        Results are cached briefly and invalidated whenever client usage or settings change.
+        """
+        self._sync_cache_generations()
+        cached = self._account_status_cache.get(telegram_id)
+        if cached is not None:
+            return dict(cached)
+        row = self.db.query("""
+            SELECT u.`status`, u.`traffic_bought_gb`, u.`time_bought_days`, u.`candy_client_name`,
+                   c.`name` AS client_name, c.`used_trafic`, c.`traffic`, c.`expires`, c.`note`
+            FROM `users` u
+            LEFT JOIN `clients` c ON c.`name` = u.`candy_client_name`
+            WHERE u.`telegram_id` = ?
+        """, (telegram_id,), 'one')
+        if row is not None:
+            self._account_status_cache.set(telegram_id, row)
+            return dict(row)
+        return None
+
+    def _invalidate_account_status(self, telegram_id: int = None):
+        """
+        Drops the cached account status for one bot user, or for everyone when no id is given.
+        """
+        self._account_status_cache.invalidate(telegram_id)
+
     def _new_client(self, name: str, expire: str, traffic: str, wg_id: int = 0, note: str = '') -> tuple[bool, str]:
         """
         Creates a new WireGuard client, generates its configuration, and adds it to the DB.
@@ -484,62 +741,49 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
         if not interface_wg:
             return False, f"WireGuard interface wg{wg_id} not found."
 
-        used_ips = self._get_used_ips(wg_id)
-        network_address_prefix = interface_wg['address_range'].rsplit('.', 1)[0]
-        next_ip_host_part = 2
-
-        # Get IPs already assigned to clients in the DB for the current interface
-        existing_client_ips = {c['address'] for c in self.db.select('clients', where={'wg': wg_id})}
-
-        while f"{network_address_prefix}.{next_ip_host_part}" in existing_client_ips or next_ip_host_part in used_ips:
-            next_ip_host_part += 1
-            if next_ip_host_part > 254:
-                return False, "No available IP addresses in the subnet."
-
-        client_ip = f"{network_address_prefix}.{next_ip_host_part}"
         client_private, client_public = self._generate_keypair()
+        with self._locks.hold(wg_id): # IP choice, conf append and insert must not interleave with other writers
+            used_ips = self._get_used_ips(wg_id)
+            network_address_prefix = interface_wg['address_range'].rsplit('.', 1)[0]
+            next_ip_host_part = 2
 
-        try:
-            self._add_peer_to_config(wg_id, name, client_public, client_ip)
-        except CommandExecutionError as e:
-            return False, str(e)
+            # Get IPs already assigned to clients in the DB for the current interface
+            existing_client_ips = {c['address'] for c in self.db.select('clients', where={'wg': wg_id})}
 
-        server_ip = self.db.get('settings', where={'key': 'custom_endpont'})['value']
-        dns = self.db.get('settings', where={'key': 'dns'})['value']
-        mtu = self.db.get('settings', where={'key': 'mtu'})
-        mtu_value = mtu['value'] if mtu else '1420'
+            while f"{network_address_prefix}.{next_ip_host_part}" in existing_client_ips or next_ip_host_part in used_ips:
+                next_ip_host_part += 1
+                if next_ip_host_part > 254:
+                    return False, "No available IP addresses in the subnet."
 
-        client_config = f"""[Interface]
-PrivateKey = {client_private}
-Address = {client_ip}/32
-DNS = {dns}
-MTU = {mtu_value}
+            client_ip = f"{network_address_prefix}.{next_ip_host_part}"
 
-[Peer]
-PublicKey = {interface_wg['public_key']}
-Endpoint = {server_ip}:{interface_wg['port']}
-AllowedIPs = 0.0.0.0/0, ::/0
-PersistentKeepalive = 25
-"""
-        # Initialize used_trafic with current WG counters, download/upload are 0
-        # This assumes a brand new client won't have existing traffic on wg show
-        initial_used_traffic = json.dumps({'download': 0, 'upload': 0, 'last_wg_rx': 0, 'last_wg_tx': 0})
-
-        self.db.insert('clients', {
-            'name': name,
-            'public_key': client_public,
-            'private_key': client_private,
-            'address': client_ip,
-            'created_at': datetime.now().isoformat(),
-            'expires': expire,
-            'traffic': traffic, # Total traffic quota in bytes
-            'used_trafic': initial_used_traffic,
-            'wg': wg_id,
-            'note': note,
-            'connected_now': False,
-            'status': True
-        })
-        return True, client_config
+            try:
+                self._add_peer_to_config(wg_id, name, client_public, client_ip)
+            except CommandExecutionError as e:
+                return False, str(e)
+
+            client_config = self._render_client_config(
+                {'private_key': client_private, 'address': client_ip}, interface_wg, self._get_config_settings())
+            # Initialize used_trafic with current WG counters, download/upload are 0
+            # This assumes a brand new client won't have existing traffic on wg show
+            initial_used_traffic = json.dumps({'download': 0, 'upload': 0, 'last_wg_rx': 0, 'last_wg_tx': 0})
+
+            self.db.insert('clients', {
+                'name': name,
+                'public_key': client_public,
+                'private_key': client_private,
+                'address': client_ip,
+                'created_at': datetime.now().isoformat(),
+                'expires': expire,
+                'traffic': traffic, # Total traffic quota in bytes
+                'used_trafic': initial_used_traffic,
+                'wg': wg_id,
+                'note': note,
+                'connected_now': False,
+                'status': True
+            })
+            self._config_cache.set(name, (wg_id, self._interface_versions.get(wg_id, 0), self._settings_version, client_public, client_config))
+            return True, client_config
 
     def _disable_client(self, client_name: str) -> tuple[bool, str]:
         """
@@ -552,18 +796,20 @@ PersistentKeepalive = 25
         wg_id = client['wg']
         client_public_key = client['public_key']
 
-        try:
-            self._remove_peer_from_config(wg_id, client_name, client_public_key)
-        except CommandExecutionError as e:
-            print(f"[!] Error during peer removal from config for disabling: {e}. Proceeding with DB status update.")
-            # Decide if you want to abort here or proceed with DB status update
-            return False, f"Failed to remove peer from config: {e}"
+        with self._locks.hold(wg_id):
+            try:
+                self._remove_peer_from_config(wg_id, client_name, client_public_key)
+            except CommandExecutionError as e:
+                print(f"[!] Error during peer removal from config for disabling: {e}. Proceeding with DB status update.")
+                # Decide if you want to abort here or proceed with DB status update
+                return False, f"Failed to remove peer from config: {e}"
 
 
-        # Update client status in database
-        self.db.update('clients', {'status': False}, {'name': client_name})
-        print(f"[+] Client '{client_name}' disabled successfully in DB.")
-        return True, f"Client '{client_name}' disabled successfully."
+            # Update client status in database
+            self.db.update('clients', {'status': False}, {'name': client_name})
+            self._invalidate_account_status()
+            print(f"[+] Client '{client_name}' disabled successfully in DB.")
+            return True, f"Client '{client_name}' disabled successfully."
 
     def _delete_client(self, client_name: str) -> tuple[bool, str]:
         """
@@ -576,17 +822,20 @@ PersistentKeepalive = 25
 
         wg_id = client['wg']
         client_public_key = client['public_key']
-        try:
-            self._remove_peer_from_config(wg_id, client['name'], client_public_key) # Use client['name']
-        except CommandExecutionError as e:
-            print(f"[!] Error during peer removal from config during deletion: {e}. Proceeding with DB deletion.")
-            # Decide if you want to abort here or proceed with DB deletion
-            # For a "delete" action, you might want to proceed even if config removal fails
-            # to at least clean up the DB.
+        with self._locks.hold(wg_id):
+            try:
+                self._remove_peer_from_config(wg_id, client['name'], client_public_key) # Use client['name']
+            except CommandExecutionError as e:
+                print(f"[!] Error during peer removal from config during deletion: {e}. Proceeding with DB deletion.")
+                # Decide if you want to abort here or proceed with DB deletion
+                # For a "delete" action, you might want to proceed even if config removal fails
+                # to at least clean up the DB.
 
-        self.db.delete('clients', {'name': client_name})
-        print(f"[+] Client '{client_name}' deleted successfully from DB.")
-        return True, f"Client '{client_name}' deleted successfully."
+            self.db.delete('clients', {'name': client_name})
+            self._config_cache.invalidate(client_name)
+            self._invalidate_account_status()
+            print(f"[+] Client '{client_name}' deleted successfully from DB.")
+            return True, f"Client '{client_name}' deleted successfully."
 
 
     def _edit_client(self, name: str, expire: str = None, traffic: str = None, status: bool = None, note: str = None) -> tuple[bool, str]:
@@ -598,38 +847,45 @@ PersistentKeepalive = 25
         if not current_client:
             return False, f"Client '{name}' not found."
 
-        update_data = {}
-        client_public_key = current_client['public_key']
+        with self._locks.hold(current_client['wg']):
+            # Re-read under the lock, so a status change made meanwhile isn't applied twice
+            current_client = self.db.get('clients', where={'name': name})
+            if not current_client:
+                return False, f"Client '{name}' not found."
 
-        if expire is not None:
-            update_data['expires'] = expire
-        if traffic is not None:
-            update_data['traffic'] = traffic
-        if note is not None:
-            update_data['note'] = note
+            update_data = {}
+            client_public_key = current_client['public_key']
 
-        # Handle status change
-        if status is not None and status != current_client['status']:
-            update_data['status'] = status
-            wg_id = current_client['wg']
+            if expire is not None:
+                update_data['expires'] = expire
+            if traffic is not None:
+                update_data['traffic'] = traffic
+            if note is not None:
+                update_data['note'] = note
 
-            if status: # Changing to Active
-                try:
-                    self._add_peer_to_config(wg_id, name, client_public_key, current_client['address'])
-                except CommandExecutionError as e:
-                    return False, str(e)
-            else: # Changing to Inactive
-                try:
-                    self._remove_peer_from_config(wg_id, name, client_public_key)
-                except CommandExecutionError as e:
-                    return False, str(e)
-
-        # Only update if there's actual data to change
-        if update_data:
-            self.db.update('clients', update_data, {'name': name})
-            return True, f"Client '{name}' edited successfully."
-        else:
-            return False, "No valid update data provided." # Or True, "Nothing to update." if that's desired
+            # Handle status change
+            if status is not None and status != current_client['status']:
+                update_data['status'] = status
+                wg_id = current_client['wg']
+
+                if status: # Changing to Active
+                    try:
+                        self._add_peer_to_config(wg_id, name, client_public_key, current_client['address'])
+                    except CommandExecutionError as e:
+                        return False, str(e)
+                else: # Changing to Inactive
+                    try:
+                        self._remove_peer_from_config(wg_id, name, client_public_key)
+                    except CommandExecutionError as e:
+                        return False, str(e)
+
+            # Only update if there's actual data to change
+            if update_data:
+                self.db.update('clients', update_data, {'name': name})
+                self._invalidate_account_status()
+                return True, f"Client '{name}' edited successfully."
+            else:
+                return False, "No valid update data provided." # Or True, "Nothing to update." if that's desired
 
 
 
@@ -655,25 +911,26 @@ PersistentKeepalive = 25
         path = self._get_interface_path(interface_name)
         print("[+] Installing and configuring UFW...")
         try:
-            self.run_command("sudo ufw default deny incoming")
-            self.run_command("sudo ufw default allow outgoing")
-            self.run_command(f"sudo ufw allow {port}/udp")
-            self.run_command("sudo ufw --force enable")
+            self.wg.ufw('default', 'deny', 'incoming')
+            self.wg.ufw('default', 'allow', 'outgoing')
+            self.wg.ufw('allow', f"{port}/udp")
+            self.wg.ufw('--force', 'enable')
             print("[+] UFW configured successfully.")
         except Exception as e:
             return False, f"Failed to configure UFW: {e}"
-        if self._interface_exists(interface_name):
-            return False, f"Interface {interface_name} configuration file already exists."
-        default_interface = self._get_default_interface()
-        private_key, public_key = self._generate_keypair()
-        server_private_key_path = SERVER_PRIVATE_KEY_PATH.replace('X', str(new_wg_id))
-        server_public_key_path = SERVER_PUBLIC_KEY_PATH.replace('X', str(new_wg_id))
-        with open(server_private_key_path, "w") as f:
-            f.write(private_key)
-            os.chmod(server_private_key_path, 0o600)
-            with open(server_public_key_path, "w") as f:
-                f.write(public_key)
-        config = f"""[Interface]
+        with self._locks.hold(new_wg_id): # A concurrent creator picking the same id sees the file below
+            if self._interface_exists(interface_name):
+                return False, f"Interface {interface_name} configuration file already exists."
+            default_interface = self._get_default_interface()
+            private_key, public_key = self._generate_keypair()
+            server_private_key_path = SERVER_PRIVATE_KEY_PATH.replace('X', str(new_wg_id))
+            server_public_key_path = SERVER_PUBLIC_KEY_PATH.replace('X', str(new_wg_id))
+            with open(server_private_key_path, "w") as f:
+                f.write(private_key)
+                os.chmod(server_private_key_path, 0o600)
+                with open(server_public_key_path, "w") as f:
+                    f.write(public_key)
+            config = f"""[Interface]
 PrivateKey = {private_key}
 Address = {address_range}
 ListenPort = {port}
@@ -683,25 +940,25 @@ DNS = 8.8.8.8
 PostUp = iptables -A FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -A POSTROUTING -o {default_interface} -j MASQUERADE
 PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D POSTROUTING -o {default_interface} -j MASQUERADE
 """
-        try:
-            with open(path, "w") as f:
-                f.write(config)
-            os.chmod(path, 0o600)
-            print(f"[+] Interface {interface_name} created.")
-            self.run_command(f"sudo systemctl enable wg-quick@{interface_name}") # Enable service
-            self._reload_wireguard(new_wg_id) # Reload the new interface
-        except Exception as e:
-            return False, f"Failed to create or reload interface {interface_name}: {e}"
-
-        self.db.insert('interfaces', {
-            'wg': new_wg_id,
-            'private_key': private_key,
-            'public_key': public_key,
-            'port': port,
-            'address_range': address_range,
-            'status': True
-        })
-        return True, 'New Interface Created!'
+            try:
+                with open(path, "w") as f:
+                    f.write(config)
+                os.chmod(path, 0o600)
+                print(f"[+] Interface {interface_name} created.")
+                self.wg.service('enable', interface_name) # Enable service
+                self._reload_wireguard(new_wg_id) # Reload the new interface
+            except Exception as e:
+                return False, f"Failed to create or reload interface {interface_name}: {e}"
+
+            self.db.insert('interfaces', {
+                'wg': new_wg_id,
+                'private_key': private_key,
+                'public_key': public_key,
+                'port': port,
+                'address_range': address_range,
+                'status': True
+            })
+            return True, 'New Interface Created!'
 
     def _edit_interface(self, name: str, address: str = None, port: int = None, status: bool = None) -> tuple[bool, str]:
         """
@@ -718,61 +975,63 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
         if not self._interface_exists(name):
             return False, f"Interface {name} configuration file does not exist."
 
-        update_data = {}
-        reload_needed = False
-        service_action_needed = False
-
-        try:
-            # Read current config to modify
-            with open(config_path, "r") as f:
-                lines = f.readlines()
+        with self._locks.hold(wg_id):
+            update_data = {}
+            reload_needed = False
+            service_action_needed = False
 
-            new_lines = []
-            for line in lines:
-                if address is not None and line.strip().startswith("Address ="):
-                    if line.strip() != f"Address = {address}":
-                        new_lines.append(f"Address = {address}\n")
-                        update_data['address_range'] = address
-                        reload_needed = True
-                    else:
-                        new_lines.append(line)
-                elif port is not None and line.strip().startswith("ListenPort ="):
-                    if line.strip() != f"ListenPort = {port}":
-                        new_lines.append(f"ListenPort = {port}\n")
-                        update_data['port'] = port
-                        reload_needed = True
+            try:
+                # Read current config to modify
+                with open(config_path, "r") as f:
+                    lines = f.readlines()
+
+                new_lines = []
+                for line in lines:
+                    if address is not None and line.strip().startswith("Address ="):
+                        if line.strip() != f"Address = {address}":
+                            new_lines.append(f"Address = {address}\n")
+                            update_data['address_range'] = address
+                            reload_needed = True
+                        else:
+                            new_lines.append(line)
+                    elif port is not None and line.strip().startswith("ListenPort ="):
+                        if line.strip() != f"ListenPort = {port}":
+                            new_lines.append(f"ListenPort = {port}\n")
+                            update_data['port'] = port
+                            reload_needed = True
+                        else:
+                            new_lines.append(line)
                     else:
                         new_lines.append(line)
-                else:
-                    new_lines.append(line)
-
-            # Write updated config back
-            if reload_needed:
-                with open(config_path, "w") as f:
-                    f.writelines(new_lines)
-
-            # Handle status change (start/stop service)
-            if status is not None and status != current_interface['status']:
-                update_data['status'] = status
-                service_action_needed = True
-                if status: # Changing to Active
-                    self.run_command(f"sudo systemctl start wg-quick@{name}")
-                    print(f"[+] Interface {name} started.")
-                else: # Changing to Inactive
-                    self.run_command(f"sudo systemctl stop wg-quick@{name}")
-                    print(f"[+] Interface {name} stopped.")
 
-            # Perform DB update only if there's data to update
-            if update_data:
-                self.db.update('interfaces', update_data, {'wg': wg_id})
-
-            # Reload only if config file was changed and service wasn't explicitly started/stopped
-            if reload_needed and not service_action_needed:
-                self._reload_wireguard(wg_id)
-
-            return True, f"Interface {name} edited successfully."
-        except Exception as e:
-            return False, f"Error editing interface {name}: {e}"
+                # Write updated config back
+                if reload_needed:
+                    with open(config_path, "w") as f:
+                        f.writelines(new_lines)
+
+                # Handle status change (start/stop service)
+                if status is not None and status != current_interface['status']:
+                    update_data['status'] = status
+                    service_action_needed = True
+                    if status: # Changing to Active
+                        self.wg.service('start', name)
+                        print(f"[+] Interface {name} started.")
+                    else: # Changing to Inactive
+                        self.wg.service('stop', name)
+                        print(f"[+] Interface {name} stopped.")
+
+                # Perform DB update only if there's data to update
+                if update_data:
+                    self.db.update('interfaces', update_data, {'wg': wg_id})
+                    self._invalidate_config_caches(wg_id)
+
+                # Reload only if config file was changed and service wasn't explicitly started/stopped
+                if reload_needed and not service_action_needed:
+                    self._reload_wireguard(wg_id)
+
+                return True, f"Interface {name} edited successfully."
+            except Exception as e:
+                return False, f"Error editing interface {name}: {e}"
 
     def _delete_interface(self, wg_id: int) -> tuple[bool, str]:
         """
@@ -784,75 +1043,202 @@ PostDown = iptables -D FORWARD -i {interface_name} -j ACCEPT; iptables -t nat -D
         if not interface:
             return False, f"Interface {interface_name} not found."
 
-        try:
-            # 1. Stop and disable the WireGuard service
-            self.run_command(f"sudo systemctl stop wg-quick@{interface_name}", check=False)
-            self.run_command(f"sudo systemctl disable wg-quick@{interface_name}", check=False)
-            print(f"[+] WireGuard service wg-quick@{interface_name} stopped and disabled.")
-
-            # 2. Remove WireGuard configuration files and keys
-            config_path = WG_CONF_PATH.replace('X', str(wg_id))
-            private_key_path = SERVER_PRIVATE_KEY_PATH.replace('X', str(wg_id))
-            public_key_path = SERVER_PUBLIC_KEY_PATH.replace('X', str(wg_id))
-
-            if os.path.exists(config_path):
-                os.remove(config_path)
-                print(f"[+] Removed config file: {config_path}")
-            if os.path.exists(private_key_path):
-                os.remove(private_key_path)
-                print(f"[+] Removed private key: {private_key_path}")
-            if os.path.exists(public_key_path):
-                os.remove(public_key_path)
-                print(f"[+] Removed public key: {public_key_path}")
-
-            # 3. Delete all clients associated with this interface from the database
-            clients_to_delete = self.db.select('clients', where={'wg': wg_id})
-            for client in clients_to_delete:
-                self.db.delete('clients', {'name': client['name']})
-                print(f"[+] Deleted associated client: {client['name']}")
-
-            # 4. Delete the interface record from the database
-            self.db.delete('interfaces', {'wg': wg_id})
-            print(f"[+] Interface {interface_name} deleted from database.")
-
-            return True, f"Interface {interface_name} and all associated clients deleted successfully."
-        except Exception as e:
-            return False, f"Error deleting interface {interface_name}: {e}"
+        with self._locks.hold(wg_id):
+            try:
+                # 1. Stop and disable the WireGuard service
+                for action in ('stop', 'disable'):
+                    try:
+                        self.wg.service(action, interface_name)
+                    except CommandExecutionError as e:
+                        print(f"[!] Warning: {e}")
+                print(f"[+] WireGuard service wg-quick@{interface_name} stopped and disabled.")
+
+                # 2. Remove WireGuard configuration files and keys
+                config_path = WG_CONF_PATH.replace('X', str(wg_id))
+                private_key_path = SERVER_PRIVATE_KEY_PATH.replace('X', str(wg_id))
+                public_key_path = SERVER_PUBLIC_KEY_PATH.replace('X', str(wg_id))
+
+                if os.path.exists(config_path):
+                    os.remove(config_path)
+                    print(f"[+] Removed config file: {config_path}")
+                if os.path.exists(private_key_path):
+                    os.remove(private_key_path)
+                    print(f"[+] Removed private key: {private_key_path}")
+                if os.path.exists(public_key_path):
+                    os.remove(public_key_path)
+                    print(f"[+] Removed public key: {public_key_path}")
+
+                # 3. Delete all clients associated with this interface from the database
+                clients_to_delete = self.db.select('clients', where={'wg': wg_id})
+                for client in clients_to_delete:
+                    self.db.delete('clients', {'name': client['name']})
+                    self._config_cache.invalidate(client['name'])
+                    print(f"[+] Deleted associated client: {client['name']}")
+
+                self._invalidate_account_status()
+
+                # 4. Delete the interface record from the database
+                self.db.delete('interfaces', {'wg': wg_id})
+                self._invalidate_config_caches(wg_id)
+                print(f"[+] Interface {interface_name} deleted from database.")
+
+                return True, f"Interface {interface_name} and all associated clients deleted successfully."
+            except Exception as e:
+                return False, f"Error deleting interface {interface_name}: {e}"
 
 
-    def _get_client_config(self, name: str) -> tuple[bool, str]:
+    @staticmethod
+    def _render_client_config(client: dict, interface: dict, settings: dict) -> str:
         """
-        Generates and returns the WireGuard client configuration for a given client name.
+        Renders the WireGuard client config. This is the only copy of the template.
+        'client' needs private_key/address, 'interface' needs public_key/port and
+        'settings' holds the CONFIG_SETTING_KEYS values.
         """
-        client = self.db.get('clients', where={'name': name})
-        if not client:
-            return False, 'Client not found.'
-
-        interface = self.db.get('interfaces', where={'wg': client['wg']})
-        if not interface:
-            return False, f"Associated WireGuard interface wg{client['wg']} not found."
-
-        dns = self.db.get('settings', where={'key': 'dns'})['value']
-        mtu = self.db.get('settings', where={'key': 'mtu'})
-        mtu_value = mtu['value'] if mtu else '1420' # Default MTU if not found
-
-        server_ip = self.db.get('settings', where={'key': 'custom_endpont'})['value']
-
-        client_config = f"""
-[Interface]
+        return f"""[Interface]
 PrivateKey = {client['private_key']}
 Address = {client['address']}/32
-DNS = {dns}
-MTU = {mtu_value}
+DNS = {settings.get('dns') or '8.8.8.8'}
+MTU = {settings.get('mtu') or '1420'}
 
 [Peer]
 PublicKey = {interface['public_key']}
-Endpoint = {server_ip}:{interface['port']}
+Endpoint = {settings.get('custom_endpont')}:{interface['port']}
 AllowedIPs = 0.0.0.0/0, ::/0
 PersistentKeepalive = 25
 """
+
+    def _get_config_settings(self) -> dict:
+        """
+        Returns the settings used by client configs, read in one query and memoized per settings version.
+        """
+        self._sync_cache_generations()
+        cached = self._config_settings
+        if cached is not None and cached[0] == self._settings_version:
+            return cached[1]
+        version = self._settings_version
+        placeholders = ', '.join('?' * len(CONFIG_SETTING_KEYS))
+        rows = self.db.query(f"SELECT `key`, `value` FROM `settings` WHERE `key` IN ({placeholders})", CONFIG_SETTING_KEYS)
+        settings = {row['key']: row['value'] for row in rows}
+        self._config_settings = (version, settings)
+        return settings
+
+    def _get_client_config(self, name: str, public_key: str = None) -> tuple[bool, str]:
+        """
+        Generates and returns the WireGuard client configuration for a given client name.
+        When 'public_key' is given the client must also match it (public QR/detail pages).
+        Rendered configs are cached per (client, interface version, settings version).
+        """
+        self._sync_cache_generations()
+        cached = self._config_cache.get(name)
+        if cached is not None:
+            wg_id, interface_version, settings_version, client_public_key, config = cached
+            if interface_version == self._interface_versions.get(wg_id, 0) and settings_version == self._settings_version:
+                if public_key is not None and public_key != client_public_key:
+                    return False, 'Client not found.'
+                return True, config
+
+        where = {'name': name} if public_key is None else {'name': name, 'public_key': public_key}
+        client = self.db.get('clients', where=where)
+        if not client:
+            return False, 'Client not found.'
+
+        wg_id = client['wg']
+        interface_version, settings_version = self._interface_versions.get(wg_id, 0), self._settings_version
+        interface = self.db.get('interfaces', where={'wg': wg_id})
+        if not interface:
+            return False, f"Associated WireGuard interface wg{wg_id} not found."
+
+        client_config = self._render_client_config(client, interface, self._get_config_settings())
+        self._config_cache.set(name, (wg_id, interface_version, settings_version, client['public_key'], client_config))
         return True, client_config
 
+    def _iter_client_configs(self, names: list[str] = None, wg_id: int = None):
+        """
+        Yields (name, config) for many clients using one query per table instead of one per client.
+        'names' and 'wg_id' optionally narrow the selection.
+        """
+        interfaces = {row['wg']: Interface.from_row(row) for row in self.db.select('interfaces')}
+        settings = self._get_config_settings()
+        clients = self.db.iter_select('clients', ['name', 'wg', 'private_key', 'address'], {'wg': wg_id} if wg_id is not None else None)
+        wanted = set(names) if names else None
+        for client in clients:
+            if wanted is not None and client['name'] not in wanted:
+                continue
+            interface = interfaces.get(client['wg'])
+            if interface:
+                yield client['name'], self._render_client_config(client, interface, settings)
+
+    def _get_config_qr(self, config_content: str) -> tuple[bytes, str]:
+        """
+        Renders a client config as a QR code PNG, in-process and without temp files.
+        Returns (png_bytes, etag); the etag is the SHA-256 of the config, which also keys the cache.
+        """
+        digest = hashlib.sha256(config_content.encode()).hexdigest()
+        png = self._qr_cache.get(digest)
+        if png is None:
+            segno = optional_import('segno') # Pure-Python QR encoder; without it QR codes use the qrencode binary
+            if segno is not None:
+                buffer = io.BytesIO()
+                segno.make(config_content, error='m').save(buffer, kind='png', scale=5, border=4)
+                png = buffer.getvalue()
+            else:
+                # qrencode writes the PNG to stdout with '-o -', so nothing touches the disk
+                with metrics.SUBPROCESS_SECONDS.time('qrencode'):
+                    result = subprocess.run(['qrencode', '-o', '-', config_content], capture_output=True, check=True)
+                png = result.stdout
+            self._qr_cache.set(digest, png)
+        return png, digest
+
+    def _invalidate_config_caches(self, wg_id: int = None):
+        """
+        Invalidates rendered client configs and their QR codes.
+        Pass 'wg_id' when one interface changed; without it the config settings (endpoint, DNS, MTU) changed.
+        """
+        if wg_id is None:
+            self._settings_version += 1
+            self._config_settings = None
+        else:
+            self._interface_versions[wg_id] = self._interface_versions.get(wg_id, 0) + 1
+        self._qr_cache.invalidate()
+
+    def _sync_cache_generations(self):
+        """
+        Drops this process's cached settings, configs and account statuses whose tables changed.
+        Costs one PRAGMA when nothing was written; `cache_generation` is only read after a commit
+        (from this or any other connection), and only the scopes that moved are invalidated.
+        """
+        with self._generation_lock:
+            marker = (self.db.data_version(), self.db.write_count)
+            if marker == self._generation_marker:
+                return
+            generations = self.db.generations()
+            changed = {scope for scope, generation in generations.items() if self._generations.get(scope) != generation}
+            self._generations, self._generation_marker = generations, marker
+        if not changed:
+            return
+        if 'settings' in changed:
+            self._settings = None
+        if 'config' in changed:
+            self._invalidate_config_caches()
+        if changed & {'interfaces', 'clients'}:
+            self._config_cache.invalidate()
+            self._qr_cache.invalidate()
+        if changed & {'clients', 'users', 'traffic'}:
+            self._invalidate_account_status()
+
+    def _get_setting(self, key: str, default: str = None) -> str | None:
+        """
+        Returns a setting value from a per-process copy of the settings table.
+        The copy is reloaded whenever any connection writes to `settings`.
+        """
+        self._sync_cache_generations()
+        cached = self._settings
+        generation = self._generations.get('settings')
+        if cached is None or cached[0] != generation:
+            cached = (generation, {row['key']: row['value'] for row in self.db.select('settings', ['key', 'value'])})
+            self._settings = cached
+        return cached[1].get(key, default)
+
     def _change_settings(self, key: str, value: str) -> tuple[bool, str]:
         """
         Changes a specific setting in the database.
@@ -861,6 +1247,8 @@ PersistentKeepalive = 25
             return False, 'Invalid Key'
         # Corrected: Update the 'value' column for the given 'key'
         self.db.update('settings', {'value': value}, {'key': key})
+        if key in CONFIG_SETTING_KEYS:
+            self._invalidate_config_caches()
         return True, 'Changed!'
 
     def _add_api_token(self, name: str, token: str) -> tuple[bool, str]:
@@ -926,6 +1314,7 @@ PersistentKeepalive = 25
         """
         Generates a unique short alphanumeric code for a URL.
         """
+        from nanoid import generate
         characters = string.ascii_letters + string.digits
         while True:
             short_code = generate(characters, length) #
@@ -960,9 +1349,10 @@ PersistentKeepalive = 25
             client['interface_port'] = None
 
         # Add server endpoint details from settings
-        client['server_endpoint_ip'] = self.db.get('settings', where={'key': 'custom_endpont'})['value']
-        client['server_dns'] = self.db.get('settings', where={'key': 'dns'})['value']
-        client['server_mtu'] = self.db.get('settings', where={'key': 'mtu'})['value']
+        settings = self._get_config_settings()
+        client['server_endpoint_ip'] = settings.get('custom_endpont')
+        client['server_dns'] = settings.get('dns')
+        client['server_mtu'] = settings.get('mtu')
         return client
     def _is_telegram_bot_running(self, pid: int) -> bool:
         """
@@ -970,6 +1360,7 @@ PersistentKeepalive = 25
         """
         if pid <= 0:
             return False
+        import psutil
         try:
             process = psutil.Process(pid)
             return process.is_running() and "bot.py" in " ".join(process.cmdline())
@@ -1061,6 +1452,7 @@ PersistentKeepalive = 25
                 return True
 
             print("[*] Attempting to stop Telegram bot...")
+            import psutil
             try:
                 process = psutil.Process(current_pid)
                 cmdline = " ".join(process.cmdline()).lower()
@@ -1091,89 +1483,176 @@ PersistentKeepalive = 25
                 return False
         return False # Invalid action
 
-    def _calculate_and_update_traffic(self):
+    def _traffic_delta(self, client: Client, current: PeerStats | None) -> int:
+        """
+        Folds the interface's current rx/tx for a client into its counters and returns the bytes consumed since
+        the last reading. A peer missing from 'wg show dump' reads as 0/0.
+        """
+        current = current or PeerStats()
+        # Handle WireGuard counter resets: If current < last, assume reset and add current as delta.
+        if current.rx < client.last_wg_rx:
+            print(f"[*] Detected RX counter reset for client '{client.name}'. Adding current RX ({current.rx} bytes) as delta.")
+        if current.tx < client.last_wg_tx:
+            print(f"[*] Detected TX counter reset for client '{client.name}'. Adding current TX ({current.tx} bytes) as delta.")
+        return client.add_reading(current.rx, current.tx)
+
+    def _sync_chunking(self) -> tuple[int, float]:
+        """
+        Returns (clients per write transaction, seconds to pause between transactions) for background writers.
+        """
+        try:
+            chunk_size = max(1, int(self._get_setting('sync_chunk_size', '500')))
+        except ValueError:
+            chunk_size = 500
+        try:
+            pause = max(0.0, float(self._get_setting('sync_chunk_pause_ms', '5')) / 1000)
+        except ValueError:
+            pause = 0.005
+        return chunk_size, pause
+
+    def _traffic_chunk(self, chunk: list, readings: dict) -> tuple[list[tuple[str, str]], int, list[str]]:
+        """
+        The pure-Python traffic pass over one chunk of clients (see traffic_engine for the numpy one).
+        Returns ((used_trafic, name) rows that changed, bytes consumed, names of enabled clients at or over their quota).
+        """
+        rows, bandwidth, over_quota = [], 0, []
+        for row in chunk:
+            try:
+                client = Client.from_row(row)
+            except ValueError as e:
+                print(f"[!] {e}. Skipping this client's traffic update.")
+                continue
+            current = readings.get(client.public_key) or PeerStats()
+            if current.rx != client.last_wg_rx or current.tx != client.last_wg_tx:
+                bandwidth += self._traffic_delta(client, current)
+                rows.append((client.used_trafic_json(), client.name)) # Idle clients keep their row as it is
+            if client.status and client.quota > 0 and client.used >= client.quota:
+                over_quota.append(client.name)
+        return rows, bandwidth, over_quota
+
+    def _calculate_and_update_traffic(self, errors: list = None) -> list[str]:
         """
         Calculates and updates cumulative traffic for all clients.
-        This replaces the old traffic.json logic.
+        This replaces the old traffic.json logic. Interfaces that can't be read are added to 'errors'.
+        Returns the names of enabled clients now at or over their quota.
         """
         print("[*] Calculating and updating client traffic statistics...")
 
         # Get current traffic from all interfaces
         current_wg_traffic = {}
-        for interface_row in self.db.select('interfaces'):
-            wg_id = interface_row['wg']
-            current_wg_traffic.update(self._get_current_wg_peer_traffic(wg_id))
-
-        # Total bandwidth consumed by all clients in this cycle
-        total_bandwidth_consumed_this_cycle = 0
-
-        # Iterate through all clients in the database
-        all_clients_in_db = self.db.select('clients')
-        for client in all_clients_in_db:
-            client_public_key = client['public_key']
-            client_name = client['name']
-
-            # Get the current readings from 'wg show dump'
-            current_rx = current_wg_traffic.get(client_public_key, {}).get('rx', 0)
-            current_tx = current_wg_traffic.get(client_public_key, {}).get('tx', 0)
-
-            try:
-                # Parse existing used_trafic data (which now includes last_wg_rx/tx)
-                used_traffic_data = json.loads(client.get('used_trafic', '{"download":0,"upload":0,"last_wg_rx":0,"last_wg_tx":0}'))
-
-                cumulative_download = used_traffic_data.get('download', 0)
-                cumulative_upload = used_traffic_data.get('upload', 0)
-                last_wg_rx = used_traffic_data.get('last_wg_rx', 0)
-                last_wg_tx = used_traffic_data.get('last_wg_tx', 0)
-
-                # Calculate delta for this sync cycle
-                # Handle WireGuard counter resets: If current < last, assume reset and add current as delta.
-                delta_rx = current_rx - last_wg_rx
-                if delta_rx < 0:
-                    print(f"[*] Detected RX counter reset for client '{client_name}'. Adding current RX ({current_rx} bytes) as delta.")
-                    delta_rx = current_rx
-
-                delta_tx = current_tx - last_wg_tx
-                if delta_tx < 0:
-                    print(f"[*] Detected TX counter reset for client '{client_name}'. Adding current TX ({current_tx} bytes) as delta.")
-                    delta_tx = current_tx
-
-                delta_rx = max(0, delta_rx) # Ensure non-negative
-                delta_tx = max(0, delta_tx) # Ensure non-negative
-
-                # Update cumulative totals
-                cumulative_download += delta_rx
-                cumulative_upload += delta_tx
-
-                # Prepare updated JSON for DB
-                updated_used_traffic = {
-                    'download': cumulative_download,
-                    'upload': cumulative_upload,
-                    'last_wg_rx': current_rx, # Store current readings for next cycle's delta calculation
-                    'last_wg_tx': current_tx
-                }
-
-                self.db.update('clients', {'used_trafic': json.dumps(updated_used_traffic)}, {'name': client_name})
-
-                total_bandwidth_consumed_this_cycle += (delta_rx + delta_tx)
-
-            except (json.JSONDecodeError, ValueError, TypeError) as e:
-                print(f"[!] Error processing traffic for client '{client_name}': {e}. Skipping this client's traffic update.")
-
-        # Update overall server bandwidth in settings
-        old_bandwidth_setting = self.db.get('settings', where={'key': 'bandwidth'})
-        current_total_bandwidth = int(old_bandwidth_setting['value']) if old_bandwidth_setting and old_bandwidth_setting['value'].isdigit() else 0
-        new_total_bandwidth = current_total_bandwidth + total_bandwidth_consumed_this_cycle
-        self.db.update('settings', {'value': str(new_total_bandwidth)}, {'key': 'bandwidth'})
+        interface_ids = [interface_row['wg'] for interface_row in self.db.select('interfaces')]
+        for peer_traffic in self._map_interfaces(self._get_current_wg_peer_traffic, interface_ids, errors).values():
+            current_wg_traffic.update(peer_traffic)
+
+        # Clients are read and written in chunks, each one short BEGIN IMMEDIATE transaction that also adds its
+        # bytes to 'bandwidth', so every commit is consistent and API writes get the write lock between chunks
+        chunk_size, pause = self._sync_chunking()
+        np = traffic_engine.load_numpy()
+        peers = traffic_engine.PeerCounters(np, current_wg_traffic) if np else None
+        total_bandwidth_consumed_this_cycle, resets, over_quota = 0, 0, []
+        last_rowid = 0
+        while True:
+            with self.db.transaction():
+                if peers:
+                    chunk = self.db.query(traffic_engine.CHUNK_QUERY, (last_rowid, chunk_size), 'rows')
+                else:
+                    chunk = self.db.query("SELECT `rowid`, `name`, `public_key`, `status`, `traffic`, `used_trafic` FROM `clients` "
+                                          "WHERE `rowid` > ? ORDER BY `rowid` LIMIT ?", (last_rowid, chunk_size))
+                if not chunk:
+                    break
+                last_rowid = chunk[-1]['rowid']
+                if peers:
+                    rows, chunk_bandwidth, chunk_over_quota, chunk_resets = peers.apply_chunk(chunk)
+                    resets += chunk_resets
+                else:
+                    rows, chunk_bandwidth, chunk_over_quota = self._traffic_chunk(chunk, current_wg_traffic)
+                self.db.update_many('clients', ['used_trafic'], 'name', rows)
+                if chunk_bandwidth:
+                    self.db.increment_setting('bandwidth', chunk_bandwidth)
+                total_bandwidth_consumed_this_cycle += chunk_bandwidth
+                over_quota += chunk_over_quota
+            if len(chunk) < chunk_size:
+                break
+            time.sleep(pause)
+        if resets:
+            print(f"[*] Detected counter resets for {resets} clients; their current counters were added as new traffic.")
+        print(f"[*] {total_bandwidth_consumed_this_cycle} bytes of new traffic this cycle"
+              f"{' (numpy engine)' if peers else ''}.")
+        self.db.bump_generation('traffic') # used_trafic isn't trigger-watched; tell the API workers once per run
+        self._invalidate_account_status()
         print("[*] Client traffic statistics updated.")
+        return over_quota
 
 
     def _sync(self):
         """
         Synchronizes client data, traffic, and performs scheduled tasks.
         This method should be run periodically (e.g., via cron).
+        Every run is recorded in `sync_runs` with its phase timings, counts and errors (see _get_sync_history).
         """
         print("[*] Starting synchronization process...")
+        phases = metrics.PhaseTimer(metrics.SYNC_PHASE_SECONDS)
+        run = {'clients_examined': 0, 'clients_disabled': 0, 'errors': []}
+        run_id = self._start_sync_run()
+        wg_ops_before = self.wg.op_count
+        status = 'failed'
+        try:
+            self._sync_phases(phases, run)
+            status = 'partial' if run['errors'] else 'ok'
+        except Exception as e:
+            run['errors'].append(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self._finish_sync_run(run_id, status, phases, run, self.wg.op_count - wg_ops_before)
+
+    def _start_sync_run(self) -> int | None:
+        try:
+            return self.db.insert('sync_runs', {'started_at': datetime.now().isoformat()})
+        except Exception as e: # The ledger is bookkeeping; it never stops a sync
+            print(f"[!] Could not record sync run start: {e}")
+            return None
+
+    def _finish_sync_run(self, run_id: int | None, status: str, phases: metrics.PhaseTimer, run: dict, wg_commands: int):
+        if run_id is None:
+            return
+        try:
+            self.db.update('sync_runs', {
+                'finished_at': datetime.now().isoformat(),
+                'duration': round(phases.elapsed(), 6),
+                'status': status,
+                'phases': json.dumps({phase: round(seconds, 6) for phase, seconds in phases.durations.items()}),
+                'clients_examined': run['clients_examined'],
+                'clients_disabled': run['clients_disabled'],
+                'wg_commands': wg_commands,
+                'errors': json.dumps(run['errors'][:50]),
+            }, {'id': run_id})
+            self.db._execute_query("DELETE FROM `sync_runs` WHERE `id` <= ?", (run_id - SYNC_HISTORY_KEEP,))
+        except Exception as e:
+            print(f"[!] Could not record sync run {run_id}: {e}")
+
+    def _get_sync_history(self, limit: int = 100, before_id: int = None) -> list[dict]:
+        """
+        Returns recorded _sync runs, newest first, with 'phases' and 'errors' decoded.
+        'before_id' pages back through older runs.
+        """
+        where, params = ("WHERE `id` < ?", (before_id,)) if before_id else ("", ())
+        runs = self.db.query(f"SELECT * FROM `sync_runs` {where} ORDER BY `id` DESC LIMIT ?", params + (limit,))
+        for sync_run in runs:
+            sync_run['phases'] = json.loads(sync_run['phases'] or '{}')
+            sync_run['errors'] = json.loads(sync_run['errors'] or '[]')
+        return runs
+
+    def _get_forecast(self, hours: float = 24, limit: int = None) -> dict | None:
+        """
+        Returns the clients forecast to run out of traffic or time within 'hours', soonest first, as of the last _sync;
+        None when no sync has computed a forecast (or numpy isn't installed).
+        """
+        return forecast.read(self.db.db_path, hours, limit)
+
+    def _sync_phases(self, phases: metrics.PhaseTimer, run: dict):
+        """
+        The phases of one _sync run; fills 'run' with what the `sync_runs` ledger records.
+        """
 
         # --- Handle Reset Timer for Interface Reloads ---
         reset_time_setting = self.db.get('settings', where={'key': 'reset_time'})
@@ -1208,70 +1687,109 @@ PersistentKeepalive = 25
                     print(f"[*] Reset timer updated. Next reset scheduled for {datetime.fromtimestamp(new_future_reset_timestamp)}.")
 
                     # Reload all active interfaces
-                    for interface in self.db.select('interfaces', where={'status': True}):
-                        self._reload_wireguard(interface['wg'])
+                    self._map_interfaces(self._reload_wireguard, [interface['wg'] for interface in self.db.select('interfaces', where={'status': True})],
+                                         run['errors'])
                 else:
                     print(f"[*] Next reset in {scheduled_reset_timestamp - int(time.time())} seconds.")
         else:
             if os.path.exists(reset_timer_file):
                 os.remove(reset_timer_file) # Clean up if reset_time is 0
-
+        phases.lap('reset_timer')
 
         # --- Auto Backup ---
         auto_backup_setting = self.db.get('settings', where={'key': 'auto_backup'})
         auto_backup_enabled = bool(int(auto_backup_setting['value'])) if auto_backup_setting and auto_backup_setting['value'].isdigit() else False
 
         if auto_backup_enabled:
-            print("[*] Performing auto backup of WireGuard configurations...")
-            for interface in self.db.select('interfaces'):
-                self._backup_config(interface['wg'])
+            import backup
+            backup_dir = backup.backup_dir_for(self.db.db_path)
+            interval = self.db.get('settings', where={'key': 'backup_interval'})
+            keep = self.db.get('settings', where={'key': 'backup_keep'})
+            try:
+                if backup.snapshot_due(backup_dir, float(interval['value']) if interval else 60):
+                    print("[*] Performing auto backup of the database and WireGuard configurations...")
+                    backup.create_snapshot(self.db.db_path, WG_DIR, backup_dir, self._locks.hold)
+                    removed = backup.prune(backup_dir, int(keep['value']) if keep else 48)
+                    if removed:
+                        print(f"[*] Pruned {removed} old backups.")
+            except Exception as e:
+                print(f"[!] Auto backup failed: {e}")
+                run['errors'].append(f"backup: {e}")
+        phases.lap('backup')
 
         # --- Client Expiration and Traffic Limit Enforcement (Disable, not Delete) ---
         current_time = datetime.now()
-        # FIX: Fetch all clients to disable into a list first, BEFORE iterating and updating
+        # Collect the names to disable while streaming the active clients, then disable them in one batch
         clients_to_disable = []
-        active_clients = self.db.select('clients', where={'status': True})
-        for client in active_clients: # Iterating over fetched results
+        active_clients = self.db.iter_select('clients', ['name', 'expires', 'traffic', 'used_trafic'], {'status': True},
+                                             row_type='named')
+        for client in active_clients:
+            run['clients_examined'] += 1
             should_disable = False
             disable_reason = ""
 
             # Check expiration
             try:
-                expires_dt = datetime.fromisoformat(client['expires'])
+                expires_dt = datetime.fromisoformat(client.expires)
                 if current_time >= expires_dt:
                     should_disable = True
                     disable_reason = "expired"
             except (ValueError, TypeError):
-                print(f"[!] Warning: Invalid expires date format for client '{client['name']}'. Skipping expiration check.")
+                print(f"[!] Warning: Invalid expires date format for client '{client.name}'. Skipping expiration check.")
 
             # Check traffic limit (only if not already marked for disabling by expiration)
             if not should_disable:
                 try:
-                    traffic_limit = int(client['traffic']) # Expected total traffic quota in bytes
-                    used_traffic_data = json.loads(client['used_trafic'])
+                    traffic_limit = int(client.traffic) # Expected total traffic quota in bytes
+                    used_traffic_data = json.loads(client.used_trafic)
                     total_used_traffic = used_traffic_data.get('download', 0) + used_traffic_data.get('upload', 0)
 
                     if traffic_limit > 0 and total_used_traffic >= traffic_limit:
                         should_disable = True
                         disable_reason = "exceeded traffic limit"
                 except (ValueError, TypeError, json.JSONDecodeError) as e:
-                    print(f"[!] Warning: Invalid traffic data for client '{client['name']}'. Skipping traffic limit check. Error: {e}")
+                    print(f"[!] Warning: Invalid traffic data for client '{client.name}'. Skipping traffic limit check. Error: {e}")
 
             if should_disable:
-                clients_to_disable.append(client['name']) # Collect names to disable
+                clients_to_disable.append(client.name) # Collect names to disable
+
+        # Now disable the collected names in one batch
+        if clients_to_disable:
+            print(f"[!] {len(clients_to_disable)} clients need disabling: {', '.join(clients_to_disable[:20])}"
+                  f"{' ...' if len(clients_to_disable) > 20 else ''}")
+            disabled = []
+            success, message = self._disable_clients(clients_to_disable, disabled)
+            run['clients_disabled'] = len(disabled)
+            if not success:
+                run['errors'].append(message)
+        phases.lap('enforce_limits')
 
-        # Now, iterate over the collected names and perform the database updates
-        for client_name_to_disable in clients_to_disable:
-            print(f"[!] Client '{client_name_to_disable}' needs disabling. Disabling...")
-            self._disable_client(client_name_to_disable)
         # --- Update Traffic Statistics ---
-        self._calculate_and_update_traffic()
+        if collector_alive(self.db.db_path):
+            print("[*] Traffic collector is running; leaving traffic statistics to it.")
+        else:
+            over_quota = self._calculate_and_update_traffic(run['errors'])
+            if over_quota:
+                # Crossed their limit during this pass; the collector disables these right away too
+                print(f"[!] {len(over_quota)} clients reached their traffic limit this cycle. Disabling...")
+                disabled = []
+                success, message = self._disable_clients(over_quota, disabled)
+                run['clients_disabled'] += len(disabled)
+                if not success:
+                    run['errors'].append(message)
+        phases.lap('traffic')
+
+        # --- Forecast Quota Exhaustion and Expiry ---
+        success, message = forecast.update(self.db)
+        print(f"[{'*' if success else '!'}] {message}")
+        if not success:
+            run['errors'].append(message)
+        phases.lap('forecast')
 
         # --- Update Uptime ---
         # Get system boot time and calculate uptime
-        boot_time_timestamp = psutil.boot_time() # Returns UTC timestamp
-        current_timestamp = time.time()
-        calculated_uptime_seconds = int(current_timestamp - boot_time_timestamp)
+        # CLOCK_BOOTTIME counts from boot including suspend, like psutil.boot_time(), without importing psutil
+        calculated_uptime_seconds = int(time.clock_gettime(time.CLOCK_BOOTTIME))
         self.db.update('settings', {'value': str(calculated_uptime_seconds)}, {'key': 'uptime'})
         print("[*] Uptime updated.")
 
@@ -1284,9 +1802,7 @@ PersistentKeepalive = 25
             self.db.update('settings', {'value': actual_ap_port}, {'key': 'ap_port'})
             print(f"[*] Updated ap_port in settings to reflect environment variable: {actual_ap_port}")
 
+        phases.lap('settings')
+        metrics.SYNC_SECONDS.observe(phases.elapsed())
+        metrics.SYNC_LAST_SUCCESS.set(time.time())
         print("[*] Synchronization process completed.")
-
-
-# Custom exception for command execution errors
-class CommandExecutionError(Exception):
-    pass
\ No newline at end of file
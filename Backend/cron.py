@@ -1,5 +1,7 @@
 # cron.py
 import core
+import db
+import metrics
 import traceback
 
 # Create the panel instance, which opens a database connection
@@ -8,7 +10,10 @@ co = core.CandyPanel()
 try:
     # Run the synchronization process
     print("Starting sync process...")
+    profile_token = db.start_query_profile() if db.PROFILE_QUERIES else None
     co._sync()
+    if profile_token is not None:
+        print(f"[db-profile] sync: {db.stop_query_profile(profile_token).summary()}")
     print("Sync process completed successfully.")
 except Exception as e:
     # Log any errors that occur during the sync
@@ -16,6 +21,8 @@ except Exception as e:
     traceback.print_exc()
 finally:
     # This block will run whether the sync succeeds or fails
+    # Hand this run's timings to the API process's /metrics
+    metrics.REGISTRY.flush('sync')
     if hasattr(co, 'db') and co.db.conn is not None:
         print("Closing database connection.")
         co.db.close()
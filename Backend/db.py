@@ -1,20 +1,161 @@
 # db.py
 import sqlite3
 import time
-import json , os
+import json , os, re, queue
+import contextvars
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from collections import namedtuple
+from functools import lru_cache
+import metrics
+
+# Stored in PRAGMA user_version once tables, triggers and default settings are in place; connections to a database
+# at this version skip that work. Bump it whenever _initialize_tables or the default settings change.
+SCHEMA_VERSION = 3
+CONFIG_SETTING_KEYS = ('custom_endpont', 'dns', 'mtu') # Settings baked into client configs
+# Client columns that per-process caches depend on; traffic counters are tracked by the 'traffic' scope instead
+CLIENT_CACHE_COLUMNS = ('name', 'wg', 'public_key', 'private_key', 'address', 'created_at', 'expires', 'note', 'traffic', 'status')
+# (scope, table, columns an UPDATE must touch or None for any, row filter or None)
+CACHE_GENERATION_TRIGGERS = [
+    ('settings', 'settings', None, None),
+    ('config', 'settings', None, "{row}.`key` IN (" + ', '.join(f"'{k}'" for k in CONFIG_SETTING_KEYS) + ")"),
+    ('interfaces', 'interfaces', None, None),
+    ('clients', 'clients', CLIENT_CACHE_COLUMNS, None),
+    ('users', 'users', None, None),
+]
+CACHE_SCOPES = ('settings', 'config', 'interfaces', 'clients', 'users', 'traffic')
+# Opt-in query profiler: per-request query summaries plus a slow-query log with EXPLAIN QUERY PLAN
+PROFILE_QUERIES = os.environ.get('CANDY_DB_PROFILE', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('CANDY_SLOW_QUERY_MS', '100'))
+# Group commit (CANDY_DB_GROUP_COMMIT=1, set for the API service): INSERT/UPDATE/DELETE statements from any thread
+# are queued to one writer thread per connection, which runs everything queued (up to GROUP_COMMIT_MAX statements,
+# waiting up to CANDY_DB_GROUP_COMMIT_WINDOW_MS for more after the first) and commits them together.
+# Durability is unchanged: a write returns, or its future resolves, only after the commit that includes it,
+# so an acknowledged write survives a crash exactly as before; only the fsync is shared. Statements of one batch
+# become visible to other connections together. A statement that fails gets its own exception and the rest of
+# the batch still commits; if the commit itself fails, every statement in the batch gets that error.
+GROUP_COMMIT = os.environ.get('CANDY_DB_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('CANDY_DB_GROUP_COMMIT_WINDOW_MS', '0'))
+GROUP_COMMIT_MAX = 256
+ITER_CHUNK_SIZE = 500 # Rows per page of iter_select
+REPEATED_QUERY_WARN = 5 # A statement run this often in one request is logged as a likely N+1
+_query_profile = contextvars.ContextVar('candy_query_profile', default=None)
+
+@lru_cache(maxsize=1024)
+def _normalize_query(query: str) -> str:
+    """
+    Collapses whitespace and placeholder lists so one call site maps to one profiler entry.
+    """
+    return re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", ' '.join(query.split()))
+
+class QueryProfile:
+    def __init__(self):
+        """
+        Statements run while this profile is active, keyed by normalized text:
+        {statement: [calls, total_ms, rows, params]}.
+        """
+        self.count = 0
+        self.elapsed_ms = 0.0
+        self.statements = {}
+
+    def record(self, statement: str, params: int, rows: int, elapsed_ms: float):
+        self.count += 1
+        self.elapsed_ms += elapsed_ms
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, elapsed_ms, rows, params]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed_ms
+            entry[2] += rows
+
+    def most_repeated(self) -> tuple[str, int]:
+        if not self.statements:
+            return '', 0
+        statement, entry = max(self.statements.items(), key=lambda item: item[1][0])
+        return statement, entry[0]
+
+    def summary(self) -> str:
+        """
+        One-line summary for the X-DB-Queries header.
+        """
+        statement, calls = self.most_repeated()
+        text = f"{self.count} queries; {self.elapsed_ms:.2f}ms; {len(self.statements)} distinct"
+        if calls > 1:
+            text += f"; top {calls}x {statement[:120]}"
+        return text
+
+    def log_if_repetitive(self, label: str):
+        """
+        Prints the profile when a single statement repeated often enough to look like an N+1 pattern.
+        """
+        statement, calls = self.most_repeated()
+        if calls >= REPEATED_QUERY_WARN:
+            print(f"[db-profile] {label}: {self.count} queries in {self.elapsed_ms:.2f}ms; {calls}x {statement}")
+
+def start_query_profile() -> contextvars.Token:
+    """
+    Starts collecting every statement run in the current context (and threads/executors it is copied into).
+    """
+    return _query_profile.set(QueryProfile())
+
+def stop_query_profile(token: contextvars.Token) -> QueryProfile:
+    profile = _query_profile.get()
+    try:
+        _query_profile.reset(token)
+    except ValueError: # Token from another context; just detach
+        _query_profile.set(None)
+    return profile
+
+@lru_cache(maxsize=1024)
+def _classify_query(query: str) -> tuple[str, str]:
+    """
+    Returns (table, operation) metric labels for a statement; memoized since call sites reuse their SQL.
+    """
+    operation = query.lstrip().split(None, 1)[0].upper() if query.strip() else ''
+    match = re.search(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+`?(\w+)`?", query, re.IGNORECASE)
+    if operation == 'PRAGMA':
+        return 'pragma', operation
+    return (match.group(1) if match else ''), operation
+
+@lru_cache(maxsize=64)
+def _named_row(columns: tuple):
+    return namedtuple('Row', columns, rename=True)
+
+class _QueuedWrite:
+    __slots__ = ('query', 'params', 'future', 'queued_at', 'result', 'error')
+
+    def __init__(self, query: str, params: tuple, future):
+        self.query = query
+        self.params = params
+        self.future = future
+        self.queued_at = time.perf_counter()
+        self.result = None
+        self.error = None
 
 class SQLite:
-    def __init__(self, db_path='CandyPanel.db'):
+    def __init__(self, db_path=None, group_commit: bool = None):
         """
         Initializes the SQLite database connection.
+        The path defaults to $CANDY_DB_PATH, then 'CandyPanel.db' next to this file.
+        'group_commit' defaults to $CANDY_DB_GROUP_COMMIT; see GROUP_COMMIT.
         """
+        db_path = db_path or os.environ.get('CANDY_DB_PATH', 'CandyPanel.db')
         script_dir = os.path.dirname(os.path.abspath(__file__))
         self.db_path = os.path.join(script_dir, db_path)
         self.conn = None
         self.cursor = None
+        self.write_count = 0 # Commits made through this connection; PRAGMA data_version only counts other connections
+        self._transaction_depth = 0 # > 0 inside transaction(); statements then leave the commit to it
+        self.group_commit = GROUP_COMMIT if group_commit is None else group_commit
+        self._write_queue = None # Pending _QueuedWrite items for the group-commit writer, created on first write
+        self._writer = None
+        # The connection and its shared cursor are used from several threads; one statement at a time
+        self._lock = threading.RLock()
         self._connect()
-        self._initialize_tables()
+        if self.cursor.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._initialize_tables()
 
     def _connect(self):
         """
@@ -99,18 +240,58 @@ class SQLite:
                     FOREIGN KEY (`telegram_id`) REFERENCES `users`(`telegram_id`)
                 );
             """)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS `cache_generation` (
+                    `scope` TEXT PRIMARY KEY,
+                    `generation` INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+            self.cursor.executemany("INSERT OR IGNORE INTO `cache_generation` (`scope`) VALUES (?)", [(scope,) for scope in CACHE_SCOPES])
+            # One row per _sync run; 'phases' is a JSON object of phase -> seconds, 'errors' a JSON list of messages
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS `sync_runs` (
+                    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+                    `started_at` TEXT NOT NULL,
+                    `finished_at` TEXT,
+                    `duration` REAL,
+                    `status` TEXT NOT NULL DEFAULT 'running', -- 'running', 'ok', 'partial' (some errors) or 'failed'
+                    `phases` TEXT NOT NULL DEFAULT '{}',
+                    `clients_examined` INTEGER NOT NULL DEFAULT 0,
+                    `clients_disabled` INTEGER NOT NULL DEFAULT 0,
+                    `wg_commands` INTEGER NOT NULL DEFAULT 0,
+                    `errors` TEXT NOT NULL DEFAULT '[]'
+                );
+            """)
+            self._create_generation_triggers()
+            self.conn.commit()
+            self._insert_default_settings()
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             self.conn.commit()
-            if self.count('settings') == 0:
-                self._insert_default_settings()
 
         except sqlite3.Error as e:
             print(f"Database table initialization error: {e}")
             raise RuntimeError(f"Database table initialization error: {e}")
 
+    def _create_generation_triggers(self):
+        """
+        Bumps `cache_generation` from triggers, so a write from any process or connection
+        (another worker, cron.py, the bot) is visible to every worker's in-memory caches.
+        """
+        for scope, table, columns, condition in CACHE_GENERATION_TRIGGERS:
+            for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                of = f" OF {', '.join(f'`{c}`' for c in columns)}" if columns and event == 'UPDATE' else ''
+                when = f" WHEN {condition.format(row=row)}" if condition else ''
+                self.cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS `cache_gen_{scope}_{event.lower()}` AFTER {event}{of} ON `{table}`{when}
+                    BEGIN
+                        UPDATE `cache_generation` SET `generation` = `generation` + 1 WHERE `scope` = '{scope}';
+                    END;
+                """)
+
     def _insert_default_settings(self):
         """
-        Inserts initial default settings into the 'settings' table.
-        Includes settings for CandyPanel and Telegram Bot.
+        Inserts default settings that are missing from the 'settings' table, so settings added
+        in later versions also appear in existing databases. Includes settings for CandyPanel and Telegram Bot.
         """
         default_settings = [
             {'key': 'server_ip', 'value': '192.168.1.100'},
@@ -136,31 +317,178 @@ class SQLite:
             {'key': 'install', 'value': '0'},
             {'key': 'telegram_bot_pid', 'value': '0'},
             {'key': 'ap_port', 'value': '3446'},
+            {'key': 'reload_mode', 'value': 'reconcile'}, # 'reconcile' or 'restart', see CandyPanel._reload_wireguard
+            {'key': 'quota_watch_margin', 'value': '1073741824'}, # Bytes (or 'N%') left at which collector.py watches a client closely
+            {'key': 'quota_watch_interval', 'value': '2'}, # Seconds between those close checks; 0 turns them off
+            {'key': 'backup_interval', 'value': '60'}, # Minutes between auto backup snapshots, see backup.py
+            {'key': 'backup_keep', 'value': '48'}, # Snapshots kept; older ones are pruned
+            {'key': 'sync_chunk_size', 'value': '500'}, # Clients per write transaction in _sync and collector flushes
+            {'key': 'sync_chunk_pause_ms', 'value': '5'}, # Pause between those transactions, for interactive writers
         ]
-        for setting in default_settings:
+        existing = {row['key'] for row in self.select('settings', ['key'])}
+        missing = [setting for setting in default_settings if setting['key'] not in existing]
+        for setting in missing:
             self.insert('settings', setting)
-        print("Default settings inserted.")
+        if missing:
+            print(f"Default settings inserted: {', '.join(setting['key'] for setting in missing)}")
 
     def _execute_query(self, query: str, params: tuple = (), fetch_type: str = None):
         """
         Executes a SQL query with given parameters.
-        'fetch_type' can be 'all' (for fetchall), 'one' (for fetchone), or None (for DML operations).
+        'fetch_type' can be 'all' (for fetchall), 'one' (for fetchone), 'rows' (fetchall as sqlite3.Row)
+        or None (for DML operations).
         """
+        if fetch_type is None and self.group_commit and not self._transaction_depth:
+            return self.submit_write(query, params).result()
+        start = time.perf_counter()
+        rows = 0
         try:
-            self.cursor.execute(query, params)
-            if fetch_type == 'all':
-                return [dict(row) for row in self.cursor.fetchall()]
-            elif fetch_type == 'one':
-                row = self.cursor.fetchone()
-                return dict(row) if row else None
-            else:
-                self.conn.commit()
-                if 'INSERT' in query.upper():
-                    return self.cursor.lastrowid
-                return self.cursor.rowcount
+            with self._lock:
+                self.cursor.execute(query, params)
+                if fetch_type == 'all':
+                    result = [dict(row) for row in self.cursor.fetchall()]
+                    rows = len(result)
+                elif fetch_type == 'rows':
+                    result = self.cursor.fetchall()
+                    rows = len(result)
+                elif fetch_type == 'one':
+                    row = self.cursor.fetchone()
+                    result = dict(row) if row else None
+                    rows = int(row is not None)
+                else:
+                    if not self._transaction_depth:
+                        self.conn.commit()
+                        self.write_count += 1
+                    rows = self.cursor.rowcount
+                    result = self.cursor.lastrowid if 'INSERT' in query.upper() else rows
+            return result
         except sqlite3.Error as e:
             print(f"Database query failed: {e}\nQuery: {query}\nParams: {params}")
             raise 
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.DB_QUERY_SECONDS.observe(elapsed, *_classify_query(query))
+            if PROFILE_QUERIES:
+                self._profile_query(query, params, rows, elapsed * 1000)
+
+    def _profile_query(self, query: str, params: tuple, rows: int, elapsed_ms: float):
+        """
+        Adds a statement to the active request profile and logs it with its query plan when slow.
+        """
+        statement = _normalize_query(query)
+        profile = _query_profile.get()
+        if profile is not None:
+            profile.record(statement, len(params), rows, elapsed_ms)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            try:
+                with self._lock:
+                    plan = [row[3] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+            except sqlite3.Error as e:
+                plan = [f"unavailable: {e}"]
+            print(f"[slow-query] {elapsed_ms:.1f}ms, {len(params)} params, {rows} rows: {statement}\n"
+                  + '\n'.join(f"    plan: {line}" for line in plan))
+
+    def submit_write(self, query: str, params: tuple = ()):
+        """
+        Queues one INSERT/UPDATE/DELETE for the group-commit writer thread and returns a concurrent.futures.Future
+        that resolves to its lastrowid (INSERT) or rowcount once the batch containing it is committed.
+        """
+        from concurrent.futures import Future
+        with self._lock:
+            if self._writer is None:
+                self._write_queue = queue.SimpleQueue()
+                self._writer = threading.Thread(target=self._write_loop, name='candy-db-writer', daemon=True)
+                self._writer.start()
+        future = Future()
+        self._write_queue.put(_QueuedWrite(query, params, future))
+        return future
+
+    def _write_loop(self):
+        """
+        Group-commit writer: takes everything queued (waiting up to GROUP_COMMIT_WINDOW_MS after the first
+        statement for more), runs it in one transaction and resolves each statement's future after the commit.
+        """
+        while True:
+            batch = [self._write_queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + GROUP_COMMIT_WINDOW_MS / 1000
+            stop = False
+            while len(batch) < GROUP_COMMIT_MAX:
+                try:
+                    timeout = deadline - time.monotonic()
+                    item = self._write_queue.get(timeout=timeout) if timeout > 0 else self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+            if stop:
+                return
+
+    def _commit_batch(self, batch: list[_QueuedWrite]):
+        with self._lock:
+            cursor = self.conn.cursor()
+            for item in batch:
+                try:
+                    cursor.execute(item.query, item.params)
+                    item.result = cursor.lastrowid if 'INSERT' in item.query.upper() else cursor.rowcount
+                except sqlite3.Error as e:
+                    item.error = e
+                    if not self.conn.in_transaction:
+                        # SQLite rolled back the whole transaction (e.g. disk full), not just this statement
+                        for earlier in batch[:batch.index(item)]:
+                            if earlier.error is None:
+                                earlier.error = e
+            try:
+                self.conn.commit()
+                self.write_count += 1
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                for item in batch:
+                    item.error = item.error or e
+        now = time.perf_counter()
+        for item in batch:
+            metrics.DB_QUERY_SECONDS.observe(now - item.queued_at, *_classify_query(item.query))
+            if item.error is not None:
+                print(f"Database query failed: {item.error}\nQuery: {item.query}\nParams: {item.params}")
+                item.future.set_exception(item.error)
+            else:
+                item.future.set_result(item.result)
+
+    def query(self, query: str, params: tuple = (), fetch_type: str = 'all'):
+        """
+        Runs a raw read query, for lookups (e.g. joins) the table helpers can't express.
+        'fetch_type' is 'all' (list of dicts), 'one' (dict or None) or 'rows' (list of sqlite3.Row, skipping the dicts).
+        """
+        return self._execute_query(query, params, fetch_type)
+
+    def data_version(self) -> int:
+        """
+        Returns PRAGMA data_version, which changes whenever another connection commits to the database.
+        """
+        return self._execute_query("PRAGMA data_version", (), 'one')['data_version']
+
+    def generations(self) -> dict:
+        """
+        Returns {scope: generation} from `cache_generation`.
+        """
+        return {row['scope']: row['generation'] for row in self._execute_query("SELECT `scope`, `generation` FROM `cache_generation`", (), 'all')}
+
+    def bump_generation(self, scope: str):
+        """
+        Marks a cache scope as changed for every process; for writes the triggers don't cover (e.g. traffic counters).
+        """
+        return self._execute_query("UPDATE `cache_generation` SET `generation` = `generation` + 1 WHERE `scope` = ?", (scope,))
+
+    def increment_setting(self, key: str, amount: int):
+        """
+        Adds 'amount' to a numeric setting in one statement; a missing or malformed value counts as 0.
+        """
+        return self._execute_query("UPDATE `settings` SET `value` = CAST(CAST(`value` AS INTEGER) + ? AS TEXT) WHERE `key` = ?",
+                                   (amount, key))
 
     def select(self, table: str, columns: str | list[str] = '*', where: dict = None) -> list[dict]:
         """
@@ -176,6 +504,46 @@ class SQLite:
             params = list(where.values())
         return self._execute_query(query, tuple(params), 'all')
 
+    def iter_select(self, table: str, columns: str | list[str] = '*', where: dict = None,
+                    row_type: str = 'dict', chunk_size: int = ITER_CHUNK_SIZE):
+        """
+        Like select(), but yields rows lazily, 'chunk_size' at a time, so memory stays flat however big the table is.
+        'row_type' is 'dict', 'tuple' (values in column order) or 'named' (namedtuples with the column names).
+        Each chunk is its own short query keyed on rowid, so no read transaction stays open between chunks;
+        rows written meanwhile may or may not be seen.
+        """
+        after = 0
+        while after is not None:
+            rows, after = self._select_page(table, columns, where, row_type, after, chunk_size)
+            yield from rows
+
+    def _select_page(self, table: str, columns: str | list[str], where: dict, row_type: str,
+                     after: int, limit: int) -> tuple[list, int | None]:
+        """
+        Returns up to 'limit' rows with rowid > 'after', and the rowid to continue from (None after the last page).
+        """
+        if row_type not in ('dict', 'tuple', 'named'):
+            raise ValueError(f"Unknown row_type '{row_type}'.")
+        cols = ', '.join(f"`{c}`" for c in columns) if isinstance(columns, list) else columns
+        query = f"SELECT {cols}, `rowid` AS `__rowid` FROM `{table}` WHERE `rowid` > ?"
+        params = [after]
+        if where:
+            query += "".join(f" AND `{k}`=?" for k in where)
+            params += list(where.values())
+        rows = self._execute_query(f"{query} ORDER BY `rowid` LIMIT ?", tuple(params + [limit]), 'rows')
+        if not rows:
+            return [], None
+        last = rows[-1][-1]
+        names = rows[0].keys()[:-1]
+        if row_type == 'dict':
+            page = [dict(zip(names, row)) for row in rows]
+        elif row_type == 'tuple':
+            page = [tuple(row)[:-1] for row in rows]
+        else:
+            row_class = _named_row(tuple(names))
+            page = [row_class._make(tuple(row)[:-1]) for row in rows]
+        return page, last if len(rows) == limit else None
+
     def get(self, table: str, columns: str | list[str] = '*', where: dict = None) -> dict | None:
         """
         Retrieves a single row from a table.
@@ -207,10 +575,13 @@ class SQLite:
         Inserts a new row into a table.
         'data' is a dictionary of column-value pairs.
         """
+        return self._execute_query(*self._insert_statement(table, data))
+
+    @staticmethod
+    def _insert_statement(table: str, data: dict) -> tuple[str, tuple]:
         keys = ', '.join(f"`{k}`" for k in data.keys())
         placeholders = ', '.join(['?'] * len(data))
-        query = f"INSERT INTO `{table}` ({keys}) VALUES ({placeholders})"
-        return self._execute_query(query, tuple(data.values()))
+        return f"INSERT INTO `{table}` ({keys}) VALUES ({placeholders})", tuple(data.values())
 
     def update(self, table: str, data: dict, where: dict):
         """
@@ -218,25 +589,162 @@ class SQLite:
         'data' is a dictionary of column-value pairs to update.
         'where' is a dictionary for filtering which rows to update.
         """
+        return self._execute_query(*self._update_statement(table, data, where))
+
+    @staticmethod
+    def _update_statement(table: str, data: dict, where: dict) -> tuple[str, tuple]:
         set_clause = ', '.join(f"`{k}`=?" for k in data)
         where_clause = ' AND '.join(f"`{k}`=?" for k in where)
-        query = f"UPDATE `{table}` SET {set_clause} WHERE {where_clause}"
-        return self._execute_query(query, tuple(data.values()) + tuple(where.values()))
+        return f"UPDATE `{table}` SET {set_clause} WHERE {where_clause}", tuple(data.values()) + tuple(where.values())
+
+    def update_many(self, table: str, columns: list[str], where_column: str, rows: list[tuple],
+                    chunk_size: int = 0, pause: float = 0) -> int:
+        """
+        Updates many rows with one prepared statement.
+        Each tuple in 'rows' holds the new 'columns' values followed by the 'where_column' value.
+        All rows go in a single transaction, or with 'chunk_size' in one transaction per chunk,
+        sleeping 'pause' seconds between chunks so other writers get the write lock in between.
+        """
+        if not rows:
+            return 0
+        set_clause = ', '.join(f"`{c}`=?" for c in columns)
+        query = f"UPDATE `{table}` SET {set_clause} WHERE `{where_column}`=?"
+        chunk_size = chunk_size if chunk_size > 0 else len(rows)
+        updated = 0
+        for i in range(0, len(rows), chunk_size):
+            if i and pause > 0:
+                time.sleep(pause)
+            start = time.perf_counter()
+            try:
+                with self._lock:
+                    self.cursor.executemany(query, rows[i:i + chunk_size])
+                    updated += self.cursor.rowcount
+                    if not self._transaction_depth:
+                        self.conn.commit()
+                        self.write_count += 1
+            except sqlite3.Error as e:
+                if not self._transaction_depth:
+                    self.conn.rollback()
+                print(f"Database batch update failed: {e}\nQuery: {query}\nRows: {len(rows[i:i + chunk_size])}")
+                raise
+            finally:
+                metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - start, *_classify_query(query))
+        return updated
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the statements issued inside the block as one write transaction, started with BEGIN IMMEDIATE
+        so nothing else writes between its reads and its writes. Commits at the end and rolls back on an exception.
+        Other threads sharing this connection wait until it ends, so keep the block short. Nested blocks join the outer one.
+        """
+        with self._lock:
+            if self._transaction_depth:
+                self._transaction_depth += 1
+                try:
+                    yield
+                finally:
+                    self._transaction_depth -= 1
+                return
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self._transaction_depth = 1
+            try:
+                yield
+                self.conn.commit()
+                self.write_count += 1
+            except BaseException:
+                self.conn.rollback()
+                raise
+            finally:
+                self._transaction_depth = 0
 
     def delete(self, table: str, where: dict):
         """
         Deletes rows from a table.
         'where' is a dictionary for filtering which rows to delete.
         """
+        return self._execute_query(*self._delete_statement(table, where))
+
+    @staticmethod
+    def _delete_statement(table: str, where: dict) -> tuple[str, tuple]:
         where_clause = ' AND '.join(f"`{k}`=?" for k in where)
-        query = f"DELETE FROM `{table}` WHERE {where_clause}"
-        return self._execute_query(query, tuple(where.values()))
+        return f"DELETE FROM `{table}` WHERE {where_clause}", tuple(where.values())
 
     def close(self):
         """
-        Closes the database connection.
+        Closes the database connection, after the group-commit writer (if any) has committed what was queued.
         """
+        if self._writer is not None:
+            self._write_queue.put(None)
+            self._writer.join()
+            self._writer = None
         if self.conn:
             self.conn.close()
             self.conn = None
             self.cursor = None
+
+class AsyncSQLite:
+    def __init__(self, db_path=None):
+        """
+        Awaitable front-end for SQLite with its own connection, owned by one dedicated thread.
+        Calls from any event loop queue onto that thread, so request handlers never block the loop
+        and never contend with CandyPanel's synchronous connection for a cursor.
+        """
+        from concurrent.futures import ThreadPoolExecutor # Only the API needs these; keeps them out of cron.py and the bot
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='candy-db')
+        self.db = self._executor.submit(SQLite, db_path).result()
+
+    async def _run(self, method: str, *args, **kwargs):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context() # Keeps the caller's query profile attached on the DB thread
+        return await loop.run_in_executor(self._executor, lambda: context.run(getattr(self.db, method), *args, **kwargs))
+
+    async def query(self, query: str, params: tuple = (), fetch_type: str = 'all'):
+        return await self._run('query', query, params, fetch_type)
+
+    async def select(self, table: str, columns: str | list[str] = '*', where: dict = None) -> list[dict]:
+        return await self._run('select', table, columns, where)
+
+    async def get(self, table: str, columns: str | list[str] = '*', where: dict = None) -> dict | None:
+        return await self._run('get', table, columns, where)
+
+    async def iter_select(self, table: str, columns: str | list[str] = '*', where: dict = None,
+                          row_type: str = 'dict', chunk_size: int = ITER_CHUNK_SIZE):
+        """
+        Async iterator over SQLite.iter_select; each chunk is one trip to the DB thread.
+        """
+        after = 0
+        while after is not None:
+            rows, after = await self._run('_select_page', table, columns, where, row_type, after, chunk_size)
+            for row in rows:
+                yield row
+
+    async def has(self, table: str, where: dict) -> bool:
+        return await self._run('has', table, where)
+
+    async def count(self, table: str, where: dict = None) -> int:
+        return await self._run('count', table, where)
+
+    async def _write(self, method: str, statement: tuple[str, tuple], *args):
+        if not self.db.group_commit:
+            return await self._run(method, *args)
+        # Straight to the writer thread; awaiting the future keeps the DB thread free for reads meanwhile
+        import asyncio
+        return await asyncio.wrap_future(self.db.submit_write(*statement))
+
+    async def insert(self, table: str, data: dict):
+        return await self._write('insert', SQLite._insert_statement(table, data), table, data)
+
+    async def update(self, table: str, data: dict, where: dict):
+        return await self._write('update', SQLite._update_statement(table, data, where), table, data, where)
+
+    async def delete(self, table: str, where: dict):
+        return await self._write('delete', SQLite._delete_statement(table, where), table, where)
+
+    def close(self):
+        """
+        Closes the connection on its owning thread and stops the thread.
+        """
+        self._executor.submit(self.db.close).result()
+        self._executor.shutdown()
@@ -0,0 +1,148 @@
+# forecast.py
+# Quota-exhaustion and expiry forecast, refreshed once per _sync. update() reads every enabled client's used bytes,
+# quota and time to expiry in one query, lines them up with the previous run's totals (forecast_state.npz next to
+# the database) and folds the bytes used since then into an exponentially weighted per-second rate, all as numpy
+# array operations over the whole fleet. Clients that run out of traffic or time within MAX_HORIZON_HOURS go to
+# forecast.json, which read() serves to /api/forecast and the bot without importing numpy.
+# numpy is optional (see optional.py): without it update() skips the forecast and read() finds nothing.
+import json, os, time
+from datetime import datetime
+from optional import optional_import
+
+HALF_LIFE_SECONDS = 3 * 3600 # A rate measured this long ago weighs half as much as the latest one
+MAX_HORIZON_HOURS = 7 * 24
+
+# Enabled clients with readable used_trafic: quota (0 when unlimited or not a number), bytes used, `expires` and the
+# seconds until then (NULL when it isn't a date), counted in the naive local time it is stored in.
+STATE_QUERY = """
+    SELECT `name`,
+           CASE WHEN `traffic` GLOB '[0-9]*' AND `traffic` NOT GLOB '*[^0-9]*' THEN CAST(`traffic` AS INTEGER) ELSE 0 END,
+           CASE WHEN COALESCE(`used_trafic`, '') = '' THEN 0
+                WHEN json_valid(`used_trafic`) AND json_type(`used_trafic`) = 'object'
+                THEN COALESCE(CAST(json_extract(`used_trafic`, '$.download') AS INTEGER), 0)
+                   + COALESCE(CAST(json_extract(`used_trafic`, '$.upload') AS INTEGER), 0) END AS `used_bytes`,
+           `expires`,
+           CAST(strftime('%s', `expires`) AS INTEGER) - CAST(strftime('%s', 'now', 'localtime') AS INTEGER)
+    FROM `clients` WHERE `status` = 1 AND `used_bytes` IS NOT NULL
+"""
+
+_cache = {} # forecast.json path -> (mtime, parsed forecast)
+
+def _state_path(db_path: str, name: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), name)
+
+def _load_state(np, path: str) -> dict | None:
+    """
+    The previous run's names, used bytes, rates and time, or None when there is no readable state.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as state:
+            return {key: state[key] for key in ('names', 'used', 'rate', 'at')}
+    except (OSError, ValueError, KeyError) as e:
+        if os.path.exists(path):
+            print(f"[!] Could not read forecast state {path}: {e}. Starting over.")
+        return None
+
+def fit_rates(np, names, used, previous: dict | None, now: float):
+    """
+    Bytes per second of each client in 'names' (its 'used' bytes now), an EWMA over the runs so far; NaN for clients
+    seen for the first time. A total below the last one (usage reset by an admin) keeps the previous rate.
+    """
+    rate = np.full(len(names), np.nan)
+    if not previous or not len(previous['names']) or not len(names):
+        return rate
+    elapsed = now - float(previous['at'])
+    order = np.argsort(previous['names'])
+    known = previous['names'][order]
+    position = np.minimum(np.searchsorted(known, names), len(known) - 1)
+    found = known[position] == names
+    previous_index = order[position[found]]
+    previous_rate = previous['rate'][previous_index]
+    if elapsed <= 0: # Clock went back, or two runs in the same instant: nothing new to learn
+        rate[found] = previous_rate
+        return rate
+    delta = used[found] - previous['used'][previous_index]
+    latest = np.where(delta >= 0, delta / elapsed, previous_rate)
+    weight = 1 - 0.5 ** (elapsed / HALF_LIFE_SECONDS)
+    rate[found] = np.where(np.isnan(previous_rate), latest, previous_rate + weight * (latest - previous_rate))
+    return rate
+
+def update(db) -> tuple[bool, str]:
+    """
+    Refits the usage rates and rewrites forecast.json for the database 'db' (a db.SQLite).
+    """
+    np = optional_import('numpy') # Not traffic_engine.load_numpy(): CANDY_TRAFFIC_ENGINE=python shouldn't turn this off
+    if np is None:
+        return True, "numpy isn't installed; skipped the usage forecast."
+    now = time.time()
+    rows = db.query(STATE_QUERY, (), 'rows')
+    client_names, quota, used, expires, seconds_left = zip(*rows) if rows else ((),) * 5
+    names = np.array(client_names, dtype=str)
+    quota, used = np.array(quota, dtype=np.int64), np.array(used, dtype=np.int64)
+    seconds_left = np.array(seconds_left, dtype=float) # None (no date) becomes NaN
+
+    state_path = _state_path(db.db_path, 'forecast_state.npz')
+    rate = fit_rates(np, names, used, _load_state(np, state_path), now)
+
+    # Seconds until each client runs out of traffic at its current rate, and until it runs out of either
+    remaining = quota - used
+    exhausts = (quota > 0) & (remaining > 0) & (rate > 0)
+    exhausts_in = np.full(len(names), np.inf)
+    exhausts_in[exhausts] = remaining[exhausts] / rate[exhausts]
+    runs_out_in = np.fmin(exhausts_in, seconds_left)
+    at_risk = np.flatnonzero(runs_out_in <= MAX_HORIZON_HOURS * 3600)
+    at_risk = at_risk[np.argsort(runs_out_in[at_risk], kind='stable')]
+
+    telegram_ids = dict(db.query("SELECT `candy_client_name`, `telegram_id` FROM `users` "
+                                 "WHERE `candy_client_name` IS NOT NULL", (), 'rows'))
+    by_traffic = (exhausts_in <= seconds_left) | np.isnan(seconds_left)
+    exhausts_ts = np.where(exhausts_in <= MAX_HORIZON_HOURS * 3600, now + exhausts_in, np.nan)
+    # Column by column, then one dict per at-risk client; NaN (!= itself) is stored as null
+    clients = [{'name': name, 'telegram_id': telegram_ids.get(name), 'reason': 'traffic' if traffic else 'expiry',
+                'runs_out_ts': runs_out_ts, 'exhausts_ts': exhausts_at if exhausts_at == exhausts_at else None,
+                'expires': expires[i], 'used': client_used, 'quota': client_quota,
+                'rate': client_rate if client_rate == client_rate else None}
+               for i, name, traffic, runs_out_ts, exhausts_at, client_used, client_quota, client_rate in zip(
+                   at_risk.tolist(), names[at_risk].tolist(), by_traffic[at_risk].tolist(),
+                   np.round(now + runs_out_in[at_risk], 3).tolist(), np.round(exhausts_ts[at_risk], 3).tolist(),
+                   used[at_risk].tolist(), quota[at_risk].tolist(), np.round(rate[at_risk], 1).tolist())]
+    forecast = {'generated_ts': round(now, 3), 'clients_examined': len(rows), 'half_life_seconds': HALF_LIFE_SECONDS,
+                'clients': clients}
+
+    forecast_path = _state_path(db.db_path, 'forecast.json')
+    try:
+        with open(f"{state_path}.tmp", 'wb') as f:
+            np.savez(f, names=names, used=used, rate=rate, at=np.float64(now))
+        os.replace(f"{state_path}.tmp", state_path)
+        with open(f"{forecast_path}.tmp", 'w') as f:
+            f.write(json.dumps(forecast)) # json.dump() would encode through the pure-Python iterator
+        os.replace(f"{forecast_path}.tmp", forecast_path)
+    except OSError as e:
+        return False, f"Could not write the usage forecast: {e}"
+    return True, f"Usage forecast: {len(clients)} of {len(rows)} clients run out within {MAX_HORIZON_HOURS} hours."
+
+def read(db_path: str, hours: float = 24, limit: int = None) -> dict | None:
+    """
+    The clients forecast to run out of traffic or time within 'hours' (at most MAX_HORIZON_HOURS), soonest first,
+    from the last forecast.json; None when no sync has written one.
+    """
+    path = _state_path(db_path, 'forecast.json')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        cached = _cache.get(path)
+        if not cached or cached[0] != mtime:
+            with open(path) as f:
+                cached = _cache[path] = (mtime, json.load(f))
+    except (OSError, ValueError):
+        return None
+    forecast = cached[1]
+    hours = min(hours, MAX_HORIZON_HOURS)
+    cutoff = time.time() + hours * 3600
+    clients = [client for client in forecast['clients'] if client['runs_out_ts'] <= cutoff]
+    return {'generated_at': _isoformat(forecast['generated_ts']), 'hours': hours,
+            'clients_examined': forecast['clients_examined'], 'count': len(clients),
+            'clients': [dict(client, runs_out_at=_isoformat(client['runs_out_ts']), exhausts_at=_isoformat(client['exhausts_ts']))
+                        for client in (clients[:limit] if limit else clients)]}
+
+def _isoformat(timestamp: float | None) -> str | None:
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds') if timestamp is not None else None
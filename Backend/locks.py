@@ -0,0 +1,64 @@
+# locks.py
+# Per-interface locks around wgN.conf edits and the matching kernel updates.
+# A re-entrant thread lock orders callers inside one process (request threads, asyncio.to_thread workers,
+# the interface worker pool), and an flock on <lock_dir>/.wgN.lock orders processes (API workers, cron.py, the bot).
+# The async API only reaches these through asyncio.to_thread, so waiting never blocks the event loop.
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+class _InterfaceLock:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.depth = 0 # Nesting level of the thread holding 'lock'
+        self.file = None # Open lock file while held, for the flock
+
+class InterfaceLocks:
+    def __init__(self, lock_dir: str):
+        """
+        Hands out one lock per WireGuard interface id; lock files live in 'lock_dir'.
+        """
+        self.lock_dir = lock_dir
+        self._locks = {} # wg_id -> _InterfaceLock
+        self._guard = threading.Lock()
+
+    def _get(self, wg_id: int) -> _InterfaceLock:
+        with self._guard:
+            entry = self._locks.get(wg_id)
+            if entry is None:
+                entry = self._locks[wg_id] = _InterfaceLock(os.path.join(self.lock_dir, f".wg{wg_id}.lock"))
+            return entry
+
+    @contextmanager
+    def hold(self, wg_id: int):
+        """
+        Holds interface 'wg_id' exclusively. Nested holds from the same thread don't wait,
+        so helpers that lock for themselves can be called from an already locked section.
+        """
+        entry = self._get(int(wg_id))
+        start = time.perf_counter()
+        with entry.lock:
+            if entry.depth == 0:
+                try:
+                    entry.file = open(entry.path, 'a')
+                    fcntl.flock(entry.file, fcntl.LOCK_EX)
+                except OSError as e:
+                    # Still ordered within this process; only other processes can interleave
+                    print(f"[!] Warning: Could not lock {entry.path} ({e}); locking within this process only.")
+                    if entry.file is not None:
+                        entry.file.close()
+                    entry.file = None
+                metrics.INTERFACE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, f"wg{wg_id}")
+            entry.depth += 1
+            try:
+                yield
+            finally:
+                entry.depth -= 1
+                if entry.depth == 0 and entry.file is not None:
+                    fcntl.flock(entry.file, fcntl.LOCK_UN)
+                    entry.file.close()
+                    entry.file = None
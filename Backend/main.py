@@ -1,23 +1,114 @@
-from flask import Flask, request, jsonify, abort, g, send_from_directory , send_file
 from functools import wraps
-from flask_cors import CORS
 import asyncio
+import hmac
+import inspect
 import json
 from datetime import datetime, timedelta
 import os
+import io
+from itertools import chain, islice
 import subprocess
+import time
+import zipfile
+
+# CANDY_SERVER=asgi serves these same routes on Quart, so every request shares one event loop.
+# The default 'flask' mode keeps the WSGI app (one event loop per request thread).
+SERVER_MODE = os.environ.get('CANDY_SERVER', 'flask')
+if SERVER_MODE == 'asgi':
+    from quart import Quart as Flask, request, jsonify, abort, g, send_file, Response
+    from quart_cors import cors as CORS
+else:
+    from flask import Flask, request, jsonify, abort, g, send_from_directory , send_file, Response
+    from flask_cors import CORS
 
 # Import your CandyPanel logic
 from core import CandyPanel, CommandExecutionError
+from db import AsyncSQLite, PROFILE_QUERIES, start_query_profile, stop_query_profile
+import metrics
+import collector
+import atexit
 
 # --- Initialize CandyPanel ---
-candy_panel = CandyPanel()
+# Set by start_services() in the process that serves requests, so a Hypercorn supervisor that only forks
+# CANDY_WORKERS workers opens no database and holds no collector lock.
+candy_panel = None
+# Awaitable DB access for request handlers (own connection on a dedicated thread)
+adb = None
+# CANDY_COLLECTOR_INTERVAL > 0: poll traffic in the background; with several workers one collects, the rest stand by
+traffic_collector = None
+
+def start_services():
+    """
+    Creates the CandyPanel, its async DB access and the traffic collector, once per process. Runs at import under
+    Flask and before serving under Quart.
+    """
+    global candy_panel, adb, traffic_collector
+    if candy_panel is not None:
+        return
+    panel = CandyPanel()
+    adb = AsyncSQLite(panel.db.db_path)
+    if collector.COLLECTOR_INTERVAL > 0:
+        traffic_collector = collector.TrafficCollector(panel)
+        traffic_collector.start()
+        atexit.register(traffic_collector.stop)
+    candy_panel = panel
 
 # --- Flask Application Setup ---
 app = Flask(__name__, static_folder=os.path.join(os.getcwd(), '..', 'Frontend', 'dist'), static_url_path='/static')
 app.config['SECRET_KEY'] = 'your_super_secret_key'
 CORS(app)
 
+# --- Request Metrics ---
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILE_QUERIES:
+        g.query_profile_token = start_query_profile()
+
+def _observe_request(response):
+    started = g.get('request_started')
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if started is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    token = g.pop('query_profile_token', None)
+    if token is not None:
+        # CANDY_DB_PROFILE=1: per-request query summary, e.g. to spot N+1 lookups from the browser's dev tools
+        profile = stop_query_profile(token)
+        response.headers['X-DB-Queries'] = profile.summary()
+        response.headers['Server-Timing'] = f'db;dur={profile.elapsed_ms:.2f};desc="{profile.count} queries"'
+        profile.log_if_repetitive(f"{request.method} {route}")
+    return response
+
+if SERVER_MODE == 'asgi':
+    # Quart would run plain functions in a worker thread; keep the hooks on the event loop
+    async def _start_services_async():
+        start_services()
+
+    async def _start_request_timer_async():
+        start_services() # Test clients don't run before_serving
+        _start_request_timer()
+
+    async def _observe_request_async(response):
+        return _observe_request(response)
+
+    app.before_serving(_start_services_async)
+    app.before_request(_start_request_timer_async)
+    app.after_request(_observe_request_async)
+else:
+    start_services()
+    # Flask runs plain hooks inline; async ones would each spin up an event loop
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_request)
+
+async def get_setting(key: str, default: str = None) -> str | None:
+    """
+    candy_panel._get_setting for request handlers. The settings copy checks PRAGMA data_version on the shared
+    connection, which waits out a collector flush or sync chunk holding it, so under Quart it runs in a worker
+    thread instead of stalling the event loop.
+    """
+    if SERVER_MODE == 'asgi':
+        return await asyncio.to_thread(candy_panel._get_setting, key, default)
+    return candy_panel._get_setting(key, default)
+
 # --- Authentication Decorator for CandyPanel Admin API ---
 def authenticate_admin(f):
     @wraps(f)
@@ -34,15 +125,51 @@ def authenticate_admin(f):
         if token_type.lower() != 'bearer':
             abort(401, description="Unsupported authorization type")
 
-        # Run synchronous DB operation in a thread pool
-        settings = await asyncio.to_thread(candy_panel.db.get, 'settings','*' ,{'key': 'session_token'})
-        if not settings or settings['value'] != token:
+        # Served from the per-process settings copy; reloaded when any worker logs in
+        if await get_setting('session_token') != token:
             abort(401, description="Invalid authentication credentials")
 
         g.is_authenticated = True
         return await f(*args, **kwargs)
     return decorated_function
 
+class _ZipStream(io.RawIOBase):
+    """
+    Write-only, unseekable sink for zipfile; drain() hands back what was written since the last call.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def get_json_body():
+    """
+    Returns the parsed JSON request body under either framework (Quart's accessor is awaitable).
+    """
+    body = request.get_json()
+    if inspect.isawaitable(body):
+        body = await body
+    return body
+
+async def send_static(path: str):
+    """
+    send_file wrapper; Quart's send_file is a coroutine.
+    """
+    response = send_file(path)
+    if inspect.isawaitable(response):
+        response = await response
+    return response
+
 # --- Helper for common responses ---
 def success_response(message: str, data=None, status_code: int = 200):
     return jsonify({"message": message, "success": True, "data": data}), status_code
@@ -50,6 +177,71 @@ def success_response(message: str, data=None, status_code: int = 200):
 def error_response(message: str, status_code: int = 400):
     return jsonify({"message": message, "success": False}), status_code
 
+def _stream_body(chunks):
+    """
+    Response body from a blocking generator. Flask iterates it in the request thread; under Quart each chunk is
+    produced in a worker thread, so database reads never stall the event loop.
+    """
+    if SERVER_MODE != 'asgi':
+        return chunks
+
+    async def pull():
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+    return pull()
+
+def live_rates() -> dict | None:
+    """
+    Live throughput from the traffic collector (see TrafficCollector.live_rates); None while there is none to read.
+    """
+    return traffic_collector.live_rates() if traffic_collector else None
+
+def top_talkers(by: str, n) -> tuple[int, dict | str]:
+    """
+    Shared by /api/top and /bot_api/admin/top: (200, data) or (status, error message).
+    """
+    if by not in ('rate', 'hour', 'day'):
+        return 400, "'by' must be 'rate', 'hour' or 'day'."
+    try:
+        n = min(max(int(n), 1), 100)
+    except (TypeError, ValueError):
+        return 400, "'n' must be a number."
+    data = traffic_collector.top(by, n) if traffic_collector else None
+    if data is None:
+        return 503, "No live traffic data yet: the traffic collector is off (CANDY_COLLECTOR_INTERVAL=0) or hasn't polled."
+    return 200, data
+
+async def streamed_success_response(message: str, data: dict, key: str, rows, batch: int = 500):
+    """
+    success_response() whose data[key] list is serialized from the 'rows' iterator while it is sent, so a large
+    table never sits in memory whole. The other 'data' entries go out first, 'message' and 'success' last.
+    The first 'batch' rows are read before returning, so a failing query still raises to the caller. A later
+    failure is logged and closes the JSON with the rows sent so far and "success": false.
+    """
+    rows = iter(rows)
+    first = await asyncio.to_thread(list, islice(rows, batch))
+
+    def generate():
+        yield (f'{{"data": {{'
+               + ''.join(f'{json.dumps(k)}: {json.dumps(v)}, ' for k, v in data.items())
+               + f'{json.dumps(key)}: [').encode()
+        parts, separator, error = [], '', None
+        try:
+            for row in chain(first, rows):
+                parts.append(separator + json.dumps(row))
+                separator = ', '
+                if len(parts) >= batch:
+                    yield ''.join(parts).encode()
+                    parts.clear()
+        except Exception as e:
+            print(f"[!] Streaming '{key}' failed after the rows already sent: {e}")
+            error = f"Stream interrupted: {e}"
+        tail = (f'{json.dumps(message)}, "success": true' if error is None
+                else f'{json.dumps(error)}, "success": false')
+        yield (''.join(parts) + f']}}, "message": {tail}}}').encode()
+
+    return Response(_stream_body(generate()), mimetype='application/json')
+
 # --- CandyPanel API Endpoints ---
 @app.get("/client-details/<name>/<public_key>")
 async def get_client_public_details(name: str, public_key: str):
@@ -60,6 +252,8 @@ async def get_client_public_details(name: str, public_key: str):
     try:
         client_data = await asyncio.to_thread(candy_panel._get_client_by_name_and_public_key, name, public_key)
         if client_data:
+            # Current speed, from the traffic collector (its memory, or its snapshot in the other workers)
+            client_data['live_rate'] = traffic_collector.client_rate(public_key, name) if traffic_collector else None
             return success_response("Client details retrieved successfully.", data=client_data)
         else:
             return error_response("Client not found or public key mismatch.", 404)
@@ -71,54 +265,44 @@ async def get_qr_code(name: str, public_key: str):
     Generates and returns a QR code image for a client's configuration (without the private key).
     This endpoint is publicly accessible.
     """
-    client = await asyncio.to_thread(candy_panel.db.get, 'clients', where={'name': name, 'public_key': public_key})
-    if not client:
+    success, config_content = await asyncio.to_thread(candy_panel._get_client_config, name, public_key)
+    if not success:
         return error_response("Client not found or public key mismatch.", 404)
 
-    interface = await asyncio.to_thread(candy_panel.db.get, 'interfaces', where={'wg': client['wg']})
-    if not interface:
-        return error_response("Associated WireGuard interface not found.", 500)
-
-    # Reconstruct the config without the private key for the QR code
-    dns = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'dns'})
-    dns_value = dns['value'] if dns else '8.8.8.8'
-    mtu = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'mtu'})
-    mtu_value = mtu['value'] if mtu else '1420'
-    server_ip = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'custom_endpont'})
-    server_ip = server_ip['value']
-
-    config_content = f"""[Interface]
-PrivateKey = {client['private_key']}
-Address = {client['address']}/32
-DNS = {dns_value}
-MTU = {mtu_value}
-
-[Peer]
-PublicKey = {interface['public_key']}
-Endpoint = {server_ip}:{interface['port']}
-AllowedIPs = 0.0.0.0/0, ::/0
-PersistentKeepalive = 25"""
-    
-    # Use qrencode to generate the QR code as a temporary file
-    temp_file_path = f"/tmp/{name}-{public_key}.png"
+    # Render in-process; identical configs share one cached PNG keyed by their hash
     try:
-        await asyncio.to_thread(subprocess.run,['qrencode', '-o', temp_file_path, config_content], check=True)
-        return send_file(temp_file_path, mimetype='image/png')
-    except subprocess.CalledProcessError:
-        return error_response("Failed to generate QR code. Is 'qrencode' installed?", 500)
+        png, etag = await asyncio.to_thread(candy_panel._get_config_qr, config_content)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return error_response("Failed to generate QR code. Install 'segno' or 'qrencode'.", 500)
     except Exception as e:
         return error_response(f"An error occurred: {e}", 500)
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+
+    # The QR embeds the client's private key, so only the client itself may cache it
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, max-age=300'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(png, mimetype='image/png', headers=headers)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus text exposition of this process's metrics plus the snapshots flushed by cron.py and bot.py.
+    Requires 'Authorization: Bearer <CANDY_METRICS_TOKEN>'; without CANDY_METRICS_TOKEN the endpoint doesn't exist.
+    """
+    metrics_token = os.environ.get('CANDY_METRICS_TOKEN')
+    if not metrics_token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {metrics_token}"):
+        abort(401, description="Invalid metrics token")
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.get("/check")
 async def check_installation():
     """
     Checks if the CandyPanel is installed.
     """
-    install_status = await asyncio.to_thread(candy_panel.db.get, 'settings', '*',{'key': 'install'})
-    is_installed = bool(install_status and install_status['value'] == '1')
+    is_installed = await get_setting('install') == '1'
     return jsonify({"installed": is_installed})
 
 @app.post("/api/auth")
@@ -126,13 +310,12 @@ async def handle_auth():
     """
     Handles both login and installation based on the 'action' field.
     """
-    data = request.json
+    data = await get_json_body()
     if not data or 'action' not in data:
         return error_response("Missing 'action' in request body", 400)
 
     action = data['action']
-    install_status = await asyncio.to_thread(candy_panel.db.get, 'settings', '*',{'key': 'install'})
-    is_installed = bool(install_status and install_status['value'] == '1')
+    is_installed = await get_setting('install') == '1'
 
     if action == 'login':
         if not is_installed:
@@ -185,33 +368,105 @@ async def get_all_data():
     try:
         # Fetch all data concurrently
         dashboard_stats_task = asyncio.to_thread(candy_panel._dashboard_stats)
-        clients_data_task = asyncio.to_thread(candy_panel._get_all_clients)
-        interfaces_data_task = asyncio.to_thread(candy_panel.db.select, 'interfaces')
-        settings_data_task = asyncio.to_thread(candy_panel.db.select, 'settings')
+        interfaces_data_task = adb.select('interfaces')
+        settings_data_task = adb.select('settings')
+        live_rates_task = asyncio.to_thread(live_rates)
 
-        dashboard_stats, clients_data, interfaces_data, settings_raw = await asyncio.gather(
-            dashboard_stats_task, clients_data_task, interfaces_data_task, settings_data_task
+        dashboard_stats, interfaces_data, settings_raw, rates = await asyncio.gather(
+            dashboard_stats_task, interfaces_data_task, settings_data_task, live_rates_task
         )
 
-        # Process client data (parse used_trafic)
-        for client in clients_data:
-            try:
-                client['used_trafic'] = json.loads(client['used_trafic'])
-            except (json.JSONDecodeError, TypeError):
-                client['used_trafic'] = {"download": 0, "upload": 0}
-        
         # Process settings data (convert to dict)
         settings_data = {setting['key']: setting['value'] for setting in settings_raw}
 
-        return success_response("All data retrieved successfully.", data={
+        # Clients are streamed from the table in chunks, with used_trafic already parsed
+        return await streamed_success_response("All data retrieved successfully.", {
             "dashboard": dashboard_stats,
-            "clients": clients_data,
             "interfaces": interfaces_data,
-            "settings": settings_data
-        })
+            "settings": settings_data,
+            "live_rates": rates
+        }, "clients", candy_panel._iter_clients())
     except Exception as e:
         return error_response(f"Failed to retrieve all data: {e}", 500)
 
+@app.get("/api/rates")
+@authenticate_admin
+async def get_live_rates():
+    """
+    Returns live throughput in bits per second per interface and per client whose traffic moved recently, straight
+    from the traffic collector's memory. Optional query arg: 'names' (comma separated) to pick clients.
+    Requires authentication.
+    """
+    rates = await asyncio.to_thread(live_rates)
+    if rates is None:
+        return error_response("No live traffic data yet: the traffic collector is off (CANDY_COLLECTOR_INTERVAL=0) or hasn't polled.", 503)
+    names = request.args.get('names')
+    if names:
+        rates['clients'] = {name: rates['clients'][name] for name in names.split(',') if name in rates['clients']}
+    return success_response("Live rates retrieved successfully.", data=rates)
+
+@app.get("/api/top")
+@authenticate_admin
+async def get_top_talkers():
+    """
+    Returns the heaviest clients, from the traffic collector's memory: by current rate ('by=rate', the default) or by
+    bytes used over the last hour or day ('by=hour' / 'by=day'). Optional query arg 'n' (default 10, max 100).
+    Requires authentication.
+    """
+    status, data = await asyncio.to_thread(top_talkers, request.args.get('by', 'rate'), request.args.get('n', 10))
+    if status != 200:
+        return error_response(data, status)
+    return success_response("Top clients retrieved successfully.", data=data)
+
+@app.get("/api/clients/export")
+@authenticate_admin
+async def export_client_configs():
+    """
+    Streams the configs of many clients as a zip (one <name>.conf per client).
+    Optional query args: 'names' (comma separated) and 'wg_id'. Requires authentication.
+    """
+    names = [n for n in request.args.get('names', '').split(',') if n] or None
+    wg_id = request.args.get('wg_id', type=int)
+    configs = candy_panel._iter_client_configs(names, wg_id)
+
+    def generate():
+        sink = _ZipStream()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, config in configs:
+                archive.writestr(f"{name.replace('/', '_')}.conf", config)
+                yield sink.drain()
+        yield sink.drain()
+
+    return Response(_stream_body(generate()), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=candy-configs.zip'})
+
+@app.get("/api/sync/history")
+@authenticate_admin
+async def get_sync_history():
+    """
+    Returns recorded _sync runs, newest first: start/end time, per-phase seconds, clients examined and disabled,
+    WireGuard commands issued and errors. Optional query args: 'limit' (default 100, max 1000) and 'before_id'.
+    Requires authentication.
+    """
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    before_id = request.args.get('before_id', type=int)
+    runs = await asyncio.to_thread(candy_panel._get_sync_history, limit, before_id)
+    return success_response("Sync history retrieved successfully.", data={"runs": runs})
+
+@app.get("/api/forecast")
+@authenticate_admin
+async def get_forecast():
+    """
+    Returns the clients forecast to run out of traffic or time, soonest first, as computed by the last sync.
+    Optional query args: 'hours' (default 24, max 168) and 'limit'. Requires authentication.
+    """
+    hours = min(max(request.args.get('hours', 24, type=float), 0), 168)
+    limit = request.args.get('limit', type=int)
+    data = await asyncio.to_thread(candy_panel._get_forecast, hours, limit)
+    if data is None:
+        return error_response("No forecast yet: it is computed on each sync and needs numpy installed.", 503)
+    return success_response("Forecast retrieved successfully.", data=data)
+
 @app.post("/api/manage")
 @authenticate_admin
 async def manage_resources():
@@ -219,7 +474,7 @@ async def manage_resources():
     Unified endpoint for creating/updating/deleting clients, interfaces, and settings.
     Requires authentication.
     """
-    data = request.json
+    data = await get_json_body()
     if not data or 'resource' not in data or 'action' not in data:
         return error_response("Missing 'resource' or 'action' in request body", 400)
 
@@ -376,17 +631,17 @@ async def manage_resources():
 
 @app.post("/bot_api/user/register")
 async def bot_register_user():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     if not telegram_id:
         return error_response("Missing telegram_id", 400)
 
-    user = await asyncio.to_thread(candy_panel.db.get, 'users', where={'telegram_id': telegram_id})
+    user = await adb.get('users', where={'telegram_id': telegram_id})
     if user:
         return success_response("User already registered.", data={"registered": True, "language": user.get('language', 'en')}) # Return current language
     
     # Default language is English
-    await asyncio.to_thread(candy_panel.db.insert, 'users', {
+    await adb.insert('users', {
         'telegram_id': telegram_id,
         'created_at': datetime.now().isoformat(),
         'language': 'en' 
@@ -395,7 +650,7 @@ async def bot_register_user():
 
 @app.post("/bot_api/user/set_language")
 async def bot_set_language():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     language = data.get('language')
 
@@ -405,29 +660,27 @@ async def bot_set_language():
     if language not in ['en', 'fa']: # Only allow 'en' or 'fa' for now
         return error_response("Unsupported language. Available: 'en', 'fa'", 400)
 
-    if not await asyncio.to_thread(candy_panel.db.has, 'users', {'telegram_id': telegram_id}):
+    if not await adb.has('users', {'telegram_id': telegram_id}):
         return error_response("User not registered with the bot.", 404)
 
-    await asyncio.to_thread(candy_panel.db.update, 'users', {'language': language}, {'telegram_id': telegram_id})
+    await adb.update('users', {'language': language}, {'telegram_id': telegram_id})
     return success_response("Language updated successfully.")
 
 
 @app.post("/bot_api/user/initiate_purchase") # NEW ENDPOINT
 async def bot_initiate_purchase():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     
     if not telegram_id:
         return error_response("Missing telegram_id", 400)
 
-    if not await asyncio.to_thread(candy_panel.db.has, 'users', {'telegram_id': telegram_id}):
+    if not await adb.has('users', {'telegram_id': telegram_id}):
         return error_response("User not registered with the bot.", 404)
 
-    prices_json = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'prices'})
-    prices = json.loads(prices_json['value']) if prices_json and prices_json['value'] else {}
+    prices = json.loads(await get_setting('prices') or '{}')
 
-    admin_card_number_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'admin_card_number'})
-    admin_card_number = admin_card_number_setting['value'] if admin_card_number_setting else 'YOUR_ADMIN_CARD_NUMBER'
+    admin_card_number = await get_setting('admin_card_number', 'YOUR_ADMIN_CARD_NUMBER')
 
     return success_response("Purchase initiation details.", data={
         "admin_card_number": admin_card_number,
@@ -436,7 +689,7 @@ async def bot_initiate_purchase():
 
 @app.post("/bot_api/user/calculate_price") # NEW ENDPOINT
 async def bot_calculate_price():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     purchase_type = data.get('purchase_type')
     quantity = data.get('quantity')
@@ -446,11 +699,10 @@ async def bot_calculate_price():
     if not all([telegram_id, purchase_type]):
         return error_response("Missing telegram_id or purchase_type", 400)
 
-    if not await asyncio.to_thread(candy_panel.db.has, 'users', {'telegram_id': telegram_id}):
+    if not await adb.has('users', {'telegram_id': telegram_id}):
         return error_response("User not registered with the bot.", 404)
 
-    prices_json = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'prices'})
-    prices = json.loads(prices_json['value']) if prices_json and prices_json['value'] else {}
+    prices = json.loads(await get_setting('prices') or '{}')
 
     calculated_amount = 0
     if purchase_type == 'gb':
@@ -481,7 +733,7 @@ async def bot_calculate_price():
 
 @app.post("/bot_api/user/submit_transaction") # NEW ENDPOINT
 async def bot_submit_transaction():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     order_id = data.get('order_id')
     card_number_sent = data.get('card_number_sent') # This will be "User confirmed payment" for now
@@ -495,10 +747,10 @@ async def bot_submit_transaction():
         return error_response("Missing required transaction details.", 400)
 
     # Check if order_id already exists (to prevent duplicate requests)
-    if await asyncio.to_thread(candy_panel.db.has, 'transactions', {'order_id': order_id}):
+    if await adb.has('transactions', {'order_id': order_id}):
         return error_response("This Order ID has already been submitted. Please use a unique one or contact support if you believe this is an error.", 400)
 
-    await asyncio.to_thread(candy_panel.db.insert, 'transactions', {
+    await adb.insert('transactions', {
         'order_id': order_id,
         'telegram_id': telegram_id,
         'amount': amount,
@@ -511,8 +763,7 @@ async def bot_submit_transaction():
         'traffic_quantity': traffic_quantity
     })
 
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     return success_response("Transaction submitted for review.", data={
         "admin_telegram_id": admin_telegram_id
@@ -521,12 +772,12 @@ async def bot_submit_transaction():
 
 @app.post("/bot_api/user/get_license")
 async def bot_get_user_license():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     if not telegram_id:
         return error_response("Missing telegram_id", 400)
 
-    user = await asyncio.to_thread(candy_panel.db.get, 'users', where={'telegram_id': telegram_id})
+    user = await adb.get('users', where={'telegram_id': telegram_id})
     if not user:
         return error_response("User not registered with the bot. Please use /start to register.", 404)
     if not user.get('candy_client_name'):
@@ -540,64 +791,57 @@ async def bot_get_user_license():
 
 @app.post("/bot_api/user/account_status")
 async def bot_get_account_status():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     if not telegram_id:
         return error_response("Missing telegram_id", 400)
 
-    user = await asyncio.to_thread(candy_panel.db.get, 'users', where={'telegram_id': telegram_id})
-    if not user:
+    # Single keyed lookup joining the bot user with their CandyPanel client
+    account = await asyncio.to_thread(candy_panel._get_account_status, telegram_id)
+    if not account:
         return error_response("User not registered with the bot. Please use /start to register.", 404)
 
     status_info = {
-        "status": user['status'],
-        "traffic_bought_gb": user['traffic_bought_gb'],
-        "time_bought_days": user['time_bought_days'],
-        "candy_client_name": user['candy_client_name'],
+        "status": account['status'],
+        "traffic_bought_gb": account['traffic_bought_gb'],
+        "time_bought_days": account['time_bought_days'],
+        "candy_client_name": account['candy_client_name'],
         "used_traffic_bytes": 0, # Default to 0
         "traffic_limit_bytes": 0, # Default to 0
         "expires": 'N/A',
         "note": ''
     }
 
-    if user.get('candy_client_name'):
-        # Directly call CandyPanel's internal method to get all clients
-        all_clients_data = await asyncio.to_thread(candy_panel._get_all_clients)
-        
-        if all_clients_data:
-            client_info = next((c for c in all_clients_data if c['name'] == user['candy_client_name']), None)
-            if client_info:
-                try:
-                    used_traffic = json.loads(client_info.get('used_trafic', '{"download":0,"upload":0}'))
-                    status_info['used_traffic_bytes'] = used_traffic.get('download', 0) + used_traffic.get('upload', 0)
-                except (json.JSONDecodeError, TypeError):
-                    status_info['used_traffic_bytes'] = 0 # Fallback
-                status_info['expires'] = client_info.get('expires') # Get expiry from CandyPanel
-                status_info['traffic_limit_bytes'] = int(client_info.get('traffic', 0))
-                status_info['note'] = client_info.get('note', '') # Get note from CandyPanel client
-            else:
-                status_info['note'] = "Your VPN client configuration might be out of sync or deleted from the server. Please contact support."
+    if account.get('candy_client_name'):
+        if account.get('client_name'):
+            try:
+                used_traffic = json.loads(account.get('used_trafic') or '{"download":0,"upload":0}')
+                status_info['used_traffic_bytes'] = used_traffic.get('download', 0) + used_traffic.get('upload', 0)
+            except (json.JSONDecodeError, TypeError):
+                status_info['used_traffic_bytes'] = 0 # Fallback
+            status_info['expires'] = account.get('expires') # Get expiry from CandyPanel
+            status_info['traffic_limit_bytes'] = int(account.get('traffic') or 0)
+            status_info['note'] = account.get('note') or '' # Get note from CandyPanel client
         else:
-            status_info['note'] = "Could not fetch live traffic data from the server. Please try again later or contact support."
+            status_info['note'] = "Your VPN client configuration might be out of sync or deleted from the server. Please contact support."
 
     return success_response("Your account status:", data=status_info)
 
 @app.post("/bot_api/user/call_support")
 async def bot_call_support():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     message_text = data.get('message')
 
     if not all([telegram_id, message_text]):
         return error_response("Missing telegram_id or message", 400)
 
-    user = await asyncio.to_thread(candy_panel.db.get, 'users', where={'telegram_id': telegram_id})
+    user = await adb.get('users', where={'telegram_id': telegram_id})
     username = f"User {telegram_id}"
     if user and user.get('candy_client_name'):
         username = user['candy_client_name']
 
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if admin_telegram_id == '0':
         return error_response("Admin Telegram ID not set in bot settings. Support is unavailable.", 500)
@@ -611,38 +855,37 @@ async def bot_call_support():
 
 @app.post("/bot_api/admin/check_admin")
 async def bot_check_admin():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     if not telegram_id:
         return error_response("Missing telegram_id", 400)
     
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
     is_admin = (str(telegram_id) == admin_telegram_id)
     return success_response("Admin status checked.", data={"is_admin": is_admin, "admin_telegram_id": admin_telegram_id})
 
 
 @app.post("/bot_api/admin/get_all_users")
 async def bot_admin_get_all_users():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if not telegram_id or str(telegram_id) != admin_telegram_id:
         return error_response("Unauthorized", 403)
 
-    users = await asyncio.to_thread(candy_panel.db.select, 'users')
-    return success_response("All bot users retrieved.", data={"users": users})
+    try:
+        return await streamed_success_response("All bot users retrieved.", {}, "users", candy_panel.db.iter_select('users'))
+    except Exception as e:
+        return error_response(f"Failed to retrieve bot users: {e}", 500)
 
 @app.post("/bot_api/admin/get_transactions")
 async def bot_admin_get_transactions():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     status_filter = data.get('status_filter', 'pending') # 'pending', 'approved', 'rejected', 'all'
 
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if not telegram_id or str(telegram_id) != admin_telegram_id:
         return error_response("Unauthorized", 403)
@@ -651,12 +894,12 @@ async def bot_admin_get_transactions():
     if status_filter != 'all':
         where_clause['status'] = status_filter
 
-    transactions = await asyncio.to_thread(candy_panel.db.select, 'transactions', where=where_clause)
+    transactions = await adb.select('transactions', where=where_clause)
     return success_response("Transactions retrieved.", data={"transactions": transactions})
 
 @app.post("/bot_api/admin/approve_transaction")
 async def bot_admin_approve_transaction():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     order_id = data.get('order_id')
     admin_note = data.get('admin_note', '')
@@ -664,13 +907,12 @@ async def bot_admin_approve_transaction():
     if not all([telegram_id, order_id]):
         return error_response("Missing required fields for approval.", 400)
     
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if str(telegram_id) != admin_telegram_id:
         return error_response("Unauthorized", 403)
 
-    transaction = await asyncio.to_thread(candy_panel.db.get, 'transactions', where={'order_id': order_id})
+    transaction = await adb.get('transactions', where={'order_id': order_id})
     if not transaction:
         return error_response("Transaction not found.", 404)
     if transaction['status'] != 'pending':
@@ -708,7 +950,7 @@ async def bot_admin_approve_transaction():
         return error_response("Invalid purchase_type in transaction record.", 500)
     
     # Get user from bot's DB
-    user_in_bot_db = await asyncio.to_thread(candy_panel.db.get, 'users', where={'telegram_id': transaction['telegram_id']})
+    user_in_bot_db = await adb.get('users', where={'telegram_id': transaction['telegram_id']})
     if not user_in_bot_db:
         print(f"Warning: User {transaction['telegram_id']} not found in bot_db during transaction approval.")
         return error_response(f"User {transaction['telegram_id']} not found in bot's database. Cannot approve.", 404)
@@ -719,7 +961,7 @@ async def bot_admin_approve_transaction():
         # Use a more stable client name, maybe just based on telegram_id if unique enough
         client_name = f"tguser_{transaction['telegram_id']}"
         # Ensure uniqueness by appending timestamp if a client with this name already exists in CandyPanel
-        existing_client = await asyncio.to_thread(candy_panel.db.get, 'clients', where={'name': client_name})
+        existing_client = await adb.get('clients', where={'name': client_name})
         if existing_client:
             client_name = f"tguser_{transaction['telegram_id']}_{int(datetime.now().timestamp())}"
 
@@ -728,7 +970,7 @@ async def bot_admin_approve_transaction():
     candy_client_exists = False
     
     # Check if client exists in CandyPanel DB
-    existing_candy_client = await asyncio.to_thread(candy_panel.db.get, 'clients', where={'name': client_name})
+    existing_candy_client = await adb.get('clients', where={'name': client_name})
     if existing_candy_client:
         candy_client_exists = True
         current_expires_str = existing_candy_client.get('expires')
@@ -807,15 +1049,16 @@ async def bot_admin_approve_transaction():
     
     # Update bot's user table
     # Accumulate bought traffic and time
-    await asyncio.to_thread(candy_panel.db.update, 'users', {
+    await adb.update('users', {
         'candy_client_name': client_name,
         'traffic_bought_gb': user_in_bot_db.get('traffic_bought_gb', 0) + user_traffic_bought_gb,
         'time_bought_days': user_in_bot_db.get('time_bought_days', 0) + user_time_bought_days,
         'status': 'active' # Ensure bot user status is active
     }, {'telegram_id': transaction['telegram_id']})
+    candy_panel._invalidate_account_status(transaction['telegram_id'])
 
     # Update transaction status
-    await asyncio.to_thread(candy_panel.db.update, 'transactions', {
+    await adb.update('transactions', {
         'status': 'approved',
         'approved_at': datetime.now().isoformat(),
         'admin_note': admin_note
@@ -831,7 +1074,7 @@ async def bot_admin_approve_transaction():
 
 @app.post("/bot_api/admin/reject_transaction")
 async def bot_admin_reject_transaction():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     order_id = data.get('order_id')
     admin_note = data.get('admin_note', '')
@@ -839,19 +1082,18 @@ async def bot_admin_reject_transaction():
     if not all([telegram_id, order_id]):
         return error_response("Missing telegram_id or order_id.", 400)
     
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if str(telegram_id) != admin_telegram_id:
         return error_response("Unauthorized", 403)
 
-    transaction = await asyncio.to_thread(candy_panel.db.get, 'transactions', where={'order_id': order_id})
+    transaction = await adb.get('transactions', where={'order_id': order_id})
     if not transaction:
         return error_response("Transaction not found.", 404)
     if transaction['status'] != 'pending':
         return error_response("Transaction is not pending. It has been already processed.", 400)
 
-    await asyncio.to_thread(candy_panel.db.update, 'transactions', {
+    await adb.update('transactions', {
         'status': 'rejected',
         'approved_at': datetime.now().isoformat(),
         'admin_note': admin_note
@@ -863,7 +1105,7 @@ async def bot_admin_reject_transaction():
 
 @app.post("/bot_api/admin/manage_user")
 async def bot_admin_manage_user():
-    data = request.json
+    data = await get_json_body()
     admin_telegram_id = data.get('admin_telegram_id')
     target_telegram_id = data.get('target_telegram_id')
     action = data.get('action') # 'ban', 'unban', 'update_traffic', 'update_time'
@@ -872,13 +1114,12 @@ async def bot_admin_manage_user():
     if not all([admin_telegram_id, target_telegram_id, action]):
         return error_response("Missing required fields.", 400)
     
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if str(admin_telegram_id) != admin_telegram_id:
         return error_response("Unauthorized", 403)
 
-    user = await asyncio.to_thread(candy_panel.db.get, 'users', where={'telegram_id': target_telegram_id})
+    user = await adb.get('users', where={'telegram_id': target_telegram_id})
     if not user:
         return error_response("Target user not found.", 404)
 
@@ -940,7 +1181,8 @@ async def bot_admin_manage_user():
         return error_response("Invalid action or missing value.", 400)
 
     if update_data:
-        await asyncio.to_thread(candy_panel.db.update, 'users', update_data, {'telegram_id': target_telegram_id})
+        await adb.update('users', update_data, {'telegram_id': target_telegram_id})
+        candy_panel._invalidate_account_status(target_telegram_id)
     
     if success_status:
         return success_response(message)
@@ -950,59 +1192,80 @@ async def bot_admin_manage_user():
 
 @app.post("/bot_api/admin/send_message_to_all")
 async def bot_admin_send_message_to_all():
-    data = request.json
+    data = await get_json_body()
     telegram_id = data.get('telegram_id')
     message_text = data.get('message')
 
     if not all([telegram_id, message_text]):
         return error_response("Missing telegram_id or message.", 400)
     
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if str(telegram_id) != admin_telegram_id:
         return error_response("Unauthorized", 403)
 
-    all_users = await asyncio.to_thread(candy_panel.db.select, 'users')
-    user_ids = [user['telegram_id'] for user in all_users]
+    user_ids = [telegram_id async for telegram_id, in adb.iter_select('users', ['telegram_id'], row_type='tuple')]
 
     # This API endpoint just prepares the list of users.
     # The Telegram bot itself will handle the actual sending to avoid blocking the API.
     return success_response("Broadcast message prepared.", data={"target_user_ids": user_ids, "message": message_text})
+@app.post("/bot_api/admin/forecast")
+async def bot_admin_forecast():
+    data = await get_json_body()
+    telegram_id = data.get('telegram_id')
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
+
+    if not telegram_id or str(telegram_id) != admin_telegram_id:
+        return error_response("Unauthorized", 403)
+
+    try:
+        hours = min(max(float(data.get('hours', 24)), 0), 168)
+        limit = max(int(data.get('limit', 30)), 1)
+    except (TypeError, ValueError):
+        return error_response("'hours' and 'limit' must be numbers.", 400)
+    forecast = await asyncio.to_thread(candy_panel._get_forecast, hours, limit)
+    if forecast is None:
+        return error_response("No forecast yet: it is computed on each sync and needs numpy installed.", 503)
+    return success_response("Forecast retrieved successfully.", data=forecast)
+@app.post("/bot_api/admin/top")
+async def bot_admin_top():
+    data = await get_json_body()
+    telegram_id = data.get('telegram_id')
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
+
+    if not telegram_id or str(telegram_id) != admin_telegram_id:
+        return error_response("Unauthorized", 403)
+
+    status, top = await asyncio.to_thread(top_talkers, data.get('by', 'rate'), data.get('n', 10))
+    if status != 200:
+        return error_response(top, status)
+    return success_response("Top clients retrieved successfully.", data=top)
 @app.get("/bot_api/admin/data")
 async def bot_admin_data():
     try:
         # Fetch all data concurrently
         dashboard_stats_task = asyncio.to_thread(candy_panel._dashboard_stats)
-        clients_data_task = asyncio.to_thread(candy_panel._get_all_clients)
-        interfaces_data_task = asyncio.to_thread(candy_panel.db.select, 'interfaces')
-        settings_data_task = asyncio.to_thread(candy_panel.db.select, 'settings')
+        interfaces_data_task = adb.select('interfaces')
+        settings_data_task = adb.select('settings')
 
-        dashboard_stats, clients_data, interfaces_data, settings_raw = await asyncio.gather(
-            dashboard_stats_task, clients_data_task, interfaces_data_task, settings_data_task
+        dashboard_stats, interfaces_data, settings_raw = await asyncio.gather(
+            dashboard_stats_task, interfaces_data_task, settings_data_task
         )
 
-        # Process client data (parse used_trafic)
-        for client in clients_data:
-            try:
-                client['used_trafic'] = json.loads(client['used_trafic'])
-            except (json.JSONDecodeError, TypeError):
-                client['used_trafic'] = {"download": 0, "upload": 0}
-        
         # Process settings data (convert to dict)
         settings_data = {setting['key']: setting['value'] for setting in settings_raw}
 
-        return success_response("All data retrieved successfully.", data={
+        # Clients are streamed from the table in chunks, with used_trafic already parsed
+        return await streamed_success_response("All data retrieved successfully.", {
             "dashboard": dashboard_stats,
-            "clients": clients_data,
             "interfaces": interfaces_data,
             "settings": settings_data
-        })
+        }, "clients", candy_panel._iter_clients())
     except Exception as e:
         return error_response(f"Failed to retrieve all data: {e}", 500)
 @app.post("/bot_api/admin/server_control")
 async def bot_admin_server_control():
-    data = request.json
+    data = await get_json_body()
     admin_telegram_id = data.get('admin_telegram_id')
     resource = data.get('resource')
     action = data.get('action')
@@ -1011,8 +1274,7 @@ async def bot_admin_server_control():
     if not all([admin_telegram_id, resource, action]):
         return error_response("Missing admin_telegram_id, resource, or action.", 400)
     
-    admin_telegram_id_setting = await asyncio.to_thread(candy_panel.db.get, 'settings', where={'key': 'telegram_bot_admin_id'})
-    admin_telegram_id = admin_telegram_id_setting['value'] if admin_telegram_id_setting else '0'
+    admin_telegram_id = await get_setting('telegram_bot_admin_id', '0')
 
     if str(admin_telegram_id) != admin_telegram_id:
         return error_response("Unauthorized", 403)
@@ -1089,16 +1351,37 @@ async def bot_admin_server_control():
 
 
 @app.route('/')
-def serve_root_index():
-    return send_file(os.path.join(app.static_folder, 'index.html'))
+async def serve_root_index():
+    return await send_static(os.path.join(app.static_folder, 'index.html'))
 
 @app.route('/<path:path>')
-def catch_all_frontend_routes(path):
+async def catch_all_frontend_routes(path):
     static_file_path = os.path.join(app.static_folder, path)
     if os.path.exists(static_file_path) and os.path.isfile(static_file_path):
-        return send_file(static_file_path)
+        return await send_static(static_file_path)
     else:
-        return send_file(os.path.join(app.static_folder, 'index.html'))
-# This is for development purposes only. For production, use a WSGI server like Gunicorn.
+        return await send_static(os.path.join(app.static_folder, 'index.html'))
+
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=int(os.environ.get('AP_PORT',3446)))
\ No newline at end of file
+    port = int(os.environ.get('AP_PORT',3446))
+    workers = int(os.environ.get('CANDY_WORKERS', 1))
+    if SERVER_MODE == 'asgi':
+        # Production: one Hypercorn event loop serves panel, bot and public-page requests concurrently.
+        from hypercorn.config import Config
+        config = Config()
+        config.bind = [f"0.0.0.0:{port}"]
+        if workers > 1:
+            # CANDY_WORKERS processes share the port; each keeps its own caches, kept coherent
+            # through the `cache_generation` table (see CandyPanel._sync_cache_generations).
+            from hypercorn.run import run
+            config.application_path = 'asgi:app'
+            config.workers = workers
+            run(config)
+        else:
+            from hypercorn.asyncio import serve
+            asyncio.run(serve(app, config))
+    else:
+        if workers > 1:
+            print("[!] CANDY_WORKERS needs CANDY_SERVER=asgi; the Flask dev server runs a single process.")
+        # Development server only; set CANDY_SERVER=asgi (or run `hypercorn asgi:app`) in production.
+        app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host="0.0.0.0", port=port)
\ No newline at end of file
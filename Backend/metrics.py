@@ -0,0 +1,260 @@
+# metrics.py
+# In-process metrics with Prometheus text exposition, no client library needed.
+# Recording is a dict update under a lock; nothing is formatted until /metrics is scraped.
+# Other processes (cron.py's sync, bot.py) flush their values into JSON snapshots under METRICS_DIR,
+# which main.py merges into its /metrics output with a 'process' label.
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+ENABLED = os.environ.get('CANDY_METRICS', '1') != '0'
+METRICS_DIR = os.environ.get('CANDY_METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics'))
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {} # label values tuple -> value
+        self._lock = threading.Lock()
+
+    def _copy(self, value):
+        return value
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """
+        Returns this metric as a JSON-friendly dict, optionally clearing the in-memory values.
+        """
+        with self._lock:
+            values = [[list(key), self._copy(value)] for key, value in self._values.items()]
+            if reset:
+                self._values.clear()
+        return {'kind': self.kind, 'help': self.help, 'labels': list(self.labels), 'values': values}
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1]]
+
+    def observe(self, seconds: float, *labels):
+        """
+        Records one observation; 'labels' are the label values in declaration order.
+        """
+        if not ENABLED:
+            return
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0] # Per-bucket counts (last is +Inf), sum
+            entry[0][bisect_left(self.buckets, seconds)] += 1
+            entry[1] += seconds
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        snapshot = super().snapshot(reset)
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+class PhaseTimer:
+    def __init__(self, histogram: Histogram):
+        """
+        Times consecutive phases of one run: each lap() records the time since the previous lap.
+        """
+        self.histogram = histogram
+        self.started = self._last = time.perf_counter()
+        self.durations = {} # phase -> seconds, for this run only
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.histogram.observe(now - self._last, phase)
+        self.durations[phase] = self.durations.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+def _merge(into: dict, snapshot: dict):
+    """
+    Adds a snapshot's values into a previously stored one; counters and histograms accumulate, gauges are replaced.
+    """
+    for name, family in snapshot.items():
+        stored = into.get(name)
+        if stored is None or stored['kind'] != family['kind'] or stored.get('buckets') != family.get('buckets'):
+            into[name] = family
+            continue
+        values = {tuple(key): value for key, value in stored['values']}
+        for key, value in family['values']:
+            key, old = tuple(key), values.get(tuple(key))
+            if old is None or family['kind'] == 'gauge':
+                values[key] = value
+            elif family['kind'] == 'counter':
+                values[key] = old + value
+            else:
+                values[key] = [[a + b for a, b in zip(old[0], value[0])], old[1] + value[1]]
+        stored['values'] = [[list(key), value] for key, value in values.items()]
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._last_flush = 0.0
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def snapshot(self, reset: bool = False) -> dict:
+        return {name: metric.snapshot(reset) for name, metric in self._metrics.items()}
+
+    def flush(self, process: str, min_interval: float = 0):
+        """
+        Adds everything recorded since the last flush to METRICS_DIR/<process>.json and clears it here.
+        Meant for processes that don't serve /metrics themselves; 'min_interval' rate-limits calls from hot paths.
+        """
+        if not ENABLED or time.monotonic() - self._last_flush < min_interval:
+            return
+        self._last_flush = time.monotonic()
+        snapshot = self.snapshot(reset=True)
+        path = os.path.join(METRICS_DIR, f"{process}.json")
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(f"{path}.lock", 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX) # Overlapping cron runs flush into the same file
+                stored = {}
+                if os.path.exists(path):
+                    with open(path) as f:
+                        stored = json.load(f)
+                _merge(stored, snapshot)
+                with open(f"{path}.tmp", 'w') as f:
+                    json.dump(stored, f)
+                os.replace(f"{path}.tmp", path)
+        except (OSError, ValueError) as e:
+            print(f"[!] Could not write metrics snapshot {path}: {e}")
+
+    def render(self, process: str = 'api') -> str:
+        """
+        Renders this process's metrics plus every flushed snapshot in METRICS_DIR in text exposition format.
+        """
+        sources = [(process, self.snapshot())]
+        if os.path.isdir(METRICS_DIR):
+            for filename in sorted(os.listdir(METRICS_DIR)):
+                if filename.endswith('.json'):
+                    try:
+                        with open(os.path.join(METRICS_DIR, filename)) as f:
+                            sources.append((filename[:-5], json.load(f)))
+                    except (OSError, ValueError):
+                        continue
+
+        lines = []
+        for name in sorted({name for _, snapshot in sources for name in snapshot}):
+            families = [(source, snapshot[name]) for source, snapshot in sources if name in snapshot]
+            kind = families[0][1]['kind']
+            lines.append(f"# HELP {name} {families[0][1]['help']}")
+            lines.append(f"# TYPE {name} {kind}")
+            for source, family in families:
+                source_label = f'process="{_escape(source)}"'
+                for key, value in family['values']:
+                    if kind != 'histogram':
+                        lines.append(f"{name}{_format_labels(family['labels'], key, source_label)} {value}")
+                        continue
+                    counts, total = value
+                    cumulative = 0
+                    for bound, count in zip(family['buckets'] + ['+Inf'], counts):
+                        cumulative += count
+                        le = 'le="+Inf"' if bound == '+Inf' else f'le="{_format_bound(bound)}"'
+                        lines.append(f"{name}_bucket{_format_labels(family['labels'], key, source_label + ',' + le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(family['labels'], key, source_label)} {total}")
+                    lines.append(f"{name}_count{_format_labels(family['labels'], key, source_label)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'candy_db_query_seconds', 'SQLite statement latency by table and operation (count = number of queries).',
+    ('table', 'operation'))
+SUBPROCESS_SECONDS = REGISTRY.histogram(
+    'candy_subprocess_seconds', 'Wall time of spawned commands such as wg, wg-quick and systemctl (count = spawns).',
+    ('command',), SLOW_BUCKETS)
+SYNC_PHASE_SECONDS = REGISTRY.histogram(
+    'candy_sync_phase_seconds', 'Duration of each _sync phase.', ('phase',), SLOW_BUCKETS)
+SYNC_SECONDS = REGISTRY.histogram(
+    'candy_sync_seconds', 'Duration of a whole _sync run.', (), SLOW_BUCKETS)
+SYNC_LAST_SUCCESS = REGISTRY.gauge(
+    'candy_sync_last_success_timestamp_seconds', 'Unix time the last _sync run completed.')
+WG_OP_SECONDS = REGISTRY.histogram(
+    'candy_wg_op_seconds', 'WireGuard operations by op and transport (privileged helper or subprocess fallback).',
+    ('op', 'transport'), SLOW_BUCKETS)
+INTERFACE_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    'candy_interface_lock_wait_seconds', 'Time spent waiting for a per-interface lock (see locks.py).', ('interface',))
+COLLECTOR_SECONDS = REGISTRY.histogram(
+    'candy_collector_seconds', 'Traffic collector poll and flush durations.', ('step',), SLOW_BUCKETS)
+COLLECTOR_FLUSHED_ROWS = REGISTRY.counter(
+    'candy_collector_flushed_rows_total', 'Client rows the traffic collector wrote in batches.')
+QUOTA_WATCHED_CLIENTS = REGISTRY.gauge(
+    'candy_quota_watched_clients', 'Clients close enough to their quota to be polled on the fast cadence.')
+BACKUP_SECONDS = REGISTRY.histogram(
+    'candy_backup_seconds', 'Duration of backup snapshots (see backup.py).', (), SLOW_BUCKETS)
+BACKUP_LAST_SUCCESS = REGISTRY.gauge(
+    'candy_backup_last_success_timestamp_seconds', 'Unix time the last backup snapshot completed.')
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'candy_http_request_seconds', 'API request latency by route template.', ('method', 'route', 'status'))
+BOT_API_SECONDS = REGISTRY.histogram(
+    'candy_bot_api_seconds', 'Latency of bot calls to the unified API, as seen by the bot.', ('endpoint', 'outcome'))
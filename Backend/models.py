@@ -0,0 +1,143 @@
+# models.py
+# Slotted record types for what _sync and the traffic collector handle by the thousand: Client (a `clients` row
+# with used_trafic parsed into counters once, at the database boundary), Interface, and PeerStats (one peer's
+# `wg show dump` counters). from_row() builds them from a row, to_dict() gives the JSON shape the API returns,
+# and item access (client['name']) keeps code written against dict rows working.
+import json
+
+class _Record:
+    __slots__ = ()
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+class PeerStats(_Record):
+    __slots__ = ('rx', 'tx')
+
+    def __init__(self, rx: int = 0, tx: int = 0):
+        self.rx = rx
+        self.tx = tx
+
+class Interface(_Record):
+    __slots__ = ('wg', 'private_key', 'public_key', 'port', 'address_range', 'status')
+
+    def __init__(self, wg: int, private_key: str = None, public_key: str = None, port: int = None,
+                 address_range: str = None, status: bool = True):
+        self.wg = wg
+        self.private_key = private_key
+        self.public_key = public_key
+        self.port = port
+        self.address_range = address_range
+        self.status = status
+
+    @classmethod
+    def from_row(cls, row) -> 'Interface':
+        """
+        Builds an Interface from an `interfaces` row (a dict or sqlite3.Row with any subset of the columns).
+        """
+        return cls(**{key: row[key] for key in row.keys() if key in INTERFACE_COLUMNS})
+
+class Client(_Record):
+    __slots__ = ('name', 'wg', 'public_key', 'private_key', 'address', 'created_at', 'expires', 'note', 'traffic',
+                 'connected_now', 'status', 'quota', 'download', 'upload', 'last_wg_rx', 'last_wg_tx')
+
+    def __init__(self, name: str, wg: int = None, public_key: str = None, private_key: str = None, address: str = None,
+                 created_at: str = None, expires: str = None, note: str = '', traffic: str = '0', connected_now: bool = False,
+                 status: bool = True, download: int = 0, upload: int = 0, last_wg_rx: int = 0, last_wg_tx: int = 0):
+        self.name = name
+        self.wg = wg
+        self.public_key = public_key
+        self.private_key = private_key
+        self.address = address
+        self.created_at = created_at
+        self.expires = expires
+        self.note = note
+        self.set_traffic(traffic)
+        self.connected_now = connected_now
+        self.status = status
+        self.download = download
+        self.upload = upload
+        self.last_wg_rx = last_wg_rx
+        self.last_wg_tx = last_wg_tx
+
+    @classmethod
+    def from_row(cls, row, strict: bool = True) -> 'Client':
+        """
+        Builds a Client from a `clients` row (a dict or sqlite3.Row with any subset of the columns), parsing used_trafic.
+        An unreadable used_trafic raises ValueError, or with strict=False leaves the counters at 0.
+        """
+        keys = row.keys()
+        client = cls(**{key: row[key] for key in keys if key in CLIENT_COLUMNS})
+        used = row['used_trafic'] if 'used_trafic' in keys else None
+        if used:
+            try:
+                counters = json.loads(used)
+                client.download = int(counters.get('download', 0))
+                client.upload = int(counters.get('upload', 0))
+                client.last_wg_rx = int(counters.get('last_wg_rx', 0))
+                client.last_wg_tx = int(counters.get('last_wg_tx', 0))
+            except (ValueError, TypeError, AttributeError) as e:
+                if strict:
+                    raise ValueError(f"Unreadable used_trafic for client '{client.name}': {e}") from None
+        return client
+
+    def set_traffic(self, traffic: str):
+        """
+        Sets the `traffic` column value and 'quota', its byte count (0, unlimited, when it isn't a number).
+        """
+        self.traffic = traffic
+        try:
+            self.quota = int(traffic)
+        except (TypeError, ValueError):
+            self.quota = 0
+
+    @property
+    def used(self) -> int:
+        return self.download + self.upload
+
+    def add_reading(self, rx: int, tx: int) -> int:
+        """
+        Folds the interface's current counters into download/upload and returns the bytes added.
+        A counter below the last reading started over (interface or peer re-created), so all of it is new.
+        """
+        delta_rx = rx - self.last_wg_rx if rx >= self.last_wg_rx else rx
+        delta_tx = tx - self.last_wg_tx if tx >= self.last_wg_tx else tx
+        self.download += delta_rx
+        self.upload += delta_tx
+        self.last_wg_rx = rx
+        self.last_wg_tx = tx
+        return delta_rx + delta_tx
+
+    def used_trafic_json(self) -> str:
+        """
+        The `used_trafic` column value; the counters are always ints, so this skips json.dumps.
+        """
+        return (f'{{"download": {self.download}, "upload": {self.upload}, '
+                f'"last_wg_rx": {self.last_wg_rx}, "last_wg_tx": {self.last_wg_tx}}}')
+
+    def to_dict(self) -> dict:
+        """
+        The API shape: the `clients` columns, with used_trafic as a dict.
+        """
+        data = {name: getattr(self, name) for name in CLIENT_COLUMNS}
+        data['used_trafic'] = {'download': self.download, 'upload': self.upload,
+                               'last_wg_rx': self.last_wg_rx, 'last_wg_tx': self.last_wg_tx}
+        return data
+
+CLIENT_COLUMNS = Client.__slots__[:11] # Stored as-is; used_trafic becomes the counters
+INTERFACE_COLUMNS = Interface.__slots__
@@ -0,0 +1,23 @@
+# optional.py
+# Optional dependencies (segno, numpy), imported on first use: cron.py and bot restarts start a fresh interpreter
+# each time and most of them never need these. Every module is looked up once per process, whoever asks first.
+import importlib
+
+_modules = {} # Module name -> module, or None when it isn't installed
+_warned = set() # Warnings already printed
+
+def optional_import(name: str, warning: str = None):
+    """
+    Returns the module 'name', imported on first use; None when it isn't installed. 'warning', when given, is printed
+    the first time it applies.
+    """
+    if name not in _modules:
+        try:
+            _modules[name] = importlib.import_module(name)
+        except ImportError:
+            _modules[name] = None
+    module = _modules[name]
+    if module is None and warning and warning not in _warned:
+        _warned.add(warning)
+        print(f"[!] {warning}")
+    return module
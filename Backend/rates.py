@@ -0,0 +1,186 @@
+# rates.py
+# Live per-client and per-interface throughput for the traffic collector, held in memory only.
+# Every tracked client gets a slot in flat array('d')/array('q') rings of RATE_SAMPLES (time, download, upload)
+# samples of its running totals, written only when its counters move; every interface keeps the times and running
+# totals of its last RATE_SAMPLES full polls. A client's totals at any poll time are those of its latest sample at
+# or before it, so rates are worked out on read: 'instant' over the last poll interval, 'average' over all the
+# polls in the ring. Totals are already corrected for counter resets, so rates are plain differences.
+import os
+from array import array
+from collections import deque
+
+RATE_SAMPLES = min(max(int(os.environ.get('CANDY_RATE_SAMPLES', '6')), 2), 255) # Samples per client and per interface
+
+def _bits_per_second(start: tuple, end: tuple, average_start: tuple) -> dict:
+    """
+    Bits per second between (time, download, upload) samples: 'start' to 'end' and 'average_start' to 'end'.
+    """
+    span, average_span = end[0] - start[0], end[0] - average_start[0]
+    return {
+        'download_bps': int((end[1] - start[1]) * 8 / span) if span > 0 else 0,
+        'upload_bps': int((end[2] - start[2]) * 8 / span) if span > 0 else 0,
+        'download_bps_avg': int((end[1] - average_start[1]) * 8 / average_span) if average_span > 0 else 0,
+        'upload_bps_avg': int((end[2] - average_start[2]) * 8 / average_span) if average_span > 0 else 0,
+    }
+
+class PeerRates:
+    def __init__(self, samples: int = RATE_SAMPLES):
+        """
+        Rings of 'samples' entries per client and per interface. Not thread-safe; TrafficCollector guards it.
+        """
+        self.samples = samples
+        self.slots = {} # public_key -> slot; slot s owns entries [s * samples, (s + 1) * samples)
+        self._free = [] # Slots of clients no longer tracked
+        self._at = array('d')
+        self._download = array('q')
+        self._upload = array('q')
+        self._head = array('B') # Per slot: entry the next sample goes to
+        self._count = array('B') # Per slot: samples held
+        self._unseen = set() # Tracked clients without a baseline sample yet
+        self._polls = {} # wg -> deque of (time, download, upload) per full poll
+        self._totals = {} # wg -> [download, upload] of its tracked clients since the collector started
+        self.generation = 0 # Bumped by every full poll and roster change; rates only change with it
+
+    def track(self, peers: dict, fresh: set):
+        """
+        Keeps slots for the clients in 'peers' ({public_key: Client}) and drops the rest. Clients in 'fresh'
+        (new, or re-created under the same key) start over: their first reading is a baseline, since what it adds
+        to their totals was used over an unknown time.
+        """
+        for key in [key for key in self.slots if key not in peers]:
+            self._free.append(self.slots.pop(key))
+            self._unseen.discard(key)
+        for key in peers:
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self._free.pop() if self._free else self._grow()
+                self.slots[key] = slot
+            elif key not in fresh:
+                continue
+            self._count[slot] = 0
+            self._unseen.add(key)
+        self.generation += 1
+
+    def _grow(self) -> int:
+        slot = len(self._head)
+        self._at.extend(array('d', bytes(8 * self.samples)))
+        self._download.extend(array('q', bytes(8 * self.samples)))
+        self._upload.extend(array('q', bytes(8 * self.samples)))
+        self._head.append(0)
+        self._count.append(0)
+        return slot
+
+    def record(self, slot: int, at: float, download: int, upload: int):
+        """
+        Stores a client's totals as of 'at'.
+        """
+        head = self._head[slot]
+        entry = slot * self.samples + head
+        self._at[entry], self._download[entry], self._upload[entry] = at, download, upload
+        self._head[slot] = (head + 1) % self.samples
+        if self._count[slot] < self.samples:
+            self._count[slot] += 1
+
+    def moved(self, key: str, peer, download: int, upload: int, at: float):
+        """
+        Records the totals of a client whose counters moved at 'at', 'download'/'upload' bytes since its last reading.
+        """
+        # record() inlined: this runs for every moving client on every poll
+        slot = self.slots[key]
+        count = self._count[slot]
+        if count:
+            totals = self._totals.get(peer.wg)
+            if totals is None:
+                totals = self._totals[peer.wg] = [0, 0]
+            totals[0] += download
+            totals[1] += upload
+        head = self._head[slot]
+        entry = slot * self.samples + head
+        self._at[entry], self._download[entry], self._upload[entry] = at, peer.download, peer.upload
+        self._head[slot] = head + 1 if head + 1 < self.samples else 0
+        if count < self.samples:
+            self._count[slot] = count + 1
+
+    def seen(self, read, peers: dict, at: float):
+        """
+        Takes the baseline of the fresh clients among the public keys in 'read' (read at 'at') whose counters didn't move.
+        """
+        for key in [key for key in self._unseen if key in read]:
+            self._unseen.discard(key)
+            slot = self.slots[key]
+            if not self._count[slot]:
+                self.record(slot, at, peers[key].download, peers[key].upload)
+
+    def polled(self, interfaces: list[int], at: float):
+        """
+        Marks a full poll of 'interfaces' that read every client on them at 'at'.
+        """
+        for wg in interfaces:
+            totals = self._totals.get(wg, (0, 0))
+            polls = self._polls.get(wg)
+            if polls is None:
+                polls = self._polls[wg] = deque(maxlen=self.samples)
+            polls.append((at, totals[0], totals[1]))
+        self.generation += 1
+
+    def _rate(self, slot: int, polls: deque) -> dict | None:
+        """
+        Rates of the client in 'slot' over 'polls', its interface's full polls (two or more).
+        """
+        samples, at = self.samples, self._at
+        base, head, count = slot * samples, self._head[slot], self._count[slot]
+        # Newest sample first: the totals at each poll time are those of the first sample at or before it. Polls
+        # before the baseline (or older than the ring reaches) start at the oldest sample instead.
+        end_at, previous_at, first_at = polls[-1][0], polls[-2][0], polls[0][0]
+        end = previous = first = None
+        for i in range(1, count + 1):
+            entry = base + (head - i) % samples
+            sample_at = at[entry]
+            if end is None:
+                if sample_at > end_at:
+                    continue
+                end = (end_at, entry)
+            if previous is None and sample_at <= previous_at:
+                previous = (previous_at, entry)
+            if sample_at <= first_at:
+                first = (first_at, entry)
+                break
+        if end is None:
+            return None
+        oldest = base + (head - count) % samples
+        start, average_start = previous or (at[oldest], oldest), first or (at[oldest], oldest)
+        return _bits_per_second(*((sample_at, self._download[entry], self._upload[entry])
+                       for sample_at, entry in (start, end, average_start)))
+
+    def peer(self, key: str, wg: int) -> dict | None:
+        """
+        Rates of the client with public key 'key' on interface 'wg'; None until two full polls have read it.
+        """
+        slot = self.slots.get(key)
+        polls = self._polls.get(wg)
+        if slot is None or not polls or len(polls) < 2 or not self._count[slot]:
+            return None
+        return self._rate(slot, polls)
+
+    def active(self, peers: dict) -> dict:
+        """
+        {public_key: rates} of the clients in 'peers' ({public_key: Client}) whose totals moved within the window.
+        """
+        rates, samples, at, count = {}, self.samples, self._at, self._count
+        for key, slot in self.slots.items():
+            peer = peers.get(key)
+            polls = self._polls.get(peer.wg) if peer is not None else None
+            if not polls or len(polls) < 2 or count[slot] < 2:
+                continue
+            if at[slot * samples + (self._head[slot] - 1) % samples] <= polls[0][0]: # Unchanged since the window began
+                continue
+            rate = self._rate(slot, polls)
+            if rate and any(rate.values()):
+                rates[key] = rate
+        return rates
+
+    def interfaces(self) -> dict:
+        """
+        {wg: rates} of every interface with two full polls recorded.
+        """
+        return {wg: _bits_per_second(polls[-2], polls[-1], polls[0]) for wg, polls in self._polls.items() if len(polls) >= 2}
@@ -0,0 +1,71 @@
+# talkers.py
+# Heavy hitters over the last hour and day for the traffic collector, held in memory only.
+# Usage is cut into TOP_BUCKET_SECONDS buckets: when one closes, every client's bytes in it (its running total minus
+# the total it had when the bucket opened) go through heapq.nlargest and only the TOP_KEEP heaviest are kept. A
+# window's ranking sums the bucket summaries it covers, so a client is counted in the buckets where it was among the
+# TOP_KEEP heaviest: exact for anyone near the top, a lower bound further down. Nothing is done per poll except
+# checking the bucket's age, and a window's merged ranking is cached until the next bucket closes.
+import heapq
+import os
+from collections import deque
+from datetime import datetime
+from operator import itemgetter
+
+TOP_BUCKET_SECONDS = 300
+TOP_KEEP = int(os.environ.get('CANDY_TOP_KEEP', '1000')) # Clients kept per bucket
+TOP_WINDOWS = {'hour': 3600, 'day': 86400}
+
+class TopTalkers:
+    def __init__(self, keep: int = TOP_KEEP, bucket_seconds: float = TOP_BUCKET_SECONDS):
+        """
+        Bucketed usage summaries. Not thread-safe; TrafficCollector guards it.
+        """
+        self.keep = keep
+        self.bucket_seconds = bucket_seconds
+        self._marks = {} # public_key -> download + upload when the open bucket started
+        self._opened_at = None
+        self._buckets = deque() # (opened_at, closed_at, {name: bytes}) of the last day, oldest first
+        self._merged = {} # window -> (since, ranking), until the next bucket closes
+
+    def tick(self, peers: dict, at: float):
+        """
+        Called after every full poll of 'peers' ({public_key: Client}) at 'at'; closes the open bucket once it is
+        bucket_seconds old and opens the next.
+        """
+        if self._opened_at is not None and at - self._opened_at < self.bucket_seconds:
+            return
+        if self._opened_at is not None:
+            marks = self._marks
+            # Clients that joined during the bucket have no mark: their first bytes were used over an unknown time
+            used = ((peer.name, peer.download + peer.upload - mark) for key, peer in peers.items()
+                    if (mark := marks.get(key)) is not None)
+            top = heapq.nlargest(self.keep, (item for item in used if item[1] > 0), key=itemgetter(1))
+            self._buckets.append((self._opened_at, at, dict(top)))
+            while self._buckets and self._buckets[0][1] <= at - max(TOP_WINDOWS.values()):
+                self._buckets.popleft()
+            self._merged.clear()
+        self._marks = {key: peer.download + peer.upload for key, peer in peers.items()}
+        self._opened_at = at
+
+    def top(self, window: str, n: int) -> dict:
+        """
+        The 'n' clients that used the most bytes over 'window' ('hour' or 'day'), counted in closed buckets.
+        """
+        merged = self._merged.get(window)
+        if merged is None:
+            # Buckets closing within the window; one that straddles its start still counts whole
+            start = self._buckets[-1][1] - TOP_WINDOWS[window] if self._buckets else 0
+            totals = {}
+            since = None
+            for opened_at, closed_at, summary in self._buckets:
+                if closed_at <= start:
+                    continue
+                since = opened_at if since is None else since
+                for name, used in summary.items():
+                    totals[name] = totals.get(name, 0) + used
+            merged = self._merged[window] = (since, heapq.nlargest(self.keep, totals.items(), key=itemgetter(1)))
+        since, ranking = merged
+        until = self._buckets[-1][1] if self._buckets else None
+        return {'since': datetime.fromtimestamp(since).isoformat(timespec='seconds') if since else None,
+                'until': datetime.fromtimestamp(until).isoformat(timespec='seconds') if until else None,
+                'clients': [{'name': name, 'bytes': used} for name, used in ranking[:n]]}
@@ -0,0 +1,83 @@
+# traffic_engine.py
+# Vectorized traffic pass for large fleets. The pure-Python pass in core.py parses every client's used_trafic JSON
+# and folds its counters in one client at a time. This one lets SQLite extract the counters (json_extract), puts
+# each chunk into aligned int64 arrays next to the current `wg show dump` readings, and computes deltas, counter
+# resets, totals, the bandwidth sum and the over-quota mask in a handful of numpy operations. Only rows whose
+# counters moved are written back.
+# numpy is optional: CANDY_TRAFFIC_ENGINE=auto (default) uses it when installed, 'python' never does,
+# 'numpy' warns when it is missing and falls back.
+import os
+from optional import optional_import
+
+TRAFFIC_ENGINE = os.environ.get('CANDY_TRAFFIC_ENGINE', 'auto')
+
+# One keyset chunk of `clients`: counters of unreadable used_trafic come back NULL ('readable' = 0) and are skipped
+# like the Python pass skips them; an empty used_trafic counts from zero. Non-numeric quotas are 0 (unlimited).
+CHUNK_QUERY = """
+    SELECT `rowid`, `name`, `public_key`, `status`,
+           CASE WHEN `traffic` GLOB '[0-9]*' AND `traffic` NOT GLOB '*[^0-9]*' THEN CAST(`traffic` AS INTEGER) ELSE 0 END,
+           CASE WHEN COALESCE(`used_trafic`, '') = '' THEN 1
+                WHEN json_valid(`used_trafic`) THEN json_type(`used_trafic`) = 'object' ELSE 0 END,
+           COALESCE(CAST(json_extract(CASE WHEN json_valid(`used_trafic`) THEN `used_trafic` END, '$.download') AS INTEGER), 0),
+           COALESCE(CAST(json_extract(CASE WHEN json_valid(`used_trafic`) THEN `used_trafic` END, '$.upload') AS INTEGER), 0),
+           COALESCE(CAST(json_extract(CASE WHEN json_valid(`used_trafic`) THEN `used_trafic` END, '$.last_wg_rx') AS INTEGER), 0),
+           COALESCE(CAST(json_extract(CASE WHEN json_valid(`used_trafic`) THEN `used_trafic` END, '$.last_wg_tx') AS INTEGER), 0)
+    FROM `clients` WHERE `rowid` > ? ORDER BY `rowid` LIMIT ?
+"""
+
+def load_numpy():
+    """
+    numpy for the traffic pass; None when it is missing or CANDY_TRAFFIC_ENGINE=python.
+    """
+    if TRAFFIC_ENGINE == 'python':
+        return None
+    return optional_import('numpy', "CANDY_TRAFFIC_ENGINE=numpy but numpy isn't installed; using the Python traffic pass."
+                           if TRAFFIC_ENGINE == 'numpy' else None)
+
+class PeerCounters:
+    def __init__(self, np, readings: dict):
+        """
+        The current counters of every peer in 'readings' ({public_key: PeerStats}) as aligned arrays:
+        peer i has rx[i] and tx[i]. A trailing 0/0 entry stands in for peers missing from the dump.
+        """
+        self.np = np
+        self.index = {key: i for i, key in enumerate(readings)}
+        count = len(readings)
+        self.rx = np.zeros(count + 1, dtype=np.int64)
+        self.tx = np.zeros(count + 1, dtype=np.int64)
+        self.rx[:count] = np.fromiter((stats.rx for stats in readings.values()), dtype=np.int64, count=count)
+        self.tx[:count] = np.fromiter((stats.tx for stats in readings.values()), dtype=np.int64, count=count)
+
+    def apply_chunk(self, rows: list) -> tuple[list[tuple[str, str]], int, list[str], int]:
+        """
+        Folds the current counters into one CHUNK_QUERY result.
+        Returns ((used_trafic, name) rows that changed, bytes consumed, names of enabled clients now at or over
+        their quota, counter resets seen).
+        """
+        np = self.np
+        count = len(rows)
+        _, names, keys, status, quota, readable, download, upload, last_rx, last_tx = zip(*rows)
+        missing = len(self.index)
+        peer = np.fromiter((self.index.get(key, missing) for key in keys), dtype=np.intp, count=count)
+        rx, tx = self.rx[peer], self.tx[peer]
+        status, quota, readable = np.array(status, dtype=bool), np.array(quota, dtype=np.int64), np.array(readable, dtype=bool)
+        download, upload = np.array(download, dtype=np.int64), np.array(upload, dtype=np.int64)
+        last_rx, last_tx = np.array(last_rx, dtype=np.int64), np.array(last_tx, dtype=np.int64)
+
+        # A counter below the last reading started over (interface or peer re-created), so all of it is new
+        reset_rx, reset_tx = rx < last_rx, tx < last_tx
+        delta_rx = np.where(reset_rx, rx, rx - last_rx)
+        delta_tx = np.where(reset_tx, tx, tx - last_tx)
+        download += delta_rx
+        upload += delta_tx
+        changed = readable & ((rx != last_rx) | (tx != last_tx))
+        over_quota = readable & status & (quota > 0) & (download + upload >= quota)
+
+        for i in np.flatnonzero(~readable).tolist():
+            print(f"[!] Unreadable used_trafic for client '{names[i]}'. Skipping this client's traffic update.")
+        bandwidth = int((delta_rx + delta_tx)[readable].sum())
+        resets = int((readable & (reset_rx | reset_tx)).sum())
+        writes = [(f'{{"download": {d}, "upload": {u}, "last_wg_rx": {r}, "last_wg_tx": {t}}}', names[i])
+                  for i, d, u, r, t in zip(np.flatnonzero(changed).tolist(), download[changed].tolist(),
+                                           upload[changed].tolist(), rx[changed].tolist(), tx[changed].tolist())]
+        return writes, bandwidth, [names[i] for i in np.flatnonzero(over_quota).tolist()], resets
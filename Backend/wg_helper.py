@@ -0,0 +1,327 @@
+# wg_helper.py
+# Privileged WireGuard helper. Started once as root (see setup.sh), it serves structured requests
+# (dump, peer and listen-port changes, addresses and MTU, syncconf, interface up/down, wg-quick@ units,
+# ufw port rules) over a Unix socket, so the panel no longer spawns a shell plus sudo for every operation.
+#
+#   sudo python3 wg_helper.py [--socket /run/candy-panel/wg-helper.sock] [--group <panel user's group>]
+#
+# CandyPanel talks to it through WireGuardOps, which falls back to argv-list subprocesses
+# (prefixed with sudo only when not running as root) whenever the socket isn't available. Through sudo, peer and
+# listen-port changes are applied with `wg syncconf` from the config file instead of `wg set`, and address and MTU
+# changes aren't made at all (reconciling then restarts the interface with wg-quick): setup.sh grants neither
+# `wg set` nor `ip address`/`ip link set`, as sudoers can't restrict their arguments (its '*' matches spaces too).
+import argparse
+import grp
+import ipaddress
+import json
+import os
+import queue
+import re
+import socket
+import socketserver
+import subprocess
+import time
+import metrics
+
+HELPER_SOCKET = os.environ.get('CANDY_WG_HELPER_SOCKET', '/run/candy-panel/wg-helper.sock')
+HELPER_POOL_SIZE = 4 # Connections kept open per panel process
+HELPER_RETRY_SECONDS = 5 # After a failed connect, use subprocesses for this long before trying again
+INTERFACE_RE = re.compile(r"^wg\d{1,4}$")
+KEY_RE = re.compile(r"^[A-Za-z0-9+/]{43}=$")
+SERVICE_ACTIONS = ('enable', 'disable', 'start', 'stop', 'restart')
+ADDRESS_ACTIONS = ('add', 'del')
+PEERS_PER_SET = 256 # Peers per `wg set` in remove_peers; keeps the argv far below ARG_MAX
+UFW_COMMANDS = (('default', 'deny', 'incoming'), ('default', 'allow', 'outgoing'), ('--force', 'enable'))
+# `wg set` also takes 'private-key <file>' and 'preshared-key <file>'. Every caller writes wgN.conf before these,
+# so without the helper syncconf applies the same change.
+SYNCCONF_OPS = ('set_peer', 'remove_peer', 'remove_peers', 'listen_port')
+HELPER_ONLY_OPS = ('address', 'mtu') # `ip address add|del` and `ip link set` accept far more than an address or MTU
+
+class CommandExecutionError(Exception):
+    pass
+
+def _interface(args: dict) -> str:
+    name = str(args.get('interface', ''))
+    if not INTERFACE_RE.match(name):
+        raise CommandExecutionError(f"Invalid interface name: {name!r}")
+    return name
+
+def _public_key(args: dict) -> str:
+    key = str(args.get('public_key', ''))
+    if not KEY_RE.match(key):
+        raise CommandExecutionError("Invalid WireGuard public key.")
+    return key
+
+def _allowed_ips(args: dict) -> str:
+    networks = [part.strip() for part in str(args.get('allowed_ips', '')).split(',') if part.strip()]
+    try:
+        return ','.join(str(ipaddress.ip_network(network, strict=False)) for network in networks)
+    except ValueError as e:
+        raise CommandExecutionError(f"Invalid allowed-ips: {e}")
+
+def _address(args: dict) -> str:
+    try:
+        return str(ipaddress.ip_interface(str(args.get('address', ''))))
+    except ValueError as e:
+        raise CommandExecutionError(f"Invalid interface address: {e}")
+
+def _number(args: dict, key: str, low: int, high: int) -> str:
+    value = args.get(key)
+    if not isinstance(value, int) or not low <= value <= high:
+        raise CommandExecutionError(f"Invalid {key}: {value!r}")
+    return str(value)
+
+def _ufw_args(args: dict) -> list[str]:
+    words = tuple(str(word) for word in args.get('args', ()))
+    if words in UFW_COMMANDS:
+        return list(words)
+    match = re.match(r"^(\d{1,5})/(udp|tcp)$", words[1]) if len(words) == 2 and words[0] == 'allow' else None
+    if match and 0 < int(match.group(1)) < 65536:
+        return list(words)
+    raise CommandExecutionError(f"Unsupported ufw command: {' '.join(words)}")
+
+def _run(argv: list[str], sudo: bool, stdin: str = None) -> str:
+    argv = ['sudo', *argv] if sudo else argv
+    with metrics.SUBPROCESS_SECONDS.time(argv[1] if sudo else argv[0]):
+        result = subprocess.run(argv, input=stdin, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise CommandExecutionError(f"Command '{' '.join(argv)}' failed: {result.stderr.strip()}")
+    return result.stdout
+
+def run_op(op: str, args: dict, sudo: bool = False) -> str:
+    """
+    Validates and runs one WireGuard operation with argv lists (never a shell) and returns its stdout.
+    Used by the helper daemon (as root) and by WireGuardOps when the daemon is unavailable.
+    """
+    if op == 'ping':
+        return 'pong'
+    if sudo and op in SYNCCONF_OPS:
+        op = 'syncconf'
+    if sudo and op in HELPER_ONLY_OPS:
+        raise CommandExecutionError(f"'{op}' needs the WireGuard helper or root.")
+    if op == 'dump':
+        return _run(['wg', 'show', _interface(args), 'dump'], sudo)
+    if op == 'set_peer':
+        return _run(['wg', 'set', _interface(args), 'peer', _public_key(args), 'allowed-ips', _allowed_ips(args)], sudo)
+    if op == 'remove_peer':
+        return _run(['wg', 'set', _interface(args), 'peer', _public_key(args), 'remove'], sudo)
+    if op == 'remove_peers':
+        keys = args.get('public_keys')
+        if not isinstance(keys, list) or not 0 < len(keys) <= PEERS_PER_SET:
+            raise CommandExecutionError(f"remove_peers takes 1 to {PEERS_PER_SET} public keys.")
+        words = [word for key in keys for word in ('peer', _public_key({'public_key': key}), 'remove')]
+        return _run(['wg', 'set', _interface(args), *words], sudo)
+    if op == 'listen_port':
+        return _run(['wg', 'set', _interface(args), 'listen-port', _number(args, 'port', 1, 65535)], sudo)
+    if op == 'addresses':
+        return _run(['ip', '-o', 'address', 'show', 'dev', _interface(args)], sudo)
+    if op == 'link':
+        return _run(['ip', '-o', 'link', 'show', 'dev', _interface(args)], sudo)
+    if op == 'address':
+        action = args.get('action')
+        if action not in ADDRESS_ACTIONS:
+            raise CommandExecutionError(f"Unsupported address action: {action!r}")
+        return _run(['ip', 'address', action, _address(args), 'dev', _interface(args)], sudo)
+    if op == 'mtu':
+        return _run(['ip', 'link', 'set', 'dev', _interface(args), 'mtu', _number(args, 'mtu', 576, 65535)], sudo)
+    if op == 'syncconf':
+        interface = _interface(args)
+        return _run(['wg', 'syncconf', interface, '/dev/stdin'], sudo, stdin=_run(['wg-quick', 'strip', interface], sudo))
+    if op in ('up', 'down'):
+        return _run(['wg-quick', op, _interface(args)], sudo)
+    if op == 'service':
+        action = args.get('action')
+        if action not in SERVICE_ACTIONS:
+            raise CommandExecutionError(f"Unsupported service action: {action!r}")
+        return _run(['systemctl', action, f"wg-quick@{_interface(args)}"], sudo)
+    if op == 'ufw':
+        return _run(['ufw', *_ufw_args(args)], sudo)
+    raise CommandExecutionError(f"Unknown operation: {op!r}")
+
+def generate_keypair() -> tuple[str, str]:
+    """
+    Generates a WireGuard key pair with two argv-list calls; needs no privileges, so it never goes to the helper.
+    """
+    private_key = _run(['wg', 'genkey'], sudo=False).strip()
+    public_key = _run(['wg', 'pubkey'], sudo=False, stdin=private_key).strip()
+    return private_key, public_key
+
+class WireGuardOps:
+    def __init__(self, socket_path: str = None, pool_size: int = HELPER_POOL_SIZE):
+        """
+        Runs WireGuard operations through the privileged helper, reusing up to 'pool_size' open connections.
+        Falls back to argv-list subprocesses when the helper isn't running.
+        """
+        self.socket_path = socket_path or HELPER_SOCKET
+        self.sudo = os.geteuid() != 0
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._retry_at = 0.0
+        self.op_count = 0 # Operations issued through this instance; _sync records its share in `sync_runs`
+
+    def _connect(self):
+        if time.monotonic() < self._retry_at or not os.path.exists(self.socket_path):
+            return None
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(120)
+            sock.connect(self.socket_path)
+            return sock, sock.makefile('rwb')
+        except OSError as e:
+            print(f"[!] WireGuard helper unavailable at {self.socket_path} ({e}); using subprocesses.")
+            self._retry_at = time.monotonic() + HELPER_RETRY_SECONDS
+            return None
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+
+    def call(self, op: str, **args) -> str:
+        """
+        Runs one operation and returns its stdout; raises CommandExecutionError on failure.
+        """
+        self.op_count += 1
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        if conn is None:
+            with metrics.WG_OP_SECONDS.time(op, 'subprocess'):
+                return run_op(op, args, sudo=self.sudo)
+
+        start = time.perf_counter()
+        try:
+            sock, stream = conn
+            stream.write(json.dumps({'op': op, 'args': args}).encode() + b'\n')
+            stream.flush()
+            line = stream.readline()
+            if not line:
+                raise OSError("helper closed the connection")
+            response = json.loads(line)
+        except (OSError, ValueError) as e:
+            conn[0].close()
+            print(f"[!] WireGuard helper request '{op}' failed ({e}); retrying with a subprocess.")
+            with metrics.WG_OP_SECONDS.time(op, 'subprocess'):
+                return run_op(op, args, sudo=self.sudo)
+        self._release(conn)
+        metrics.WG_OP_SECONDS.observe(time.perf_counter() - start, op, 'helper')
+        if not response.get('ok'):
+            raise CommandExecutionError(response.get('error', f"WireGuard helper failed: {op}"))
+        return response.get('stdout', '')
+
+    def dump(self, interface: str) -> str:
+        return self.call('dump', interface=interface)
+
+    def set_peer(self, interface: str, public_key: str, allowed_ips: str):
+        self.call('set_peer', interface=interface, public_key=public_key, allowed_ips=allowed_ips)
+
+    def remove_peer(self, interface: str, public_key: str):
+        self.call('remove_peer', interface=interface, public_key=public_key)
+
+    def remove_peers(self, interface: str, public_keys: list[str]):
+        """
+        Removes many peers with one `wg set` per PEERS_PER_SET keys.
+        """
+        for i in range(0, len(public_keys), PEERS_PER_SET):
+            self.call('remove_peers', interface=interface, public_keys=list(public_keys[i:i + PEERS_PER_SET]))
+
+    def set_listen_port(self, interface: str, port: int):
+        self.call('listen_port', interface=interface, port=port)
+
+    def set_mtu(self, interface: str, mtu: int):
+        self.call('mtu', interface=interface, mtu=mtu)
+
+    def address(self, action: str, interface: str, address: str):
+        self.call('address', action=action, interface=interface, address=address)
+
+    def live_state(self, interface: str) -> dict | None:
+        """
+        Reads the running interface's listen port, peers (public key -> allowed-ips), addresses and MTU.
+        Returns None when the interface isn't up.
+        """
+        try:
+            lines = self.dump(interface).strip().splitlines()
+        except CommandExecutionError:
+            return None
+        if not lines:
+            return None
+        header = lines[0].split('\t')
+        peers = {}
+        for line in lines[1:]:
+            parts = line.split('\t')
+            if len(parts) >= 4:
+                peers[parts[0]] = '' if parts[3] == '(none)' else parts[3]
+        addresses = set()
+        for line in self.call('addresses', interface=interface).splitlines():
+            words = line.split()
+            for family in ('inet', 'inet6'):
+                if family in words and words.index(family) + 1 < len(words):
+                    addresses.add(str(ipaddress.ip_interface(words[words.index(family) + 1])))
+        link = self.call('link', interface=interface).split()
+        mtu = int(link[link.index('mtu') + 1]) if 'mtu' in link else None
+        return {
+            'listen_port': int(header[2]) if len(header) > 2 and header[2].isdigit() else None,
+            'peers': peers,
+            'addresses': addresses,
+            'mtu': mtu,
+        }
+
+    def syncconf(self, interface: str):
+        self.call('syncconf', interface=interface)
+
+    def up(self, interface: str):
+        self.call('up', interface=interface)
+
+    def down(self, interface: str):
+        self.call('down', interface=interface)
+
+    def service(self, action: str, interface: str):
+        self.call('service', action=action, interface=interface)
+
+    def ufw(self, *args: str):
+        self.call('ufw', args=list(args))
+
+class _HelperHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = {'ok': True, 'stdout': run_op(request.get('op'), request.get('args') or {})}
+            except CommandExecutionError as e:
+                response = {'ok': False, 'error': str(e)}
+            except Exception as e:
+                print(f"[!] WireGuard helper error: {e}")
+                response = {'ok': False, 'error': f"Helper error: {e}"}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+class _HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(socket_path: str, group: str = None):
+    """
+    Listens on 'socket_path' until interrupted. Only root and members of 'group' can connect.
+    """
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = _HelperServer(socket_path, _HelperHandler)
+    os.chmod(socket_path, 0o660 if group else 0o600)
+    if group:
+        os.chown(socket_path, 0, grp.getgrnam(group).gr_gid)
+    print(f"[*] WireGuard helper listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Privileged WireGuard helper for CandyPanel")
+    parser.add_argument('--socket', default=HELPER_SOCKET)
+    parser.add_argument('--group', help="Group allowed to use the socket (the panel's service user)")
+    args = parser.parse_args()
+    if os.geteuid() != 0:
+        print("[!] wg_helper.py is meant to run as root; WireGuard commands will likely fail.")
+    serve(args.socket, args.group)
@@ -55,6 +55,13 @@ const formatBytes = (bytes: number): string => {
   return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
 };
 
+const formatBitrate = (bps: number): string => {
+  if (bps < 1000) return `${bps} bps`;
+  const sizes = ['Kbps', 'Mbps', 'Gbps'];
+  const i = Math.min(Math.floor(Math.log10(bps) / 3), 3);
+  return parseFloat((bps / Math.pow(1000, i)).toFixed(2)) + ' ' + sizes[i - 1];
+};
+
 const formatUptime = (seconds: number): string => {
   const days = Math.floor(seconds / 86400);
   const hours = Math.floor((seconds % 86400) / 3600);
@@ -778,6 +785,14 @@ function App() {
                 <span className="text-sm text-gray-400">Upload:</span>
                 <span className="text-sm font-medium text-white">{dashboard.net.upload}</span>
               </div>
+              {data.live_rates && Object.entries(data.live_rates.interfaces).map(([wg, rate]) => (
+                <div key={wg} className="flex justify-between">
+                  <span className="text-sm text-gray-400">wg{wg}:</span>
+                  <span className="text-sm font-medium text-white">
+                    ↓ {formatBitrate(rate.download_bps)} ↑ {formatBitrate(rate.upload_bps)}
+                  </span>
+                </div>
+              ))}
             </div>
           </div>
 
@@ -819,7 +834,10 @@ function App() {
                       <p className="text-sm font-medium text-white">
                         {formatBytes(client.used_trafic.download + client.used_trafic.upload)}
                       </p>
-                      <p className="text-xs text-gray-500">used</p>
+                      <p className="text-xs text-gray-500">
+                        used{data.live_rates?.clients[client.name] &&
+                          ` · ↓ ${formatBitrate(data.live_rates.clients[client.name].download_bps)}`}
+                      </p>
                     </div>
                   </div>
                 ))}
@@ -1001,6 +1019,12 @@ function App() {
                       </td>
                       <td className="p-4 text-sm text-gray-300">
                         {formatBytes(client.used_trafic.download + client.used_trafic.upload)}
+                        {data.live_rates?.clients[client.name] && (
+                          <p className="text-xs text-gray-500">
+                            ↓ {formatBitrate(data.live_rates.clients[client.name].download_bps)}{' '}
+                            ↑ {formatBitrate(data.live_rates.clients[client.name].upload_bps)}
+                          </p>
+                        )}
                       </td>
                       <td className="p-4 text-sm text-gray-300">
                         {new Date(client.expires).toLocaleDateString()}
@@ -1066,6 +1090,13 @@ function App() {
       { key: 'reset_time', label: 'Reset Time (hours)', type: 'number' },
       { key: 'ap_port', label: 'API + Panel Port', type: 'number' },
       { key: 'auto_backup', label: 'Auto Backup', type: 'select', options: [{ value: '1', label: 'Enabled' }, { value: '0', label: 'Disabled' }] },
+      { key: 'quota_watch_margin', label: 'Quota Watch Margin (bytes or %)', type: 'text' },
+      { key: 'quota_watch_interval', label: 'Quota Watch Interval (seconds)', type: 'number' },
+      { key: 'backup_interval', label: 'Backup Interval (minutes)', type: 'number' },
+      { key: 'backup_keep', label: 'Backups Kept', type: 'number' },
+      { key: 'sync_chunk_size', label: 'Sync Chunk Size (clients)', type: 'number' },
+      { key: 'sync_chunk_pause_ms', label: 'Sync Chunk Pause (ms)', type: 'number' },
+      { key: 'reload_mode', label: 'Interface Reload', type: 'select', options: [{ value: 'reconcile', label: 'Apply changes live' }, { value: 'restart', label: 'Restart interface' }] },
     ];
 
     return (
@@ -27,6 +27,13 @@ const formatBytes = (bytes: number): string => {
   return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
 };
 
+const formatBitrate = (bps: number): string => {
+  if (bps < 1000) return `${bps} bps`;
+  const sizes = ['Kbps', 'Mbps', 'Gbps'];
+  const i = Math.min(Math.floor(Math.log10(bps) / 3), 3);
+  return parseFloat((bps / Math.pow(1000, i)).toFixed(2)) + ' ' + sizes[i - 1];
+};
+
 const formatDate = (dateString: string): string => {
   if (!dateString) return 'N/A';
   const date = new Date(dateString);
@@ -280,6 +287,26 @@ PersistentKeepalive = 25`;
                 </div>
               </div>
             </div>
+
+            {/* Current Speed, when the panel's traffic collector has recent readings */}
+            {clientData.live_rate && (
+              <div className="mt-4 bg-gray-700/50 rounded-xl p-4">
+                <div className="flex items-center gap-3">
+                  <div className="w-8 h-8 bg-yellow-600/20 rounded-lg flex items-center justify-center">
+                    <Wifi className="w-4 h-4 text-yellow-400" />
+                  </div>
+                  <div>
+                    <p className="text-sm text-gray-400">Current Speed</p>
+                    <p className="text-white font-medium">
+                      ↓ {formatBitrate(clientData.live_rate.download_bps)} ↑ {formatBitrate(clientData.live_rate.upload_bps)}
+                    </p>
+                    <p className="text-xs text-gray-500">
+                      average ↓ {formatBitrate(clientData.live_rate.download_bps_avg)} ↑ {formatBitrate(clientData.live_rate.upload_bps_avg)}
+                    </p>
+                  </div>
+                </div>
+              </div>
+            )}
           </div>
 
           {/* Action Buttons */}
@@ -19,6 +19,20 @@ export interface Client {
   server_endpoint_ip: string;
   server_dns: string;
   server_mtu: string;
+  live_rate?: LiveRate | null; // Only on the public client-details response
+}
+
+// Bits per second from the traffic collector: over the last poll, and averaged over its recent polls
+export interface LiveRate {
+  download_bps: number;
+  upload_bps: number;
+  download_bps_avg: number;
+  upload_bps_avg: number;
+}
+
+export interface LiveRates {
+  interfaces: Record<string, LiveRate>;
+  clients: Record<string, LiveRate>; // Only clients whose traffic moved recently
 }
 
 export interface Interface {
@@ -75,6 +89,7 @@ export interface AllData {
   clients: Client[];
   interfaces: Interface[];
   settings: Record<string, string>;
+  live_rates?: LiveRates | null; // null when the traffic collector doesn't run in the API process
   // Add new fields for Telegram settings and API tokens if they are returned directly by getAllData
   // For now, these are part of 'settings' record, but if backend changes, they can be separate.
 }
@@ -0,0 +1,67 @@
+# bench_account_status.py
+# Compares the old account-status path (load every client, linear search) with the
+# keyed users/clients join used by /bot_api/user/account_status.
+#
+#   python3 benchmarks/bench_account_status.py [--clients 50000] [--lookups 200]
+import argparse, json, os, random, sys, tempfile, time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Backend'))
+from core import CandyPanel
+
+def build_fleet(panel: CandyPanel, count: int):
+    """
+    Fills the panel database with 'count' clients, each linked to a bot user.
+    """
+    now = datetime.now().isoformat()
+    used = json.dumps({'download': 0, 'upload': 0, 'last_wg_rx': 0, 'last_wg_tx': 0})
+    clients = [(f"client{i}", 0, f"pub{i}", f"priv{i}", f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}",
+                now, '2099-01-01T00:00:00', '', str(10 * 1024**3), used) for i in range(count)]
+    users = [(100000 + i, f"client{i}", now) for i in range(count)]
+    panel.db.conn.executemany("INSERT INTO `clients` (`name`, `wg`, `public_key`, `private_key`, `address`, "
+                              "`created_at`, `expires`, `note`, `traffic`, `used_trafic`) VALUES (?,?,?,?,?,?,?,?,?,?)", clients)
+    panel.db.conn.executemany("INSERT INTO `users` (`telegram_id`, `candy_client_name`, `created_at`) VALUES (?,?,?)", users)
+    panel.db.conn.commit()
+
+def legacy_lookup(panel: CandyPanel, telegram_id: int):
+    user = panel.db.get('users', where={'telegram_id': telegram_id})
+    all_clients = panel._get_all_clients()
+    return next((c for c in all_clients if c['name'] == user['candy_client_name']), None)
+
+def keyed_lookup(panel: CandyPanel, telegram_id: int):
+    panel._invalidate_account_status() # Measure the DB path, not the cache
+    return panel._get_account_status(telegram_id)
+
+def timeit(fn, panel, ids) -> float:
+    start = time.perf_counter()
+    for telegram_id in ids:
+        fn(panel, telegram_id)
+    return (time.perf_counter() - start) / len(ids) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        panel = CandyPanel(os.path.join(tmp, 'bench.db'))
+        build_fleet(panel, args.clients)
+        ids = [100000 + random.randrange(args.clients) for _ in range(args.lookups)]
+        legacy_ids = ids[:max(1, args.lookups // 20)] # The legacy path is slow; sample fewer lookups
+
+        legacy_ms = timeit(legacy_lookup, panel, legacy_ids)
+        keyed_ms = timeit(keyed_lookup, panel, ids)
+        start = time.perf_counter()
+        for telegram_id in ids:
+            panel._get_account_status(telegram_id)
+        cached_ms = (time.perf_counter() - start) / len(ids) * 1000
+
+        print(f"clients: {args.clients}")
+        print(f"legacy full scan : {legacy_ms:9.3f} ms/lookup")
+        print(f"keyed join       : {keyed_ms:9.3f} ms/lookup")
+        print(f"cached           : {cached_ms:9.3f} ms/lookup")
+        panel.db.close()
+
+if __name__ == '__main__':
+    main()
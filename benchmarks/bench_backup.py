@@ -0,0 +1,81 @@
+# bench_backup.py
+# API latency while backup.py snapshots a synthetic fleet (see fleet.py): p50/p99 of a read endpoint
+# (/bot_api/user/account_status) and of a client row write, first idle, then while snapshots run back to back
+# in a background thread, copying the database in page steps and, for comparison, in one step. Afterwards it checks
+# that nothing in the backup directory is readable by anyone but its owner, since snapshots hold private keys.
+#
+#   python3 benchmarks/bench_backup.py [--clients 10000] [--requests 2000]
+import argparse, contextlib, io, os, random, sys, tempfile, threading, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+from run_suite import summarize
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per scenario, half reads and half writes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = fleet.build_fleet(tmp, args.clients)
+        os.environ.update(fleet.fleet_env(tmp))
+        os.environ['CANDY_BACKUP_DIR'] = os.path.join(tmp, 'backups')
+        os.chdir(tmp)
+        sys.path.insert(0, fleet.BACKEND_DIR)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main as api
+            api.start_services()
+        import backup, core
+        panel, client = api.candy_panel, api.app.test_client()
+        names = [name for name, _ in summary['sample_clients']]
+        rng = random.Random(1)
+
+        def scenario(pages) -> tuple[dict, dict, int]:
+            stop, snapshots = threading.Event(), [0]
+
+            def backups():
+                backup.BACKUP_PAGES = pages
+                while not stop.is_set():
+                    backup.create_snapshot(panel.db.db_path, core.WG_DIR, interface_lock=panel._locks.hold)
+                    snapshots[0] += 1
+
+            thread = threading.Thread(target=backups, daemon=True) if pages else None
+            reads, writes = [], []
+            with contextlib.redirect_stdout(io.StringIO()):
+                if thread:
+                    thread.start()
+                    time.sleep(0.2) # Let the first copy get going
+                for i in range(args.requests):
+                    start = time.perf_counter()
+                    if i % 2:
+                        panel.db.update('clients', {'note': f"bench {i}"}, {'name': rng.choice(names)})
+                        writes.append((time.perf_counter() - start) * 1000)
+                    else:
+                        response = client.post('/bot_api/user/account_status',
+                                               json={'telegram_id': rng.choice(summary['telegram_ids'])})
+                        if response.status_code >= 400:
+                            raise RuntimeError(f"account_status -> {response.status_code}")
+                        reads.append((time.perf_counter() - start) * 1000)
+                stop.set()
+                if thread:
+                    thread.join()
+            return summarize(reads), summarize(writes), snapshots[0]
+
+        print(f"clients: {args.clients}, db: {os.path.getsize(panel.db.db_path) / 1024**2:.1f} MiB")
+        print(f"{'scenario':22} {'read p50':>9} {'read p99':>9} {'write p50':>10} {'write p99':>10} {'snapshots':>10}")
+        for label, pages in (('idle', None), (f"paged ({backup.BACKUP_PAGES} pages)", backup.BACKUP_PAGES), ('one step', -1)):
+            reads, writes, snapshots = scenario(pages)
+            print(f"{label:22} {reads['p50']:9.2f} {reads['p99']:9.2f} {writes['p50']:10.2f} {writes['p99']:10.2f} {snapshots:10}")
+        exposed = [path for root, dirs, files in os.walk(os.environ['CANDY_BACKUP_DIR'])
+                   for path in [root] + [os.path.join(root, name) for name in files]
+                   if os.stat(path).st_mode & 0o077]
+        if exposed:
+            sys.exit(f"Backup files readable by group or others: {', '.join(exposed[:5])}")
+        api.adb.close()
+        panel.db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# bench_group_commit.py
+# Throughput of small concurrent writes with and without group commit (see GROUP_COMMIT in db.py):
+# 'threads' threads share one SQLite connection like asyncio.to_thread request handlers, and 'tasks' asyncio tasks
+# share one AsyncSQLite like the bot API routes, each doing bot-style writes (register a user, change its language).
+# fsync cost dominates, so run it on the disk the panel uses: --dir defaults to a scratch directory under /var/tmp.
+#
+#   python3 benchmarks/bench_group_commit.py [--threads 32] [--tasks 64] [--writes 50] [--dir /var/tmp]
+import argparse, asyncio, contextlib, io, os, statistics, sys, tempfile, threading, time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Backend'))
+os.environ.setdefault('CANDY_METRICS', '0')
+import db
+
+def user_writes(worker: int, i: int) -> list[tuple[str, tuple]]:
+    telegram_id = 10_000_000 + worker * 100_000 + i
+    return [db.SQLite._insert_statement('users', {'telegram_id': telegram_id, 'created_at': datetime.now().isoformat()}),
+            db.SQLite._update_statement('users', {'language': 'fa'}, {'telegram_id': telegram_id})]
+
+def run_threads(sqlite: db.SQLite, threads: int, writes: int) -> list[float]:
+    latencies, lock = [], threading.Lock()
+
+    def work(worker: int):
+        mine = []
+        for i in range(writes // 2):
+            for query, params in user_writes(worker, i):
+                start = time.perf_counter()
+                sqlite._execute_query(query, params)
+                mine.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(mine)
+
+    pool = [threading.Thread(target=work, args=(worker,)) for worker in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies
+
+async def run_tasks(adb: db.AsyncSQLite, tasks: int, writes: int) -> list[float]:
+    latencies = []
+
+    async def work(worker: int):
+        for i in range(writes // 2):
+            telegram_id = 20_000_000 + worker * 100_000 + i
+            start = time.perf_counter()
+            await adb.insert('users', {'telegram_id': telegram_id, 'created_at': datetime.now().isoformat()})
+            latencies.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            await adb.update('users', {'language': 'fa'}, {'telegram_id': telegram_id})
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(work(worker) for worker in range(tasks)))
+    return latencies
+
+def report(label: str, latencies: list[float], elapsed: float):
+    latencies.sort()
+    print(f"{label:34} {len(latencies) / elapsed:9.0f} {statistics.median(latencies):9.2f} "
+          f"{latencies[int(len(latencies) * 0.99) - 1]:9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--tasks', type=int, default=64)
+    parser.add_argument('--writes', type=int, default=50, help="Writes per thread or task")
+    parser.add_argument('--dir', default='/var/tmp')
+    args = parser.parse_args()
+
+    print(f"{'scenario':34} {'writes/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for group_commit in (False, True):
+        mode = 'group commit' if group_commit else 'commit per write'
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            with contextlib.redirect_stdout(io.StringIO()):
+                sqlite = db.SQLite(os.path.join(tmp, 'bench.db'), group_commit=group_commit)
+            start = time.perf_counter()
+            latencies = run_threads(sqlite, args.threads, args.writes)
+            report(f"{args.threads} threads, {mode}", latencies, time.perf_counter() - start)
+            sqlite.close()
+
+            db.GROUP_COMMIT = group_commit # AsyncSQLite builds its connection with the module default
+            adb = db.AsyncSQLite(os.path.join(tmp, 'bench.db'))
+            start = time.perf_counter()
+            latencies = asyncio.run(run_tasks(adb, args.tasks, args.writes))
+            report(f"{args.tasks} async tasks, {mode}", latencies, time.perf_counter() - start)
+            adb.close()
+            check = db.SQLite(os.path.join(tmp, 'bench.db'))
+            expected = (args.threads + args.tasks) * (args.writes // 2)
+            if check.count('users', {'language': 'fa'}) != expected:
+                sys.exit(f"Expected {expected} users with language 'fa' after the {mode} runs")
+            check.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# bench_iter_select.py
+# Peak Python memory (tracemalloc) of reading the clients table over synthetic fleets (see fleet.py) of growing size:
+# select() against iter_select() with each row type, plus the streamed /api/data and /api/clients/export responses,
+# read chunk by chunk the way a WSGI server sends them. With iter_select the peaks should not grow with the fleet.
+#
+#   python3 benchmarks/bench_iter_select.py [--sizes 1000,20000,100000]
+import argparse, contextlib, io, os, sys, tempfile, time, tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+
+def measure(fn) -> tuple[float, float]:
+    """
+    Returns (peak MiB, seconds) of fn().
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024**2, elapsed
+
+def drain(response):
+    for _ in response.response:
+        pass
+    response.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,20000,100000', help="Comma separated fleet sizes")
+    args = parser.parse_args()
+
+    os.environ['CANDY_METRICS'] = '0'
+    os.environ['CANDY_SERVER'] = 'flask'
+    sys.path.insert(0, fleet.BACKEND_DIR)
+    print(f"{'clients':>8} {'case':22} {'peak MiB':>9} {'seconds':>8}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fleet.build_fleet(tmp, size)
+            os.environ.update(fleet.fleet_env(tmp))
+            os.chdir(tmp)
+            for module in ('main', 'core', 'db'): # Fresh module state per fleet
+                sys.modules.pop(module, None)
+            with contextlib.redirect_stdout(io.StringIO()):
+                import main as api
+                api.start_services()
+            panel, client = api.candy_panel, api.app.test_client()
+            auth = {'Authorization': f"Bearer {fleet.SESSION_TOKEN}"}
+            cases = [
+                ('select', lambda: panel.db.select('clients')),
+                ('iter_select dict', lambda: sum(1 for _ in panel.db.iter_select('clients'))),
+                ('iter_select tuple', lambda: sum(1 for _ in panel.db.iter_select('clients', row_type='tuple'))),
+                ('iter_select named', lambda: sum(1 for _ in panel.db.iter_select('clients', row_type='named'))),
+                ('GET /api/data', lambda: drain(client.get('/api/data', headers=auth, buffered=False))),
+                ('GET /api/clients/export', lambda: drain(client.get('/api/clients/export', headers=auth, buffered=False))),
+            ]
+            for name, fn in cases:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    peak, elapsed = measure(fn)
+                print(f"{size:8} {name:22} {peak:9.2f} {elapsed:8.2f}")
+            api.adb.close()
+            panel.db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# bench_models.py
+# Memory and loop time of the record types in models.py.
+# Memory: tracemalloc size of --clients clients held the way the sync and the collector hold them, as dict rows with
+# used_trafic parsed into a dict against models.Client, and of their 'wg show dump' readings as nested dicts
+# against models.PeerStats.
+# Loop time: _sync's traffic pass and one collector poll + flush over a synthetic fleet (see fleet.py), each in a
+# fresh interpreter; --backend times another checkout's Backend directory instead, e.g. a `git worktree` of an
+# older commit.
+#
+#   python3 benchmarks/bench_models.py [--clients 100000] [--fleet 20000] [--runs 5] [--backend /path/to/Backend]
+import argparse, contextlib, io, json, os, statistics, subprocess, sys, tempfile, tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+
+LOOP_CODE = """
+import contextlib, io, json, sys, time
+import core, collector
+panel = core.CandyPanel()
+traffic_collector = collector.TrafficCollector(panel)
+timings = {}
+with contextlib.redirect_stdout(io.StringIO()):
+    panel._calculate_and_update_traffic() # Warm up: caches, page cache, first readings
+    start = time.perf_counter()
+    panel._calculate_and_update_traffic()
+    timings['traffic pass'] = time.perf_counter() - start
+    traffic_collector.poll()
+    start = time.perf_counter()
+    traffic_collector.poll()
+    timings['collector poll'] = time.perf_counter() - start
+    start = time.perf_counter()
+    traffic_collector.flush()
+    timings['collector flush'] = time.perf_counter() - start
+    interfaces = [row['wg'] for row in panel.db.select('interfaces')]
+    start = time.perf_counter()
+    panel._map_interfaces(panel._get_current_wg_peer_traffic, interfaces)
+    timings['wg dump reads'] = time.perf_counter() - start # Part of both the traffic pass and the poll
+panel.db.close()
+print(json.dumps(timings))
+"""
+
+def traced(build) -> float:
+    """
+    Returns the MiB still allocated by what build() returns.
+    """
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / 1024**2
+
+def memory(clients: int):
+    sys.path.insert(0, fleet.BACKEND_DIR)
+    from models import Client, PeerStats
+    used = json.dumps({'download': 123456789, 'upload': 98765432, 'last_wg_rx': 1234567, 'last_wg_tx': 7654321})
+    rows = [{'name': f"client{i}", 'wg': i // 250, 'public_key': fleet.fake_key(f"pub{i}"), 'private_key': fleet.fake_key(f"priv{i}"),
+             'address': f"10.{i // 62500}.{i // 250 % 250}.{i % 250 + 2}", 'created_at': '2026-01-01T00:00:00',
+             'expires': '2099-01-01T00:00:00', 'note': '', 'traffic': str(50 * 1024**3), 'used_trafic': used,
+             'connected_now': 0, 'status': 1} for i in range(clients)]
+
+    def as_dicts():
+        parsed = []
+        for row in rows:
+            row = dict(row)
+            row['used_trafic'] = json.loads(row['used_trafic'])
+            parsed.append(row)
+        return parsed
+
+    print(f"{'representation':34} {'MiB':>8} {'bytes/client':>13}")
+    for label, build in ((f"{clients} clients as dicts", as_dicts),
+                         (f"{clients} clients as Client", lambda: [Client.from_row(row) for row in rows]),
+                         (f"{clients} readings as dicts", lambda: {row['public_key']: {'rx': 10**9 + i, 'tx': 10**8 + i}
+                                                                    for i, row in enumerate(rows)}),
+                         (f"{clients} readings as PeerStats", lambda: {row['public_key']: PeerStats(10**9 + i, 10**8 + i)
+                                                                        for i, row in enumerate(rows)})):
+        size = traced(build)
+        print(f"{label:34} {size:8.1f} {size * 1024**2 / clients:13.0f}")
+
+def loops(backend: str, size: int, runs: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fleet.build_fleet(tmp, size)
+        env = fleet.fleet_env(tmp)
+        env['CANDY_METRICS'] = '0'
+        timings = {}
+        for _ in range(runs):
+            child = subprocess.run([sys.executable, '-c', LOOP_CODE], cwd=backend, env=env, check=True,
+                                   capture_output=True, text=True)
+            for name, seconds in json.loads(child.stdout.strip().splitlines()[-1]).items():
+                timings.setdefault(name, []).append(seconds * 1000)
+    print(f"backend: {os.path.abspath(backend)}, fleet: {size} clients")
+    print(f"{'loop':18} {'median ms':>10} {'min ms':>8}")
+    for name, values in timings.items():
+        print(f"{name:18} {statistics.median(values):10.1f} {min(values):8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=100000, help="Clients for the memory comparison")
+    parser.add_argument('--fleet', type=int, default=20000, help="Fleet size for the loop timings")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--backend', default=fleet.BACKEND_DIR, help="Backend directory to time")
+    args = parser.parse_args()
+
+    memory(args.clients)
+    print()
+    loops(args.backend, args.fleet, args.runs)
+
+if __name__ == '__main__':
+    main()
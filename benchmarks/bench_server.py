@@ -0,0 +1,108 @@
+# bench_server.py
+# Throughput/latency of main.py under the Flask dev server vs the ASGI (Quart + Hypercorn) mode.
+# Each mode is started as a subprocess against a throwaway database and hit with a mix of
+# panel, bot and public-page requests at a fixed concurrency.
+#
+#   python3 benchmarks/bench_server.py [--requests 2000] [--concurrency 50] [--modes flask,asgi] [--workers 1]
+# --workers sets CANDY_WORKERS for the asgi mode (one Hypercorn process per worker).
+import argparse, asyncio, os, socket, statistics, subprocess, sys, tempfile, time
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Backend')
+sys.path.insert(0, BACKEND_DIR)
+from db import SQLite
+
+def seed(db_path: str):
+    """
+    Creates a database with one interface, one client linked to a bot user, and a session token.
+    """
+    db = SQLite(db_path)
+    db.update('settings', {'value': 'bench-token'}, {'key': 'session_token'})
+    db.update('settings', {'value': '1'}, {'key': 'install'})
+    db.insert('interfaces', {'wg': 0, 'private_key': 'srv-priv', 'public_key': 'srv-pub', 'port': 51820,
+                             'address_range': '10.0.0.1/24', 'status': True})
+    db.insert('clients', {'name': 'bench', 'wg': 0, 'public_key': 'bench-pub', 'private_key': 'bench-priv',
+                          'address': '10.0.0.2', 'created_at': '2025-01-01T00:00:00', 'expires': '2099-01-01T00:00:00',
+                          'traffic': str(10 * 1024**3), 'used_trafic': '{"download":0,"upload":0,"last_wg_rx":0,"last_wg_tx":0}'})
+    db.insert('users', {'telegram_id': 1, 'candy_client_name': 'bench', 'created_at': '2025-01-01T00:00:00'})
+    db.close()
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+REQUESTS = [
+    ('GET', '/check', None),
+    ('GET', '/client-details/bench/bench-pub', None),
+    ('POST', '/bot_api/user/account_status', {'telegram_id': 1}),
+    ('POST', '/bot_api/admin/check_admin', {'telegram_id': 1}),
+]
+
+async def hammer(base_url: str, total: int, concurrency: int) -> tuple[float, list[float]]:
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(REQUESTS[i % len(REQUESTS)])
+
+    async def worker(client):
+        while not queue.empty():
+            method, path, body = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return total / elapsed, latencies
+
+def run_mode(mode: str, db_path: str, args) -> dict:
+    port = free_port()
+    env = dict(os.environ, CANDY_SERVER=mode, AP_PORT=str(port), CANDY_DB_PATH=db_path,
+               CANDY_WORKERS=str(args.workers if mode == 'asgi' else 1))
+    server = subprocess.Popen([sys.executable, 'main.py'], cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                httpx.get(f"{base_url}/check", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"{mode} server did not start")
+                time.sleep(0.2)
+        throughput, latencies = asyncio.run(hammer(base_url, args.requests, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    return {
+        'rps': throughput,
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--modes', default='flask,asgi')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        seed(db_path)
+        print(f"{'mode':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}   ({args.requests} requests, concurrency {args.concurrency}, asgi workers {args.workers})")
+        for mode in args.modes.split(','):
+            result = run_mode(mode, db_path, args)
+            print(f"{mode:<6} {result['rps']:9.1f} {result['p50']:9.2f} {result['p99']:9.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# bench_startup.py
+# Cold-start cost of the short-lived entry points: each case runs in a fresh interpreter against a synthetic
+# fleet (see fleet.py), the way cron.py runs every minute and the bot starts after each restart.
+# --backend times another checkout's Backend directory instead, e.g. a `git worktree` of an older commit.
+#
+#   python3 benchmarks/bench_startup.py [--clients 1000] [--runs 20] [--backend /path/to/Backend]
+import argparse, contextlib, io, os, statistics, subprocess, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+
+CASES = [
+    ('interpreter', "pass"),
+    ('import core', "import core"),
+    ('cron start', "import core; core.CandyPanel().db.close()"), # cron.py before _sync
+    ('bot settings', "from db import SQLite; db = SQLite(); "
+                     "db.query(\"SELECT `key`, `value` FROM `settings` WHERE `key` LIKE 'telegram_%'\"); db.close()"),
+]
+
+def time_case(code: str, backend: str, env: dict, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=backend, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--backend', default=fleet.BACKEND_DIR, help="Backend directory to time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fleet.build_fleet(tmp, args.clients)
+        env = fleet.fleet_env(tmp)
+        env['CANDY_METRICS'] = '0'
+        subprocess.run([sys.executable, '-m', 'compileall', '-q', args.backend], check=True) # Time runs, not bytecode compiles
+        print(f"backend: {os.path.abspath(args.backend)}")
+        print(f"{'case':14} {'median ms':>10} {'min ms':>8}")
+        for name, code in CASES:
+            time_case(code, args.backend, env, 1) # Warm the page cache
+            timings = time_case(code, args.backend, env, args.runs)
+            print(f"{name:14} {statistics.median(timings):10.1f} {min(timings):8.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# bench_sync_contention.py
+# Interactive write latency while _sync's traffic pass runs over a synthetic fleet (see fleet.py).
+# A separate process stands in for /api/manage and bot purchases: it updates one client row at a time through
+# its own connection and records how long each write waited. The traffic pass runs once as one big transaction
+# (sync_chunk_size = fleet size) and once with the default chunking.
+#
+#   python3 benchmarks/bench_sync_contention.py [--clients 20000] [--chunk 500] [--pause-ms 5]
+import argparse, contextlib, io, multiprocessing, os, sqlite3, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+from run_suite import summarize
+
+def writer(db_path: str, names: list[str], stop, results):
+    conn = sqlite3.connect(db_path, timeout=30)
+    latencies, i = [], 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        conn.execute("UPDATE `clients` SET `note` = ? WHERE `name` = ?", (f"w{i}", names[i % len(names)]))
+        conn.commit()
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+        time.sleep(0.002)
+    conn.close()
+    results.put(latencies)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--chunk', type=int, default=500)
+    parser.add_argument('--pause-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = fleet.build_fleet(tmp, args.clients)
+        os.environ.update(fleet.fleet_env(tmp))
+        os.environ['CANDY_METRICS'] = '0'
+        os.chdir(tmp)
+        sys.path.insert(0, fleet.BACKEND_DIR)
+        import core
+        panel = core.CandyPanel()
+        names = [name for name, _ in summary['sample_clients']]
+
+        print(f"clients: {args.clients}")
+        print(f"{'traffic pass':24} {'pass s':>7} {'writes':>7} {'write p50':>10} {'write p99':>10} {'write max':>10}")
+        for label, chunk, pause_ms in (('one transaction', args.clients + 1, 0),
+                                       (f"chunks of {args.chunk}", args.chunk, args.pause_ms)):
+            panel.db.update('settings', {'value': str(chunk)}, {'key': 'sync_chunk_size'})
+            panel.db.update('settings', {'value': str(pause_ms)}, {'key': 'sync_chunk_pause_ms'})
+            stop, results = multiprocessing.Event(), multiprocessing.Queue()
+            process = multiprocessing.Process(target=writer, args=(panel.db.db_path, names, stop, results))
+            process.start()
+            time.sleep(0.5) # Writer warm-up
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                panel._calculate_and_update_traffic()
+                elapsed = time.perf_counter() - start
+            time.sleep(0.2)
+            stop.set()
+            latencies = results.get()
+            process.join()
+            stats = summarize(latencies)
+            print(f"{label:24} {elapsed:7.2f} {stats['n']:7} {stats['p50']:10.2f} {stats['p99']:10.2f} {max(latencies):10.2f}")
+        panel.db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# bench_traffic_engine.py
+# _sync's traffic pass with the pure-Python engine against the numpy one (see traffic_engine.py), over a synthetic
+# fleet (see fleet.py). 'compute' times just the per-chunk work on chunks already read from the database, the part
+# the engines differ in; 'pass' is the whole _calculate_and_update_traffic with sync_chunk_pause_ms = 0, and
+# 'dump reads' is its share spent in `wg show dump`, which both engines pay.
+#
+#   python3 benchmarks/bench_traffic_engine.py [--clients 100000] [--runs 3]
+import argparse, contextlib, io, os, statistics, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fleet.build_fleet(tmp, args.clients)
+        os.environ.update(fleet.fleet_env(tmp))
+        os.environ['CANDY_METRICS'] = '0'
+        os.chdir(tmp)
+        sys.path.insert(0, fleet.BACKEND_DIR)
+        import core, traffic_engine
+        np = traffic_engine.load_numpy()
+        if np is None:
+            sys.exit("numpy isn't installed (or CANDY_TRAFFIC_ENGINE=python); nothing to compare.")
+        panel = core.CandyPanel()
+        panel.db.update('settings', {'value': '0'}, {'key': 'sync_chunk_pause_ms'})
+        chunk_size, _ = panel._sync_chunking()
+        interfaces = [row['wg'] for row in panel.db.select('interfaces')]
+
+        def chunks(query: str, fetch_type: str) -> list:
+            result, last_rowid = [], 0
+            while chunk := panel.db.query(query, (last_rowid, chunk_size), fetch_type):
+                result.append(chunk)
+                last_rowid = chunk[-1]['rowid']
+            return result
+
+        python_query = ("SELECT `rowid`, `name`, `public_key`, `status`, `traffic`, `used_trafic` FROM `clients` "
+                        "WHERE `rowid` > ? ORDER BY `rowid` LIMIT ?")
+        timings = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            panel._calculate_and_update_traffic() # First readings
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                readings = {}
+                for peer_traffic in panel._map_interfaces(panel._get_current_wg_peer_traffic, interfaces).values():
+                    readings.update(peer_traffic)
+                timings.setdefault('dump reads', []).append(time.perf_counter() - start)
+
+                python_chunks = chunks(python_query, 'all')
+                start = time.perf_counter()
+                for chunk in python_chunks:
+                    panel._traffic_chunk(chunk, readings)
+                timings.setdefault('python compute', []).append(time.perf_counter() - start)
+
+                numpy_chunks = chunks(traffic_engine.CHUNK_QUERY, 'rows')
+                start = time.perf_counter()
+                peers = traffic_engine.PeerCounters(np, readings)
+                for chunk in numpy_chunks:
+                    peers.apply_chunk(chunk)
+                timings.setdefault('numpy compute', []).append(time.perf_counter() - start)
+
+                for engine in ('python', 'numpy'):
+                    traffic_engine.TRAFFIC_ENGINE = engine
+                    start = time.perf_counter()
+                    panel._calculate_and_update_traffic()
+                    timings.setdefault(f"{engine} pass", []).append(time.perf_counter() - start)
+
+        print(f"clients: {args.clients}, chunk size: {chunk_size}")
+        print(f"{'':16} {'median ms':>10} {'min ms':>9}")
+        for name in ('dump reads', 'python compute', 'numpy compute', 'python pass', 'numpy pass'):
+            values = [seconds * 1000 for seconds in timings[name]]
+            print(f"{name:16} {statistics.median(values):10.1f} {min(values):9.1f}")
+        panel.db.close()
+
+if __name__ == '__main__':
+    main()
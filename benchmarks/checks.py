@@ -0,0 +1,134 @@
+# checks.py
+# Failure-path checks the timing benchmarks don't exercise, each against its own synthetic fleet (see fleet.py)
+# in a child process, since core.py reads CANDY_WG_DIR at import time. Exits 1 when any check fails.
+#
+#   python3 benchmarks/checks.py [check ...]      # default: every check
+import argparse, contextlib, io, json, os, socket, sqlite3, subprocess, sys, tempfile, time
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+
+def _fleet(tmp: str, clients: int) -> dict:
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = fleet.build_fleet(tmp, clients)
+    os.environ.update(fleet.fleet_env(tmp))
+    os.environ['CANDY_METRICS'] = '0'
+    os.chdir(tmp)
+    sys.path.insert(0, fleet.BACKEND_DIR)
+    return summary
+
+def check_flush_failure(tmp: str):
+    """
+    A collector flush whose writes fail keeps the unwritten counters and bandwidth for the next flush.
+    """
+    _fleet(tmp, 200)
+    import core, collector
+    panel = core.CandyPanel()
+    traffic = collector.TrafficCollector(panel, 10, 3600)
+    traffic._lock_file = True # Act as the active collector without the flock
+    with contextlib.redirect_stdout(io.StringIO()):
+        traffic._load_roster()
+        traffic.poll()
+        traffic.flush()
+        traffic.poll() # The fake wg counters grow on every read
+    dirty, bandwidth = set(traffic._dirty), traffic._bandwidth_pending
+    assert dirty and bandwidth, "the second poll moved no counters"
+    bandwidth_before = int(panel._get_setting('bandwidth') or 0)
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    for target, name in ((traffic, '_write'), (panel.db, 'increment_setting')):
+        original = getattr(target, name)
+        setattr(target, name, locked)
+        try:
+            traffic.flush()
+            raise AssertionError(f"flush() swallowed the failing {name}")
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            setattr(target, name, original)
+        assert traffic._dirty >= (dirty if name == '_write' else set()), f"failing {name} dropped dirty clients"
+        assert traffic._bandwidth_pending == bandwidth, f"failing {name} dropped the bandwidth delta"
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        traffic.flush()
+    assert not traffic._dirty and not traffic._bandwidth_pending, "the retry left counters pending"
+    assert int(panel._get_setting('bandwidth')) == bandwidth_before + bandwidth, "bandwidth was lost or counted twice"
+    stored = {row['name']: json.loads(row['used_trafic']) for row in panel.db.select('clients', ['name', 'used_trafic'])}
+    for key in dirty:
+        peer = traffic._peers[key]
+        assert stored[peer.name]['download'] == peer.download, f"{peer.name}'s usage wasn't written"
+    panel.db.close()
+
+def check_workers(tmp: str):
+    """
+    `python main.py` with CANDY_SERVER=asgi and 2 workers: the supervisor holds no collector lock, and /api/rates and
+    /api/top answer from whichever worker takes the request.
+    """
+    _fleet(tmp, 200)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, CANDY_SERVER='asgi', CANDY_WORKERS='2', CANDY_COLLECTOR_INTERVAL='1', AP_PORT=str(port))
+    server = subprocess.Popen([sys.executable, 'main.py'], cwd=fleet.BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url, auth = f"http://127.0.0.1:{port}", {'Authorization': f"Bearer {fleet.SESSION_TOKEN}"}
+
+    def live() -> list[int]: # A fresh connection per request, so the kernel spreads them over the workers
+        return [httpx.get(f"{base_url}{path}", headers=auth, timeout=5).status_code
+                for path in ('/api/rates', '/api/top?by=rate', '/api/top?by=hour')]
+
+    try:
+        # Until both workers answered: the standby one asks for the snapshot on its first request
+        deadline, streak = time.time() + 30, 0
+        while streak < 10:
+            try:
+                streak = streak + 1 if live() == [200] * 3 else 0
+            except httpx.HTTPError:
+                assert server.poll() is None, "the server exited"
+            assert time.time() < deadline, "no live traffic data within 30s"
+            time.sleep(0.2)
+        statuses = [status for _ in range(20) for status in live()]
+        assert statuses == [200] * len(statuses), f"live endpoints answered {sorted(set(statuses))}"
+
+        lock = os.path.realpath(os.path.join(tmp, 'collector.lock'))
+        fds = os.path.join('/proc', str(server.pid), 'fd')
+        held = [fd for fd in os.listdir(fds) if os.path.realpath(os.path.join(fds, fd)) == lock]
+        assert not held, "the supervisor holds collector.lock"
+        with open(os.path.join(tmp, 'collector.heartbeat')) as f:
+            assert json.load(f)['pid'] != server.pid, "the supervisor runs the collector"
+    finally:
+        server.terminate()
+        server.wait()
+
+CHECKS = {'flush_failure': check_flush_failure, 'workers': check_workers}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checks', nargs='*', help=f"Checks to run (default: all): {', '.join(CHECKS)}")
+    parser.add_argument('--child', help=argparse.SUPPRESS) # Child process mode
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    if args.child:
+        with tempfile.TemporaryDirectory() as tmp:
+            CHECKS[args.child](tmp)
+        return
+
+    failed = 0
+    for name in args.checks or CHECKS:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name], capture_output=True, text=True)
+        if child.returncode == 0:
+            print(f"[+] {name}")
+        else:
+            failed += 1
+            print(f"[!] {name} failed:\n{child.stderr or child.stdout}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# fleet.py
+# Builds a synthetic CandyPanel fleet: a CandyPanel.db plus matching WireGuard configs and server keys,
+# for benchmarking against the stub binaries in benchmarks/fakebin instead of a real WireGuard box.
+#
+#   python3 benchmarks/fleet.py --clients 10000 --out /tmp/fleet
+import argparse, base64, hashlib, json, os, random, sys
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Backend')
+FAKEBIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakebin')
+sys.path.insert(0, BACKEND_DIR)
+from db import SQLite
+
+PEERS_PER_INTERFACE = 250 # _new_client allocates from a /24, so real panels spread clients like this
+SESSION_TOKEN = 'bench-token'
+ADMIN_TELEGRAM_ID = 1
+TELEGRAM_ID_BASE = 100000
+
+def fake_key(seed: str) -> str:
+    return base64.b64encode(hashlib.sha256(seed.encode()).digest()).decode()
+
+def fleet_env(out_dir: str) -> dict:
+    """
+    Environment that points core.py at the fleet and puts the stub binaries first on PATH.
+    """
+    return dict(os.environ,
+                PATH=FAKEBIN_DIR + os.pathsep + os.environ.get('PATH', ''),
+                CANDY_WG_DIR=os.path.join(out_dir, 'wireguard'),
+                CANDY_DB_PATH=os.path.join(out_dir, 'CandyPanel.db'))
+
+def build_fleet(out_dir: str, clients: int, expired_ratio: float = 0.01, over_quota_ratio: float = 0.01,
+                bot_user_ratio: float = 0.5, seed: int = 1, spare_interfaces: int = 1) -> dict:
+    """
+    Writes 'clients' clients spread over /24 interfaces, plus 'spare_interfaces' empty interfaces for new clients.
+    A small share of clients is expired or over quota so _sync has something to disable.
+    Returns a summary with the names the benchmarks need.
+    """
+    rng = random.Random(seed)
+    wg_dir = os.path.join(out_dir, 'wireguard')
+    os.makedirs(wg_dir, exist_ok=True)
+    db = SQLite(os.path.join(out_dir, 'CandyPanel.db'))
+    for key, value in (('install', '1'), ('session_token', SESSION_TOKEN), ('custom_endpont', '203.0.113.1'),
+                       ('telegram_bot_admin_id', str(ADMIN_TELEGRAM_ID))):
+        db.update('settings', {'value': value}, {'key': key})
+
+    now = datetime.now()
+    interface_count = (clients + PEERS_PER_INTERFACE - 1) // PEERS_PER_INTERFACE + spare_interfaces # The last ones stay empty
+    interfaces, configs = [], []
+    for wg_id in range(interface_count):
+        private_key = fake_key(f"server-priv-{wg_id}")
+        public_key = fake_key(private_key)
+        address_range = f"10.{wg_id // 256}.{wg_id % 256}.1/24"
+        interfaces.append((wg_id, private_key, public_key, 51820 + wg_id, address_range, 1))
+        configs.append([f"[Interface]\nPrivateKey = {private_key}\nAddress = {address_range}\nListenPort = {51820 + wg_id}\n"])
+        for kind, key in (('private', private_key), ('public', public_key)):
+            with open(os.path.join(wg_dir, f"server_{kind}_wg{wg_id}.key"), 'w') as f:
+                f.write(key)
+
+    rows, users = [], []
+    for i in range(clients):
+        wg_id, host = divmod(i, PEERS_PER_INTERFACE)
+        name, public_key = f"client{i}", fake_key(f"client-pub-{i}")
+        address = f"10.{wg_id // 256}.{wg_id % 256}.{host + 2}"
+        roll = rng.random()
+        expires = now - timedelta(days=1) if roll < expired_ratio else now + timedelta(days=rng.randint(1, 90))
+        quota = 10 * 1024**3
+        used = quota if expired_ratio <= roll < expired_ratio + over_quota_ratio else rng.randrange(quota // 2)
+        used_trafic = json.dumps({'download': used, 'upload': 0, 'last_wg_rx': 0, 'last_wg_tx': 0})
+        rows.append((name, wg_id, public_key, fake_key(f"client-priv-{i}"), address, now.isoformat(),
+                     expires.isoformat(), '', str(quota), used_trafic))
+        configs[wg_id].append(f"\n[Peer]\n# {name}\nPublicKey = {public_key}\nAllowedIPs = {address}/32\n")
+        if rng.random() < bot_user_ratio:
+            users.append((TELEGRAM_ID_BASE + i, name, now.isoformat()))
+
+    db.conn.executemany("INSERT INTO `interfaces` (`wg`, `private_key`, `public_key`, `port`, `address_range`, `status`) "
+                        "VALUES (?,?,?,?,?,?)", interfaces)
+    db.conn.executemany("INSERT INTO `clients` (`name`, `wg`, `public_key`, `private_key`, `address`, `created_at`, "
+                        "`expires`, `note`, `traffic`, `used_trafic`) VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+    db.conn.executemany("INSERT INTO `users` (`telegram_id`, `candy_client_name`, `created_at`) VALUES (?,?,?)", users)
+    db.conn.commit()
+    db.close()
+    for wg_id, parts in enumerate(configs):
+        with open(os.path.join(wg_dir, f"wg{wg_id}.conf"), 'w') as f:
+            f.write(''.join(parts))
+
+    return {
+        'clients': clients,
+        'interfaces': interface_count,
+        'spare_interface': interface_count - 1,
+        'spare_interfaces': list(range(interface_count - spare_interfaces, interface_count)),
+        'sample_clients': [(row[0], row[2]) for row in rng.sample(rows, min(len(rows), 200))],
+        'telegram_ids': [user[0] for user in rng.sample(users, min(len(users), 200))],
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+    summary = build_fleet(args.out, args.clients)
+    print(f"{summary['clients']} clients on {summary['interfaces']} interfaces written to {args.out}")
+    print(f"Use: PATH={FAKEBIN_DIR}:$PATH CANDY_WG_DIR={os.path.join(args.out, 'wireguard')} "
+          f"CANDY_DB_PATH={os.path.join(args.out, 'CandyPanel.db')}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# run_suite.py
+# Times CandyPanel's hot paths and HTTP endpoints against synthetic fleets (see fleet.py) with the
+# stub wg/wg-quick/systemctl/ufw/sudo from benchmarks/fakebin on PATH, and compares against a baseline.
+# Each fleet size runs in its own process, since core.py reads CANDY_WG_DIR at import time.
+#
+#   python3 benchmarks/run_suite.py [--sizes 1000,10000] [--repeat 5] [--baseline benchmarks/baseline.json]
+#   python3 benchmarks/run_suite.py --save-baseline       # record the current numbers as the baseline
+#   CANDY_SERVER=asgi python3 benchmarks/run_suite.py     # the HTTP benchmarks through Quart instead of Flask
+# Exits 1 when a p50 is more than --tolerance slower than the baseline.
+import argparse, asyncio, contextlib, inspect, io, json, os, platform, random, statistics, subprocess, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+sys.path.insert(0, BENCH_DIR)
+import fleet
+
+def summarize(latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'n': len(latencies),
+        'ops': 1000 * len(latencies) / sum(latencies) if sum(latencies) else 0.0,
+        'p50': statistics.median(latencies),
+        'p99': latencies[max(0, int(len(latencies) * 0.99) - 1)],
+    }
+
+def measure(fn, repeat: int) -> list[float]:
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def run_size(size: int, repeat: int) -> dict:
+    """
+    Builds a fleet of 'size' clients in a scratch directory and times every benchmark against it.
+    Runs inside the per-size child process.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = fleet.build_fleet(tmp, size)
+        os.environ.update(fleet.fleet_env(tmp))
+        os.chdir(tmp) # _sync keeps reset.timer in the working directory
+        sys.path.insert(0, fleet.BACKEND_DIR)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main
+            main.start_services() # Quart starts them before serving, which the test client skips
+        panel, client = main.candy_panel, main.app.test_client()
+        auth = {'Authorization': f"Bearer {fleet.SESSION_TOKEN}"}
+        # Public pages take the key as a path segment, so skip base64 keys that contain '/'
+        samples = [sample for sample in summary['sample_clients'] if '/' not in sample[1]]
+        telegram_ids = summary['telegram_ids']
+        rng = random.Random(size)
+        # Quart's test client is async: drive every request through one event loop, as the server would
+        loop = asyncio.new_event_loop() if main.SERVER_MODE == 'asgi' else None
+
+        def http(method: str, path: str, **kwargs):
+            response = client.open(path, method=method, **kwargs)
+            if inspect.isawaitable(response):
+                response = loop.run_until_complete(response)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {path} -> {response.status_code}")
+
+        benchmarks = [
+            ('sync_first', 1, lambda i: panel._sync()), # Disables the expired/over-quota share
+            ('sync', repeat, lambda i: panel._sync()),
+            ('new_client', repeat * 4, lambda i: panel._new_client(f"bench-new-{i}", '2099-01-01T00:00:00', str(1024**3),
+                                                                    summary['spare_interface'])),
+            ('reload_interface', repeat, lambda i: panel._reload_wireguard(0)),
+            ('get_all_clients', repeat * 4, lambda i: panel._get_all_clients()),
+            ('http_api_data', repeat * 4, lambda i: http('GET', '/api/data', headers=auth)),
+            ('http_client_details', repeat * 20, lambda i: http('GET', '/client-details/%s/%s' % rng.choice(samples))),
+            ('http_qr', repeat * 20, lambda i: http('GET', '/qr/%s/%s' % rng.choice(samples))),
+            ('http_bot_account_status', repeat * 20, lambda i: http('POST', '/bot_api/user/account_status',
+                                                                     json={'telegram_id': rng.choice(telegram_ids)})),
+            ('http_bot_check_admin', repeat * 20, lambda i: http('POST', '/bot_api/admin/check_admin',
+                                                                  json={'telegram_id': fleet.ADMIN_TELEGRAM_ID})),
+            ('http_bot_admin_data', repeat * 4, lambda i: http('GET', '/bot_api/admin/data')),
+        ]
+        for name, count, fn in benchmarks:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[name] = summarize(measure(fn, count))
+        main.adb.close()
+        panel.db.close()
+        if loop:
+            loop.close()
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a line per benchmark whose p50 is more than 'tolerance' slower than the baseline.
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, stats in benchmarks.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if base and base['p50'] > 0 and stats['p50'] > base['p50'] * (1 + tolerance):
+                regressions.append(f"{size} clients / {name}: p50 {stats['p50']:.2f} ms vs baseline {base['p50']:.2f} ms "
+                                   f"(+{(stats['p50'] / base['p50'] - 1) * 100:.0f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000', help="Comma-separated fleet sizes, e.g. 1000,10000,100000")
+    parser.add_argument('--repeat', type=int, default=5, help="Base repetition count; cheap benchmarks run a multiple of it")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed p50 slowdown before failing (0.5 = 50%%)")
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS) # Child process mode
+    args = parser.parse_args()
+
+    if args.size:
+        print(json.dumps(run_size(args.size, args.repeat)))
+        return
+
+    results = {}
+    for size in [int(s) for s in args.sizes.split(',')]:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--size', str(size), '--repeat', str(args.repeat)],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            sys.exit(f"Benchmarks for {size} clients failed:\n{child.stderr}")
+        results[str(size)] = json.loads(child.stdout.strip().splitlines()[-1])
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    for size, benchmarks in results.items():
+        print(f"\n{size} clients ({os.environ.get('CANDY_SERVER', 'flask')} mode)")
+        print(f"  {'benchmark':<26} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'base p50':>10}")
+        for name, stats in benchmarks.items():
+            base = (baseline or {}).get('results', {}).get(size, {}).get(name)
+            base_p50 = f"{base['p50']:10.2f}" if base else f"{'-':>10}"
+            print(f"  {name:<26} {stats['ops']:10.1f} {stats['p50']:10.2f} {stats['p99']:10.2f} {base_p50}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': {'python': platform.python_version(), 'cpus': os.cpu_count(), 'platform': platform.platform()},
+                       'results': results}, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    elif baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+if __name__ == '__main__':
+    main()
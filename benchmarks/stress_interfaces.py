@@ -0,0 +1,147 @@
+# stress_interfaces.py
+# Concurrency stress check for the per-interface locks: several processes, each with several threads,
+# create, disable, re-enable and delete clients on a few interfaces while _sync, reloads and backups run,
+# all against a synthetic fleet with the stub binaries from benchmarks/fakebin (see fleet.py).
+# Afterwards every wgN.conf must list exactly the DB's active clients of that interface, with no duplicate
+# keys or addresses.
+#
+#   python3 benchmarks/stress_interfaces.py [--processes 3] [--threads 4] [--ops 30] [--interfaces 3]
+# Exits 1 when an operation raised or the configs and the database disagree.
+import argparse, contextlib, io, json, os, random, re, subprocess, sys, tempfile, threading, time, traceback
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import fleet
+
+def worker(out_dir: str, index: int, threads: int, ops: int, interfaces: list[int]) -> dict:
+    """
+    Runs in a child process: 'threads' threads share one CandyPanel, like request threads in one API worker.
+    """
+    sys.path.insert(0, fleet.BACKEND_DIR)
+    import core
+    panel = core.CandyPanel()
+    stats = {'ops': 0, 'refused': 0, 'errors': []}
+    stats_lock = threading.Lock()
+
+    def run(thread: int):
+        rng = random.Random(index * 1000 + thread)
+        mine = [] # (name, active)
+        for i in range(ops):
+            roll = rng.random()
+            try:
+                if roll < 0.45 or not mine:
+                    name = f"stress-{index}-{thread}-{i}"
+                    ok, _ = panel._new_client(name, '2099-01-01T00:00:00', str(1024**3), rng.choice(interfaces))
+                    if ok:
+                        mine.append([name, True])
+                elif roll < 0.7:
+                    entry = rng.choice(mine)
+                    ok, _ = panel._edit_client(entry[0], status=not entry[1])
+                    if ok:
+                        entry[1] = not entry[1]
+                elif roll < 0.85:
+                    entry = mine.pop(rng.randrange(len(mine)))
+                    ok, _ = panel._delete_client(entry[0])
+                elif roll < 0.93:
+                    panel._reload_wireguard(rng.choice(interfaces))
+                    ok = True
+                else:
+                    panel._sync()
+                    ok = True
+                with stats_lock:
+                    stats['ops'] += 1
+                    stats['refused'] += 0 if ok else 1
+            except Exception:
+                with stats_lock:
+                    stats['errors'].append(traceback.format_exc())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        pool = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+    panel.db.close()
+    return stats
+
+def check(out_dir: str) -> list[str]:
+    """
+    Compares every wgN.conf against the clients table and returns the inconsistencies found.
+    """
+    sys.path.insert(0, fleet.BACKEND_DIR)
+    from db import SQLite
+    db = SQLite(os.path.join(out_dir, 'CandyPanel.db'))
+    problems = []
+    for interface in db.select('interfaces'):
+        wg_id = interface['wg']
+        with open(os.path.join(out_dir, 'wireguard', f"wg{wg_id}.conf")) as f:
+            peers = re.findall(r"PublicKey\s*=\s*(\S+)\s*\nAllowedIPs\s*=\s*(\S+)", f.read())
+        keys = [key for key, _ in peers]
+        addresses = [address for _, address in peers]
+        if len(set(keys)) != len(keys):
+            problems.append(f"wg{wg_id}: duplicate peer keys in the config")
+        if len(set(addresses)) != len(addresses):
+            problems.append(f"wg{wg_id}: duplicate AllowedIPs in the config")
+        active = {client['public_key']: f"{client['address']}/32"
+                  for client in db.select('clients', where={'wg': wg_id, 'status': True})}
+        if dict(peers) != active:
+            missing, extra = set(active) - set(keys), set(keys) - set(active)
+            moved = {key for key in set(active) & set(keys) if active[key] != dict(peers)[key]}
+            problems.append(f"wg{wg_id}: {len(missing)} active clients missing from the config, "
+                            f"{len(extra)} peers without an active client, {len(moved)} with another address")
+    db.close()
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=4, help="Threads per process")
+    parser.add_argument('--ops', type=int, default=30, help="Operations per thread")
+    parser.add_argument('--interfaces', type=int, default=3, help="Empty interfaces the clients are spread over")
+    parser.add_argument('--clients', type=int, default=500, help="Existing clients, so _sync has real work")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS) # Child process mode
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    parser.add_argument('--spare', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        os.chdir(args.dir) # _sync keeps reset.timer in the working directory
+        spare = [int(wg_id) for wg_id in args.spare.split(',')]
+        print(json.dumps(worker(args.dir, args.worker, args.threads, args.ops, spare)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = fleet.build_fleet(tmp, args.clients, spare_interfaces=args.interfaces)
+        env = fleet.fleet_env(tmp)
+        env['CANDY_METRICS'] = '0'
+        spare = ','.join(str(wg_id) for wg_id in summary['spare_interfaces'])
+        start = time.perf_counter()
+        children = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', str(index), '--dir', tmp,
+                                      '--spare', spare, '--threads', str(args.threads), '--ops', str(args.ops)],
+                                     env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                    for index in range(args.processes)]
+        ops, refused, errors = 0, 0, []
+        for child in children:
+            out, err = child.communicate()
+            if child.returncode != 0:
+                errors.append(f"worker exited with {child.returncode}:\n{err}")
+                continue
+            stats = json.loads(out.strip().splitlines()[-1])
+            ops, refused, errors = ops + stats['ops'], refused + stats['refused'], errors + stats['errors']
+        elapsed = time.perf_counter() - start
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            problems = check(tmp)
+    print(f"{ops} operations from {args.processes} processes x {args.threads} threads in {elapsed:.1f}s "
+          f"({refused} refused, {len(errors)} raised)")
+    for error in errors[:5]:
+        print(error)
+    for problem in problems:
+        print(f"[!] {problem}")
+    if errors or problems:
+        sys.exit(1)
+    print("Configs and database agree.")
+
+if __name__ == '__main__':
+    main()
@@ -145,7 +145,7 @@ setup_permissions() {
 
     cat <<EOF | sudo tee "$SUDOERS_FILE" > /dev/null
 # Allow $CANDYPANEL_USER to manage WireGuard, UFW, systemctl, and cron for CandyPanel
-$CANDYPANEL_USER ALL=(ALL) NOPASSWD: /usr/bin/wg genkey, /usr/bin/wg pubkey, /usr/bin/wg show *, /usr/bin/wg syncconf *, /usr/bin/wg-quick up *, /usr/bin/wg-quick down *, /usr/bin/systemctl enable wg-quick@*, /usr/bin/systemctl start wg-quick@*, /usr/bin/systemctl stop wg-quick@*, /usr/sbin/ufw allow *, /usr/sbin/ufw delete *, /usr/bin/crontab
+$CANDYPANEL_USER ALL=(ALL) NOPASSWD: /usr/bin/wg genkey, /usr/bin/wg pubkey, /usr/bin/wg show *, /usr/bin/wg syncconf *, /usr/bin/wg-quick strip *, /usr/sbin/ip -o address show dev wg*, /usr/sbin/ip -o link show dev wg*, /usr/bin/wg-quick up *, /usr/bin/wg-quick down *, /usr/bin/systemctl enable wg-quick@*, /usr/bin/systemctl start wg-quick@*, /usr/bin/systemctl stop wg-quick@*, /usr/sbin/ufw allow *, /usr/sbin/ufw delete *, /usr/bin/crontab
 EOF
 
     sudo chmod 0440 "$SUDOERS_FILE" || { print_error "Failed to set permissions for sudoers file."; exit 1; }
@@ -234,7 +234,7 @@ deploy_backend() {
 
     print_info "Installing Python dependencies (Flask etc.)..."
     # Install netifaces with required build dependencies if needed
-    pip install pyrogram flask[async] requests flask_cors psutil httpx tgcrypto nanoid || { print_error "Failed to install Python dependencies."; exit 1; }
+    pip install pyrogram flask[async] requests flask_cors psutil httpx tgcrypto nanoid segno numpy quart quart-cors hypercorn || { print_error "Failed to install Python dependencies."; exit 1; }
     print_info "Attempting to install netifaces specifically, including build dependencies..."
     
     # Try installing netifaces with potential build dependencies for different distros
@@ -251,6 +251,35 @@ deploy_backend() {
     print_success "Python dependencies installed."
     sleep 1
 
+    print_info "Creating Systemd service file for the WireGuard helper..."
+    sudo tee "/etc/systemd/system/${PROJECT_NAME}_wg_helper.service" > /dev/null <<EOF
+[Unit]
+Description=Privileged WireGuard helper for ${PROJECT_NAME}
+After=network.target
+Before=${PROJECT_NAME}_flask.service
+
+[Service]
+User=root
+WorkingDirectory=$BACKEND_DIR
+RuntimeDirectory=candy-panel
+ExecStart=$BACKEND_DIR/venv/bin/python3 $BACKEND_DIR/wg_helper.py --socket /run/candy-panel/wg-helper.sock --group $LINUX_USER
+Restart=always
+RestartSec=5s
+
+[Install]
+WantedBy=multi-user.target
+EOF
+    print_success "WireGuard helper service file created."
+
+    # /metrics only answers with this token; kept in a root-only file so local users can't read it from the unit
+    METRICS_ENV_FILE="/etc/default/${PROJECT_NAME}_metrics"
+    if ! sudo grep -q '^CANDY_METRICS_TOKEN=.' "$METRICS_ENV_FILE" 2>/dev/null; then
+        print_info "Generating the /metrics token..."
+        echo "CANDY_METRICS_TOKEN=$(python3 -c 'import secrets; print(secrets.token_hex(24))')" | sudo tee "$METRICS_ENV_FILE" > /dev/null
+        sudo chmod 600 "$METRICS_ENV_FILE"
+        print_success "Metrics token saved to $METRICS_ENV_FILE. Scrape /metrics with 'Authorization: Bearer <token>'."
+    fi
+
     print_info "Creating Systemd service file for Flask..."
     sudo tee "/etc/systemd/system/${PROJECT_NAME}_flask.service" > /dev/null <<EOF
 [Unit]
@@ -264,6 +293,10 @@ WorkingDirectory=$BACKEND_DIR
 Environment="FLASK_APP=$FLASK_APP_ENTRY"
 Environment="FLASK_RUN_HOST=$BACKEND_HOST"
 Environment="FLASK_RUN_PORT=$BACKEND_PORT"
+Environment="CANDY_SERVER=asgi"
+Environment="CANDY_COLLECTOR_INTERVAL=10"
+Environment="CANDY_DB_GROUP_COMMIT=1"
+EnvironmentFile=$METRICS_ENV_FILE
 ExecStart=$BACKEND_DIR/venv/bin/python3 $FLASK_APP_ENTRY
 Restart=always
 RestartSec=5s
@@ -276,6 +309,8 @@ EOF
 
     print_info "Reloading Systemd daemon, enabling and starting Flask service..."
     sudo systemctl daemon-reload || { print_error "Failed to reload Systemd daemon."; exit 1; }
+    sudo systemctl enable "${PROJECT_NAME}_wg_helper.service" || print_warning "Failed to enable the WireGuard helper; the panel will fall back to sudo."
+    sudo systemctl start "${PROJECT_NAME}_wg_helper.service" || print_warning "Failed to start the WireGuard helper; the panel will fall back to sudo."
     sudo systemctl enable "${PROJECT_NAME}_flask.service" || { print_error "Failed to enable Flask service."; exit 1; }
     sudo systemctl enable cron
     sudo systemctl start "${PROJECT_NAME}_flask.service" || { print_error "Failed to start Flask service."; exit 1; }
@@ -413,6 +448,14 @@ uninstall_backend_service() {
         print_info "Systemd service file '/etc/systemd/system/$service_name' not found."
     fi
     
+    local helper_service="${PROJECT_NAME}_wg_helper.service"
+    if [ -f "/etc/systemd/system/$helper_service" ]; then
+        print_info "Stopping and removing WireGuard helper service: $helper_service..."
+        sudo systemctl disable --now "$helper_service" > /dev/null 2>&1 || print_warning "Failed to stop the WireGuard helper service."
+        sudo rm -f "/etc/systemd/system/$helper_service"
+        print_success "WireGuard helper service removed."
+    fi
+
     print_info "Reloading Systemd daemon..."
     sudo systemctl daemon-reload || { print_warning "Failed to reload Systemd daemon. This might not be critical for uninstallation."; }
     print_success "Systemd daemon reloaded."
@@ -636,6 +679,7 @@ run_update() {
     configure_frontend_api_url # This will rebuild the frontend
 
     print_info "--- Starting Services after Update ---"
+    sudo systemctl restart "${PROJECT_NAME}_wg_helper.service" || print_warning "WireGuard helper service is not installed or failed to restart; the panel will fall back to sudo."
     sudo systemctl start "${PROJECT_NAME}_flask.service" || { print_error "Failed to start Flask service after update."; exit 1; }
     print_success "Flask service started."
     print_info "You can check its status with: sudo systemctl status ${PROJECT_NAME}_flask.service"